@@ -8,65 +8,86 @@ from tqdm import tqdm
 import sys
 import copy
 import utils
-from Dataloader import skeleton_aug
+from Dataloader import skeleton_aug, skeleton_store, skeleton_streams, skeleton_archive
 from prepare import aug_tools
 
 class Sdata_generator:
     def __init__(self, data_level, label_level):
+        self.store_path = Path(F"C:/ML/dataset/HandGestureDataset_SHREC2017/{data_level}")
         self.data_path = Path(F"C:/ML/dataset/HandGestureDataset_SHREC2017/{data_level}_skeleton.pkl")
         self.label_path = Path(F"C:/ML/dataset/HandGestureDataset_SHREC2017/{data_level}_label_{label_level}.pkl")
+        self.data_level = data_level
+        self.label_level = label_level
         self.load_shrec_data()
 
     def load_shrec_data(self,):
+        if skeleton_store.store_exists(self.store_path):
+            # memory-mapped, samples are only paged in when touched
+            self.data = skeleton_store.SkeletonStore(self.store_path)
+            self.sample_name, self.label = self.data.names, self.data.labels(self.label_level)
+            return
+        if skeleton_archive.archive_exists(self.store_path):
+            # delta encoded archive, every sample is decoded when touched
+            self.data = skeleton_archive.SkeletonArchive(self.store_path)
+            self.sample_name, self.label = self.data.names, self.data.labels(self.label_level)
+            return
+
         with open(self.label_path, 'rb') as f:
             self.sample_name, self.label = pickle.load(f)
 
         with open(self.data_path, 'rb') as f:
             self.data = pickle.load(f)
 
-    def __call__(self, C, random_choose=False, center_choose=False, aug=False):
-        X_1, X_2, X_3 = [], [], []
+    def source_files(self):
+        if isinstance(self.data, skeleton_store.SkeletonStore):
+            return skeleton_store.store_paths(self.store_path)
+        if isinstance(self.data, skeleton_archive.SkeletonArchive):
+            return skeleton_archive.archive_paths(self.store_path)
+        return [self.data_path, self.label_path]
+
+    def cache_key(self, cache, C, mode, seed=None):
+        return cache.key(data_level=self.data_level, label_level=self.label_level, frame_l=C.frame_l,
+                         mode=mode, seed=seed, source=cache.source_hash(self.source_files()))
+
+    def load_cached(self, cache, key, C):
+        cached = cache.load(key)
+        if cached is None:
+            return False
+        self.streams = skeleton_streams.SkeletonStreams(cached['X'], cached['Y'], C)
+        return True
+
+    def __call__(self, C, random_choose=False, center_choose=False, aug=False, cache=None, seed=None):
+        if cache is not None:
+            mode = '{}_{}'.format('random' if random_choose else 'uniform', 'center' if center_choose else 'crop')
+            key = self.cache_key(cache, C, mode, seed)
+            if self.load_cached(cache, key, C):
+                return self.streams
         window_size= 150
-        Y = []
+        # written sample by sample into one float32 array instead of stacking a list at the end
+        X = np.empty((len(self.data), min(C.frame_l, window_size), C.joint_n, C.joint_d), dtype=np.float32)
+        Y = np.asarray(self.label, dtype=np.int64)
         for i in range(len(self.data)):
-            data_numpy = np.transpose(np.copy(self.data[i].squeeze(-1)),(1,2,0))
+            data_numpy = np.transpose(self.data[i].squeeze(-1),(1,2,0))
+            # a seeded build draws every sample's windows from its own stream
+            rng = None if seed is None else utils.sample_rng(seed, 0, i)
              # p.shape (frame,joint_num,joint_coords_dims)
-            label = self.label[i]
             # print('input', data_numpy.shape)
             # p = normalize_skeletons(p, 0)
             # p = utils.zoom(p, target_l=C.frame_l,
             #                joints_num=C.joint_n, joints_dim=C.joint_d)
-            if random_choose:
-                data_numpy = utils.random_sample_np(data_numpy, window_size)
-                # data_numpy = random_choose_simple(data_numpy, self.final_size)
-            else:
-                data_numpy = utils.uniform_sample_np(data_numpy, window_size)
-            if center_choose:
-                # data_numpy = uniform_sample_np(data_numpy, self.final_size)
-                data_numpy = utils.random_choose_simple(data_numpy, C.frame_l, center=True)
-            else:
-                data_numpy = utils.random_choose_simple(data_numpy, C.frame_l)
-
-            p = data_numpy
-
-            # print(p.shape)
+            data_numpy = utils.window_sequence(data_numpy, C.frame_l, window_size, random_choose, center_choose, rng)
 
-            # s = utils.decouple_spatial(p, C.hand_edge)
-            # s = utils.get_CG(p, C) # (b, l, 231)
-            # t = utils.decouple_temporal(p, 1)
-            # print(p.shape,p[:, 1, :].shape)
+            X[i] = data_numpy
 
-            X_1.append(p)
-            X_2.append(p)
-            X_3.append(p)
-            Y.append(label)
-
-        self.X_1 = np.stack(X_1)
-        self.X_2 = np.stack(X_2)
-        self.X_3 = np.stack(X_3)
+            # print(p.shape)
+        print('{}: built {}, peak RSS {} MB'.format(self.data_level, X.shape, utils.peak_rss_mb()))
 
-        self.Y = np.stack(Y)
-        return self.X_1, self.X_2, self.X_3, self.Y
+        # one joint array, bone / motion / JCD streams are derived on demand
+        self.streams = skeleton_streams.SkeletonStreams(X, Y, C)
+        if cache is not None:
+            cache.save(key, parts={'data_level': self.data_level, 'frame_l': C.frame_l},
+                       X=self.streams['joint'], Y=self.streams.label)
+        return self.streams
 
 
 class SConfig():
@@ -97,9 +118,9 @@ if __name__ == '__main__':
     #     print(p.shape)
     C = SConfig()
     data = Sdata_generator('train', 28)
-    x,y,z,l = data(C, True)
+    streams = data(C, True)
 
-    print(x.shape, l.shape)
+    print(streams['joint'].shape, streams['bone'].shape, streams.label.shape)
 
 
 
@@ -107,16 +107,15 @@ class Sdata_generator:
 
     # le is None to provide a unified interface with JHMDB datagenerator
     def __call__(self, T, C, aug=False):
-        X_1, X_2, X_3 = [], [], []
+        X_1, X_2 = [], []
 
         Y = []
+        # normalize first, then resample every sequence to frame_l at once
+        P = [normalize_skeletons(np.copy(T['pose'][i].reshape([-1, 22, 3])), 0) for i in range(len(T['pose']))]
+        P = utils.zoom_batch(P, target_l=C.frame_l)
         for i in tqdm(range(len(T['pose']))):
-            p = np.copy(T['pose'][i].reshape([-1, 22, 3]))
+            p = P[i]
             # p.shape (frame,joint_num,joint_coords_dims)
-            p = normalize_skeletons(p, 0)
-
-            p = zoom(p, target_l=C.frame_l,
-                     joints_num=C.joint_n, joints_dim=C.joint_d)
             # s = utils.decouple_spatial(p, C.hand_edge)
             # s = utils.get_CG(p, C) # (b, l, 231)
             # t = utils.decouple_temporal(p, 1)
@@ -127,7 +126,6 @@ class Sdata_generator:
 
             X_1.append(p)
             X_2.append(p)
-            X_3.append(p)
             Y.append(label)
 
             if aug is True:
@@ -145,13 +143,12 @@ class Sdata_generator:
 
                     X_1.append(skeleton)
                     X_2.append(p)
-                    X_3.append(p)
                     Y.append(label)
 
 
         self.X_1 = np.stack(X_1)
         self.X_2 = np.stack(X_2)
-        self.X_3 = np.stack(X_3)
+        self.X_3 = self.X_2  # same data as X_2, no need for a third copy
 
         self.Y = np.stack(Y)
         return self.X_1, self.X_2, self.X_3, self.Y
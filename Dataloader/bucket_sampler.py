@@ -0,0 +1,109 @@
+import numpy as np
+import torch
+from pathlib import Path
+from torch.utils.data import Dataset, Sampler
+
+import utils
+from Dataloader import skeleton_store
+
+
+class Sequence_Dataset(Dataset):
+    """Samples at their native length, no resampling to window_size / frame_l.
+
+    Sequences longer than max_len are thinned to max_len frames (uniform_sample_np), shorter ones
+    are left alone. Pair with BucketBatchSampler(dataset.lengths, ...) and pad_collate, so a batch
+    is only padded to its own longest sample.
+    """
+
+    def __init__(self, store, label_level, max_len=150):
+        if isinstance(store, (str, Path)):
+            store = skeleton_store.SkeletonStore(store)
+        self.data = store
+        self.label = store.labels(label_level)
+        self.max_len = max_len
+        # frames every sample comes out with, what the sampler buckets on
+        self.lengths = np.minimum(np.asarray(store.lengths, dtype=np.int64), max_len)
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, ind):
+        skeleton = self.data.sequence(ind)
+        if len(skeleton) > self.max_len:
+            skeleton = utils.uniform_sample_np(skeleton, self.max_len)
+        return torch.from_numpy(np.array(skeleton, dtype=np.float32)), self.label[ind]
+
+
+class BucketBatchSampler(Sampler):
+    '''
+    batches of samples with similar lengths
+
+    every epoch the samples are shuffled, cut into pools of bucket_size samples, each pool is
+    sorted by length and cut into batches, and the batch order is shuffled. bucket_size=None
+    sorts the whole split (tightest batches), a few dozen batches per pool keeps more randomness
+    in which samples meet.
+    '''
+
+    def __init__(self, lengths, batch_size, bucket_size=None, shuffle=True, drop_last=False, seed=1):
+        self.lengths = np.asarray(lengths, dtype=np.int64)
+        self.batch_size = batch_size
+        self.bucket_size = bucket_size or len(self.lengths)
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.seed = seed
+        self.epoch = 0
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def batches(self):
+        n = len(self.lengths)
+        rng = np.random.RandomState(self.seed + self.epoch)
+        order = rng.permutation(n) if self.shuffle else np.arange(n)
+        batches = []
+        for begin in range(0, n, max(self.bucket_size, 1)):
+            pool = order[begin:begin + self.bucket_size]
+            pool = pool[np.argsort(self.lengths[pool], kind='stable')]
+            for b in range(0, len(pool), self.batch_size):
+                batch = pool[b:b + self.batch_size]
+                if len(batch) == self.batch_size or not self.drop_last:
+                    batches.append(batch.tolist())
+        if self.shuffle:
+            batches = [batches[i] for i in rng.permutation(len(batches))]
+        return batches
+
+    def __iter__(self):
+        return iter(self.batches())
+
+    def __len__(self):
+        return len(self.batches())
+
+
+def pad_collate(batch):
+    '''
+    zero-pad a list of (T_i, V, C sequence, label) to the longest T_i of the batch
+    :return: B, T, V, C float tensor, B, T bool mask (True on real frames), B labels
+    '''
+    lengths = torch.tensor([len(skeleton) for skeleton, _ in batch])
+    first = torch.as_tensor(batch[0][0])
+    data = first.new_zeros((len(batch), int(lengths.max()),) + tuple(first.shape[1:]))
+    for i, (skeleton, _) in enumerate(batch):
+        data[i, :len(skeleton)] = torch.as_tensor(skeleton)
+    mask = torch.arange(data.shape[1]).unsqueeze(0) < lengths.unsqueeze(1)
+    label = torch.as_tensor([label for _, label in batch])
+    return data, mask, label
+
+
+if __name__ == '__main__':
+    import sys
+    from torch.utils.data import DataLoader
+    root = 'C:/ML/dataset/HandGestureDataset_SHREC2017/'
+    dataset = Sequence_Dataset(Path(sys.argv[1] if len(sys.argv) > 1 else root) / 'val', 14)
+    for name, sampler in (('random', BucketBatchSampler(dataset.lengths, 32, bucket_size=32)),
+                          ('bucketed', BucketBatchSampler(dataset.lengths, 32))):
+        padded = real = 0
+        for data, mask, label in DataLoader(dataset, batch_sampler=sampler, collate_fn=pad_collate):
+            padded += mask.numel()
+            real += int(mask.sum())
+        print('{}: {} frames in batches, {} real ({:.1f}% padding), vs {} at a fixed {} frames'.format(
+            name, padded, real, 100. * (padded - real) / padded, len(dataset) * dataset.max_len, dataset.max_len))
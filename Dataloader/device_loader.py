@@ -0,0 +1,73 @@
+import torch
+from torch.utils.data import TensorDataset
+
+
+class DeviceLoader:
+    """Epoch iterator over tensors that live on the training device, no DataLoader involved.
+
+    X and Y are copied to the device once. Every epoch shuffles with an on-device permutation and
+    yields index-gathered (data, target) batches, optionally through a batched augmentation
+    (e.g. Hand_Dataset.batch_aug, called as augment(data, generator)) that runs on the device as
+    well, drawing from the seeded generator. For splits that fit in device
+    memory (the SHREC train split at frame_l=120 is tens of MB) there is no host side work left
+    per batch. Drop-in for train()/test(): len() is the number of batches and .dataset the samples.
+    With lengths and a temporal sampler (Dataloader/temporal_sampler.py), X holds the zero-padded
+    full-length sequences and every batch gets a fresh frame window, gathered on the device.
+    """
+
+    def __init__(self, X, Y, batch_size, device, shuffle=True, drop_last=False, augment=None, seed=None,
+                 lengths=None, temporal=None):
+        self.X = torch.as_tensor(X).to(device, torch.float32)
+        self.Y = torch.as_tensor(Y).to(device)
+        if len(self.X) != len(self.Y):
+            raise ValueError('X and Y have different lengths ({}, {})'.format(len(self.X), len(self.Y)))
+        self.lengths = None if lengths is None else torch.as_tensor(lengths).to(device)
+        self.temporal = temporal
+        self.dataset = TensorDataset(self.X, self.Y)
+        self.batch_size = batch_size
+        self.device = torch.device(device)
+        self.shuffle = shuffle
+        self.drop_last = drop_last
+        self.augment = augment
+        self.generator = None
+        if seed is not None:
+            self.generator = torch.Generator(device=self.device)
+            self.generator.manual_seed(seed)
+
+    @classmethod
+    def from_dataset(cls, dataset, batch_size, device, **kwargs):
+        # the tensors of an in-memory Hand_Dataset, with its batch_aug when it augments
+        if dataset.use_data_aug:
+            kwargs.setdefault('augment', dataset.batch_aug)
+        return cls(dataset.data, dataset.label, batch_size, device, **kwargs)
+
+    def __len__(self):
+        if self.drop_last:
+            return len(self.X) // self.batch_size
+        return (len(self.X) + self.batch_size - 1) // self.batch_size
+
+    def __iter__(self):
+        n = len(self.X)
+        if self.shuffle:
+            order = torch.randperm(n, device=self.device, generator=self.generator)
+        else:
+            order = torch.arange(n, device=self.device)
+        for b in range(len(self)):
+            index = order[b * self.batch_size:(b + 1) * self.batch_size]
+            data = self.X.index_select(0, index)
+            if self.temporal is not None:
+                data = self.temporal(data, self.lengths.index_select(0, index))
+            if self.augment is not None:
+                data = self.augment(data, self.generator)
+            yield data, self.Y.index_select(0, index)
+
+
+if __name__ == '__main__':
+    import time
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    X, Y = torch.randn(5000, 120, 22, 3), torch.randint(0, 14, (5000,))
+    loader = DeviceLoader(X, Y, 128, device, seed=1)
+    for epoch in range(3):
+        start = time.time()
+        seen = sum(len(data) for data, target in loader)
+        print('epoch {}: {} samples in {} batches, {:.3f}s'.format(epoch, seen, len(loader), time.time() - start))
@@ -0,0 +1,94 @@
+import time
+import torch
+
+from Dataloader.skeleton_loader import augment_batch
+
+
+class EchoLoader:
+    """Data echoing: every batch the wrapped loader produces is used echo times.
+
+    The batch is moved to the device once. Repeats after the first go through augment
+    (augment_batch by default, called as augment(data, generator) and drawn fresh for every repeat
+    on the device, from a generator seeded with seed), so the model doesn't see the same tensor
+    twice. Meant for loader-bound runs (CPU augmentation feeding a small
+    model): echo times the optimizer steps per loaded batch.
+
+    Time spent waiting on the wrapped loader and time spent by the consumer between batches (its
+    whole loop body, host side) are both recorded, report() gives the balance. If the loader
+    share stays high, raise echo. Once it is near 0, more echoing only repeats data. On CUDA the
+    device time of each step is taken with event pairs that are only read once they completed
+    (or in report()), the host never waits on the device for the bookkeeping, so the next fetch
+    and its non_blocking copy still overlap with the step.
+    """
+
+    def __init__(self, loader, echo, device, augment=augment_batch, seed=None):
+        if echo < 1:
+            raise ValueError('echo must be >= 1 (got {})'.format(echo))
+        self.loader = loader
+        self.echo = echo
+        self.device = torch.device(device)
+        self.augment = augment
+        self.generator = None
+        if seed is not None:
+            self.generator = torch.Generator(device=self.device)
+            self.generator.manual_seed(seed)
+        self.reset()
+
+    def reset(self):
+        self.loader_time = 0.
+        self.consumer_time = 0.
+        self.device_time = 0.
+        self.events = []
+        self.loaded = 0
+        self.steps = 0
+
+    @property
+    def dataset(self):
+        return self.loader.dataset
+
+    def __len__(self):
+        return len(self.loader) * self.echo
+
+    def _event(self):
+        event = torch.cuda.Event(enable_timing=True)
+        event.record(torch.cuda.current_stream(self.device))
+        return event
+
+    def _resolve(self, wait=False):
+        # add up the device time of the steps whose events completed, all of them with wait
+        while self.events and (wait or self.events[0][1].query()):
+            begin, end = self.events.pop(0)
+            end.synchronize()
+            self.device_time += begin.elapsed_time(end) / 1000.
+
+    def __iter__(self):
+        batches = iter(self.loader)
+        while True:
+            start = time.perf_counter()
+            try:
+                data, target = next(batches)
+            except StopIteration:
+                return
+            data = data.to(self.device, non_blocking=True)
+            target = target.to(self.device, non_blocking=True)
+            self.loader_time += time.perf_counter() - start
+            self.loaded += 1
+            for repeat in range(self.echo):
+                start = time.perf_counter()
+                begin = self._event() if self.device.type == 'cuda' else None
+                batch = data if repeat == 0 or self.augment is None else self.augment(data, self.generator)
+                yield batch, target
+                if begin is not None:
+                    self.events.append((begin, self._event()))
+                    self._resolve()
+                self.consumer_time += time.perf_counter() - start
+                self.steps += 1
+
+    def report(self):
+        self._resolve(wait=True)
+        total = self.loader_time + self.consumer_time
+        device = ', device {:.2f}s'.format(self.device_time) if self.device.type == 'cuda' else ''
+        return ('echo {}: {} loaded batches -> {} steps, loader {:.2f}s, consumer loop {:.2f}s{} '
+                '(loader share {:.0f}%), {:.1f} steps per loader second').format(
+            self.echo, self.loaded, self.steps, self.loader_time, self.consumer_time, device,
+            100. * self.loader_time / max(total, 1e-9), self.steps / max(self.loader_time, 1e-9))
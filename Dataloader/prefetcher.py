@@ -0,0 +1,130 @@
+import queue
+import threading
+import torch
+
+
+def _map_tensors(batch, fn):
+    # apply fn to every tensor of a (nested tuple/list of) batch
+    if torch.is_tensor(batch):
+        return fn(batch)
+    if isinstance(batch, (tuple, list)):
+        return type(batch)(_map_tensors(b, fn) for b in batch)
+    return batch
+
+
+class _Raised:
+    # an exception of the loader thread, raised again in the consumer
+    def __init__(self, error):
+        self.error = error
+
+
+_DONE = object()
+
+
+class DevicePrefetcher:
+    """Wraps any loader so batches arrive on the device ahead of the step that needs them.
+
+    A background thread takes batches from the loader and stages up to depth of them (in pinned
+    memory when the device is CUDA). The host to device copy of the next batch is issued on a side
+    CUDA stream before the current batch is handed out, so it overlaps the current step. On a
+    CPU-only host it is just the background thread, the loader still runs ahead of the step.
+    The training loops' data.to(device) is then a no-op. len() and .dataset pass through.
+    """
+
+    def __init__(self, loader, device, depth=2):
+        self.loader = loader
+        self.device = torch.device(device)
+        self.depth = max(depth, 1)
+        self.cuda = self.device.type == 'cuda' and torch.cuda.is_available()
+
+    @property
+    def dataset(self):
+        return self.loader.dataset
+
+    def __len__(self):
+        return len(self.loader)
+
+    def _produce(self, staged, stop):
+        def put(item):
+            while not stop.is_set():
+                try:
+                    staged.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    pass
+            return False
+
+        try:
+            for batch in self.loader:
+                if self.cuda:
+                    batch = _map_tensors(batch, lambda t: t if t.is_pinned() else t.pin_memory())
+                if not put(batch):
+                    return
+        except Exception as error:
+            put(_Raised(error))
+            return
+        put(_DONE)
+
+    def _take(self, staged):
+        item = staged.get()
+        if isinstance(item, _Raised):
+            raise item.error
+        return item
+
+    def __iter__(self):
+        staged = queue.Queue(maxsize=self.depth)
+        stop = threading.Event()
+        thread = threading.Thread(target=self._produce, args=(staged, stop), daemon=True)
+        thread.start()
+        stream = torch.cuda.Stream(self.device) if self.cuda else None
+
+        def copy(batch):
+            if batch is _DONE:
+                return batch
+            if stream is None:
+                return _map_tensors(batch, lambda t: t.to(self.device))
+            with torch.cuda.stream(stream):
+                return _map_tensors(batch, lambda t: t.to(self.device, non_blocking=True))
+
+        try:
+            ready = copy(self._take(staged))
+            while ready is not _DONE:
+                if stream is not None:
+                    # the step waits for its batch's copy, and the caching allocator must not hand
+                    # the memory back to the side stream while the step still uses it
+                    torch.cuda.current_stream(self.device).wait_stream(stream)
+                    _map_tensors(ready, lambda t: t.record_stream(torch.cuda.current_stream(self.device)))
+                current = ready
+                # start the next copy before the step runs
+                try:
+                    ready = copy(self._take(staged))
+                except Exception:
+                    # the loader failed on the next batch, still hand out this one first
+                    yield current
+                    raise
+                yield current
+        finally:
+            stop.set()
+            thread.join()
+
+
+if __name__ == '__main__':
+    import time
+    from torch.utils.data import DataLoader, TensorDataset
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+    class Slow(TensorDataset):
+        def __getitem__(self, i):
+            time.sleep(0.0005)
+            return super(Slow, self).__getitem__(i)
+
+    loader = DataLoader(Slow(torch.randn(2048, 120, 22, 3), torch.randint(0, 14, (2048,))), batch_size=64)
+
+    def epoch(batches):
+        start = time.time()
+        for data, target in batches:
+            data, target = data.to(device), target.to(device)
+            time.sleep(0.03)  # the step
+        return time.time() - start
+
+    print('plain loader {:.2f}s, prefetched {:.2f}s'.format(epoch(loader), epoch(DevicePrefetcher(loader, device))))
@@ -0,0 +1,148 @@
+import numpy as np
+from pathlib import Path
+
+from Dataloader import skeleton_store
+
+
+META_SUFFIX = '.meta.npz'
+COLUMNS = ('gesture', 'finger', 'subject', 'essai', 'length', 'label_14', 'label_28')
+
+
+def meta_path(path):
+    path = Path(path)
+    return path.with_name(path.name + META_SUFFIX)
+
+
+class SampleIndex:
+    """Columnar metadata of a split, one int64 array per column (see COLUMNS), row i is sample i.
+
+    query(subject=3, length__gt=80) style filters, leave-one-subject-out splits and stratified
+    subsets are all array operations and return row numbers, ready for torch.utils.data.Subset
+    or Sdata_generator data.
+    """
+
+    OPS = {'eq': np.equal, 'ne': np.not_equal, 'lt': np.less, 'le': np.less_equal,
+           'gt': np.greater, 'ge': np.greater_equal}
+
+    def __init__(self, **columns):
+        missing = set(COLUMNS) - set(columns)
+        if missing:
+            raise ValueError('missing columns {}'.format(sorted(missing)))
+        self.columns = {name: np.asarray(columns[name], dtype=np.int64) for name in COLUMNS}
+
+    @classmethod
+    def from_names(cls, names, lengths, labels_14, labels_28):
+        # "{g}_{f}_{sub}_{e}" names, -1 for names that don't follow it
+        ids = np.full((len(names), 4), -1, dtype=np.int64)
+        for i, name in enumerate(names):
+            parts = str(name).split('_')
+            if len(parts) == 4 and all(p.isdigit() for p in parts):
+                ids[i] = [int(p) for p in parts]
+        return cls(gesture=ids[:, 0], finger=ids[:, 1], subject=ids[:, 2], essai=ids[:, 3],
+                   length=lengths, label_14=labels_14, label_28=labels_28)
+
+    @classmethod
+    def from_store(cls, store):
+        # the saved .meta.npz when it is newer than the store index, parsed from the names otherwise
+        if not hasattr(store, 'names'):
+            store = skeleton_store.SkeletonStore(store)
+        path = meta_path(store.path)
+        if path.exists() and path.stat().st_mtime_ns >= store.index_path.stat().st_mtime_ns:
+            index = cls.load(path)
+            if len(index) == len(store):
+                return index
+        return cls.from_names(store.names, store.lengths, store.label_14, store.label_28)
+
+    @classmethod
+    def from_split_file(cls, split_file):
+        # train_gestures.txt / test_gestures.txt: g f sub e label_14 label_28 size_seq
+        fields = np.loadtxt(split_file, dtype=np.int64, ndmin=2).reshape(-1, 7)
+        return cls(gesture=fields[:, 0], finger=fields[:, 1], subject=fields[:, 2], essai=fields[:, 3],
+                   length=fields[:, 6], label_14=fields[:, 4] - 1, label_28=fields[:, 5] - 1)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as meta:
+            return cls(**{name: meta[name] for name in COLUMNS})
+
+    def save(self, path):
+        # store prefix (writes <path>.meta.npz) or an explicit .npz path
+        path = Path(path)
+        if path.suffix != '.npz':
+            path = meta_path(path)
+        np.savez(path, **self.columns)
+        return path
+
+    def __len__(self):
+        return len(self.columns['gesture'])
+
+    def __getattr__(self, name):
+        columns = self.__dict__.get('columns', {})
+        if name in columns:
+            return columns[name]
+        raise AttributeError(name)
+
+    def mask(self, **conditions):
+        '''
+        boolean row mask of every condition combined with and
+        :param conditions: column=value, column__in=[values] or column__<op>=value with op one of
+                           eq, ne, lt, le, gt, ge, e.g. subject=3, length__gt=80, label_14__in=[0, 1]
+        '''
+        keep = np.ones(len(self), dtype=bool)
+        for key, value in conditions.items():
+            name, _, op = key.partition('__')
+            if name not in self.columns:
+                raise KeyError('unknown column {} (expected one of {})'.format(name, COLUMNS))
+            column = self.columns[name]
+            if op == 'in':
+                keep &= np.isin(column, value)
+            elif op in self.OPS or not op:
+                keep &= self.OPS[op or 'eq'](column, value)
+            else:
+                raise ValueError('unknown operator {} in {}'.format(op, key))
+        return keep
+
+    def query(self, **conditions):
+        # row numbers matching every condition, e.g. query(subject=3, length__gt=80)
+        return np.flatnonzero(self.mask(**conditions))
+
+    def subjects(self):
+        return np.unique(self.columns['subject'])
+
+    def loso(self, subject):
+        # leave one subject out: (train rows, test rows)
+        test = self.columns['subject'] == subject
+        return np.flatnonzero(~test), np.flatnonzero(test)
+
+    def loso_folds(self):
+        for subject in self.subjects():
+            yield (subject,) + self.loso(subject)
+
+    def stratified(self, fraction, label_level=14, rows=None, seed=1):
+        '''
+        random subset keeping round(fraction * n) samples of every class (at least one)
+        :param rows: restrict the subset to these rows (e.g. the train rows of a loso fold)
+        :return: sorted row numbers
+        '''
+        rows = np.arange(len(self)) if rows is None else np.asarray(rows)
+        labels = self.columns['label_{}'.format(label_level)][rows]
+        rng = np.random.RandomState(seed)
+        order = rng.permutation(len(rows))
+        order = order[np.argsort(labels[order], kind='stable')]
+        sorted_labels = labels[order]
+        # rank of every sample inside its class, in the shuffled order
+        starts = np.searchsorted(sorted_labels, sorted_labels, side='left')
+        rank = np.arange(len(order)) - starts
+        classes, counts = np.unique(sorted_labels, return_counts=True)
+        quota = np.maximum(np.rint(counts * fraction), 1).astype(np.int64)
+        keep = rank < quota[np.searchsorted(classes, sorted_labels)]
+        return np.sort(rows[order[keep]])
+
+
+if __name__ == '__main__':
+    import sys
+    root = 'C:/ML/dataset/HandGestureDataset_SHREC2017/'
+    for data_level in (sys.argv[1:] or ['aug4_train', 'val']):
+        index = SampleIndex.from_store(Path(root) / data_level)
+        print(data_level, len(index), 'samples, subjects', index.subjects(),
+              'subject 3 & length > 80:', len(index.query(subject=3, length__gt=80)))
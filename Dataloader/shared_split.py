@@ -0,0 +1,240 @@
+import os
+import json
+import tempfile
+import contextlib
+import numpy as np
+import torch
+from pathlib import Path
+from multiprocessing import shared_memory, resource_tracker
+
+from Dataloader.skeleton_loader import Hand_Dataset, Sdata_generator
+
+
+# Named shared memory segment holding processed split tensors, e.g. train_X / train_Y / val_X / val_Y
+#   [0:8)    reference count, int64 (changed under a file lock, see _lock)
+#   [8:16)   length of the JSON header
+#   [16:..)  JSON header: [key, dtype, shape, byte offset] of every array
+#   arrays back to back, 64 byte aligned, offsets counted from the first aligned byte after the header
+# The first process to ask builds the arrays and publishes them, every later one (other trials,
+# parallel runs) attaches and maps the same pages. The segment is removed when the last
+# attached process closes it. A process that dies without closing leaves the count up, the
+# segment then stays until unlink(name) (or a reboot).
+ALIGN = 64
+HEADER = 16
+
+
+@contextlib.contextmanager
+def _lock(name):
+    # one lock file per segment name, held while the segment is created, attached or released
+    path = Path(tempfile.gettempdir()) / '{}.lock'.format(name)
+    with open(path, 'a+b') as f:
+        if os.name == 'nt':
+            import msvcrt
+            f.seek(0)
+            msvcrt.locking(f.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                f.seek(0)
+                msvcrt.locking(f.fileno(), msvcrt.LK_UNLCK, 1)
+        else:
+            import fcntl
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+
+def _open(name, create=False, size=0):
+    shm = shared_memory.SharedMemory(name=name, create=create, size=size)
+    # the reference count decides when the segment goes away, not the resource tracker (which
+    # would unlink it as soon as the process that created or attached it exits)
+    if os.name != 'nt':
+        resource_tracker.unregister(shm._name, 'shared_memory')
+    return shm
+
+
+def _unlink(shm):
+    # SharedMemory.unlink unregisters from the tracker again, give it the entry _open took away
+    if os.name != 'nt':
+        resource_tracker.register(shm._name, 'shared_memory')
+    shm.unlink()
+
+
+class SharedSplit:
+    """Arrays of a named shared memory segment, see publish / attach / attach_or_publish.
+
+    arrays[key] are numpy views of the segment, tensor(key) a torch tensor on the same memory
+    (no copy either way). close() drops this process' reference. Pickling only carries the
+    name: DataLoader workers (and anything else that unpickles it) map the segment again without
+    taking a reference of their own, so they must not outlive the process that holds one.
+    """
+
+    def __init__(self, name, shm, owned=True):
+        self.name = name
+        self.shm = shm
+        self.owned = owned
+        header_len = int(np.frombuffer(shm.buf, dtype=np.int64, count=1, offset=8)[0])
+        header = json.loads(bytes(shm.buf[HEADER:HEADER + header_len]).decode('utf-8'))
+        begin = _aligned(HEADER + header_len)
+        self.arrays = {key: np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=begin + offset)
+                       for key, dtype, shape, offset in header}
+
+    def tensor(self, key):
+        return torch.from_numpy(self.arrays[key])
+
+    def __getitem__(self, key):
+        return self.arrays[key]
+
+    def keys(self):
+        return self.arrays.keys()
+
+    def refcount(self):
+        return int(np.frombuffer(self.shm.buf, dtype=np.int64, count=1)[0])
+
+    def close(self):
+        if self.shm is None:
+            return
+        shm, self.shm, self.arrays = self.shm, None, {}
+        if self.owned:
+            with _lock(self.name):
+                count = np.frombuffer(shm.buf, dtype=np.int64, count=1)
+                count[0] -= 1
+                last = count[0] <= 0
+                del count
+                if last:
+                    _unlink(shm)
+        try:
+            shm.close()
+        except BufferError:
+            # tensors/views handed out are still alive, the mapping goes with the last of them
+            pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __getstate__(self):
+        return {'name': self.name}
+
+    def __setstate__(self, state):
+        self.__init__(state['name'], _open(state['name']), owned=False)
+
+
+def _aligned(n):
+    return (n + ALIGN - 1) // ALIGN * ALIGN
+
+
+def _publish(name, arrays):
+    arrays = {key: np.ascontiguousarray(value.numpy() if torch.is_tensor(value) else value)
+              for key, value in arrays.items()}
+    header, size = [], 0
+    for key, value in arrays.items():
+        header.append([key, value.dtype.str, list(value.shape), size])
+        size += _aligned(value.nbytes)
+    encoded = json.dumps(header).encode('utf-8')
+    begin = _aligned(HEADER + len(encoded))
+
+    shm = _open(name, create=True, size=begin + max(size, 1))
+    np.frombuffer(shm.buf, dtype=np.int64, count=2)[:] = (1, len(encoded))
+    shm.buf[HEADER:HEADER + len(encoded)] = encoded
+    for (key, dtype, shape, offset), value in zip(header, arrays.values()):
+        np.ndarray(shape, dtype=np.dtype(dtype), buffer=shm.buf, offset=begin + offset)[...] = value
+    return SharedSplit(name, shm)
+
+
+def _attach(name):
+    shm = _open(name)
+    np.frombuffer(shm.buf, dtype=np.int64, count=1)[0] += 1
+    return SharedSplit(name, shm)
+
+
+def publish(name, **arrays):
+    # a new segment holding arrays (numpy arrays or cpu tensors), FileExistsError if name is taken
+    with _lock(name):
+        return _publish(name, arrays)
+
+
+def attach(name):
+    # a reference to an existing segment, FileNotFoundError if nobody published it
+    with _lock(name):
+        return _attach(name)
+
+
+def attach_or_publish(name, build):
+    '''
+    attach to the segment, or build and publish it when it doesn't exist yet
+    :param build: called without arguments, returns the dict of arrays (or tensors) to publish;
+                  it runs under the lock, so processes starting together wait for one build
+    '''
+    with _lock(name):
+        try:
+            return _attach(name)
+        except FileNotFoundError:
+            return _publish(name, build())
+
+
+def unlink(name):
+    # remove a segment whatever its reference count, e.g. left behind by a crashed run
+    with _lock(name):
+        try:
+            shm = _open(name)
+        except FileNotFoundError:
+            return False
+        _unlink(shm)
+        shm.close()
+        return True
+
+
+def split_name(data_level, label_level, frame_l, seed=None):
+    # the seed is part of the name, runs with different seeds must not map each other's split
+    name = 'shrec_{}_{}_{}'.format(data_level, label_level, frame_l)
+    return name if seed is None else '{}_s{}'.format(name, seed)
+
+
+def build_splits(train_level, test_level, label_level, C, cache=None, seed=None):
+    # the arrays attach_or_publish shares: joint tensors and labels of a train and a test split
+    train_streams = Sdata_generator(train_level, label_level)(C, cache=cache, seed=seed)
+    test_streams = Sdata_generator(test_level, label_level)(C, cache=cache, seed=seed)
+    return {'train_X': train_streams['joint'], 'train_Y': train_streams.label,
+            'val_X': test_streams['joint'], 'val_Y': test_streams.label}
+
+
+def shared_splits(train_level, test_level, label_level, C, cache=None, seed=None):
+    # train/val arrays of Sdata_generator, built by the first process and shared with the rest
+    name = split_name('{}_{}'.format(train_level, test_level), label_level, C.frame_l, seed)
+    return attach_or_publish(name, lambda: build_splits(train_level, test_level, label_level, C, cache, seed))
+
+
+class Shared_Dataset(Hand_Dataset):
+    """Hand_Dataset over the tensors of a SharedSplit.
+
+    Pickles without the tensors, DataLoader workers map the segment again instead of receiving
+    a copy of the split.
+    """
+
+    def __init__(self, split, part, time_len, use_data_aug, seed=None, batched=False):
+        self.split = split
+        self.part = part
+        super(Shared_Dataset, self).__init__(split.tensor(part + '_X'), split.tensor(part + '_Y'),
+                                             time_len, use_data_aug, seed, batched)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['data'], state['label']
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.data = self.split.tensor(self.part + '_X')
+        self.label = self.split.tensor(self.part + '_Y')
+
+
+if __name__ == '__main__':
+    import sys
+    if sys.argv[1:2] == ['--unlink']:
+        for name in sys.argv[2:]:
+            print(name, 'removed' if unlink(name) else 'not found')
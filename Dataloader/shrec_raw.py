@@ -0,0 +1,89 @@
+import os
+import numpy as np
+from pathlib import Path
+
+from Dataloader import skeleton_store
+from prepare.shrec.gendata import read_skeleton, gesture_path
+from prepare.shrec.normalize_skeletons import normalize_skeletons
+from prepare.shrec.validate_skeletons import validate_skeletons, format_report, POLICIES
+
+
+class RawSplit:
+    """A SHREC split read straight from the dataset tree, no gendata step needed.
+
+    Lines of train_gestures.txt / test_gestures.txt give the samples and labels. Each
+    skeletons_world.txt is parsed, validated and normalized the first time it is asked for, like
+    the gendata ingest does it (validate_skeletons with policy), and saved as one .npy per sample
+    under cache_dir, later reads memory-map that file instead. A cache entry older than its source
+    file is rebuilt. Has the sequence/labels/names interface of SkeletonStore, so it plugs into
+    Store_Dataset (and DataLoader workers) as is. A sample the policy drops can't leave the split,
+    reading it raises ValueError.
+    """
+
+    def __init__(self, root, split_file='train_gestures.txt', cache_dir=None, policy='repair'):
+        if policy not in POLICIES:
+            raise ValueError('policy must be one of {} (got {})'.format(POLICIES, policy))
+        self.root = Path(root)
+        self.policy = policy
+        self.cache_dir = Path(cache_dir) if cache_dir else self.root / 'raw_cache'
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        lines = [line.rstrip() for line in open(self.root / split_file, 'r').readlines() if line.strip()]
+        fields = np.array([list(map(int, line.split(" "))) for line in lines], dtype=np.int64).reshape(-1, 7)
+        self.src_paths = [gesture_path(str(self.root), line) for line in lines]
+        self.names = np.array(["{}_{}_{}_{}".format(*f[:4]) for f in fields], dtype=str)
+        self.label_14 = fields[:, 4] - 1
+        self.label_28 = fields[:, 5] - 1
+        # size_seq of the split file, frames per sample (what BucketBatchSampler buckets on)
+        self.lengths = fields[:, 6]
+
+    def __len__(self):
+        return len(self.src_paths)
+
+    def cache_path(self, i):
+        # per policy, repair and report keep different frames
+        return self.cache_dir / '{}.{}.npy'.format(self.names[i], self.policy)
+
+    def sequence(self, i):
+        # T, V, C
+        cache_path = self.cache_path(i)
+        try:
+            if cache_path.stat().st_mtime_ns >= os.stat(self.src_paths[i]).st_mtime_ns:
+                return np.load(cache_path, mmap_mode='r')
+        except (OSError, ValueError):
+            pass
+        skeletons, num_frame = read_skeleton(self.src_paths[i])
+        coords, offsets, lengths, keep, report = validate_skeletons(skeletons[0], [0], [len(skeletons[0])],
+                                                                    policy=self.policy)
+        if not keep[0]:
+            raise ValueError('{} is dropped by validate_skeletons:\n{}'.format(
+                self.src_paths[i], format_report(report, [str(self.names[i])])))
+        skeletons = normalize_skeletons(np.array(coords[offsets[0]:offsets[0] + lengths[0]])[np.newaxis],
+                                        origin=0, base_bone=[0, 10])
+        seq = skeleton_store.to_sequence(skeletons)
+        # several workers may parse the same file, the last rename wins and every copy is identical
+        tmp = cache_path.with_name('{}.{}.tmp{}.npy'.format(self.names[i], self.policy, os.getpid()))
+        np.save(tmp, seq)
+        os.replace(tmp, cache_path)
+        return seq
+
+    def __getitem__(self, i):
+        # C, T, V, M
+        return np.transpose(self.sequence(i), (2, 0, 1))[..., np.newaxis]
+
+    def labels(self, label_level):
+        if int(label_level) == 14:
+            return self.label_14
+        elif int(label_level) == 28:
+            return self.label_28
+        raise ValueError('label_level must be 14 or 28 (got {})'.format(label_level))
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+    root = sys.argv[1] if len(sys.argv) > 1 else 'C:/ML/dataset/HandGestureDataset_SHREC2017/'
+    split = RawSplit(root, 'train_gestures.txt')
+    for epoch in range(2):
+        start = time.time()
+        frames = sum(len(split.sequence(i)) for i in range(len(split)))
+        print('epoch {}: {} samples, {} frames in {:.2f}s'.format(epoch, len(split), frames, time.time() - start))
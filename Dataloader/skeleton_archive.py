@@ -0,0 +1,186 @@
+import zlib
+import numpy as np
+from pathlib import Path
+
+from Dataloader import skeleton_store
+
+
+# Delta archive of a split, e.g. <root>/aug4_train.delta + <root>/aug4_train.delta.npz
+#   .delta      one zlib block per sample: int32 keyframe (V, C) followed by the per-frame deltas
+#               (T - 1, V, C) of the coordinates quantized to multiples of `step`, as int16 when
+#               they all fit and int32 otherwise
+#   .delta.npz  byte offsets/sizes of the blocks, frames, delta itemsize, labels and names
+# Deltas are taken between quantized positions, so decoding (keyframe + cumsum) is exact on the
+# grid and the error never drifts along the sequence: it stays <= step / 2 (up to float32 rounding)
+# on every frame.
+ARCHIVE_SUFFIX = '.delta'
+INDEX_SUFFIX = '.delta.npz'
+
+
+def archive_paths(path):
+    path = Path(path)
+    return path.with_name(path.name + ARCHIVE_SUFFIX), path.with_name(path.name + INDEX_SUFFIX)
+
+
+def archive_exists(path):
+    archive_path, index_path = archive_paths(path)
+    return archive_path.exists() and index_path.exists()
+
+
+def encode_sequence(seq, step, level=6):
+    # T, V, C float -> (zlib block, delta itemsize)
+    q = np.rint(np.asarray(seq, dtype=np.float64) / step)
+    if q.size and np.abs(q).max() > np.iinfo(np.int32).max:
+        raise ValueError('coordinates too large for step {} (max abs {})'.format(step, np.abs(seq).max()))
+    q = q.astype(np.int32)
+    delta = np.diff(q, axis=0)
+    fits = not delta.size or np.abs(delta).max() <= np.iinfo(np.int16).max
+    delta = delta.astype(np.int16 if fits else np.int32)
+    return zlib.compress(q[:1].tobytes() + delta.tobytes(), level), delta.itemsize
+
+
+def write_archive(path, skeletons, names, labels_14, labels_28, step=1e-4, level=6):
+    '''
+
+    :param path: archive prefix, e.g. root/aug4_train
+    :param skeletons: list (or store) of C, T, V, M / T, V, C arrays, at least one frame each
+    :param step: quantization step of the coordinates, the max reconstruction error is step / 2
+    :param level: zlib compression level
+    :return: number of samples written
+    '''
+    if not len(skeletons) == len(names) == len(labels_14) == len(labels_28):
+        raise ValueError('skeletons/names/labels have different lengths ({}, {}, {}, {})'.format(
+            len(skeletons), len(names), len(labels_14), len(labels_28)))
+    archive_path, index_path = archive_paths(path)
+    archive_path.parent.mkdir(parents=True, exist_ok=True)
+
+    frames = np.zeros(len(skeletons), dtype=np.int64)
+    sizes = np.zeros(len(skeletons), dtype=np.int64)
+    itemsizes = np.zeros(len(skeletons), dtype=np.int64)
+    joint_n, joint_d = 22, 3
+    with open(archive_path, 'wb') as f:
+        for i, skeleton in enumerate(skeletons):
+            seq = skeleton_store.to_sequence(skeleton)
+            if seq.shape[0] == 0:
+                # every block starts with a keyframe, there is nothing to decode one from
+                raise ValueError('sample {} ({}) has no frames, an archive can\'t hold it'.format(i, names[i]))
+            frames[i] = seq.shape[0]
+            joint_n, joint_d = seq.shape[1], seq.shape[2]
+            block, itemsizes[i] = encode_sequence(seq, step, level)
+            sizes[i] = len(block)
+            f.write(block)
+    offsets = np.zeros(len(skeletons), dtype=np.int64)
+    offsets[1:] = np.cumsum(sizes)[:-1]
+
+    np.savez(index_path,
+             offsets=offsets,
+             sizes=sizes,
+             frames=frames,
+             itemsizes=itemsizes,
+             label_14=np.asarray(labels_14, dtype=np.int64),
+             label_28=np.asarray(labels_28, dtype=np.int64),
+             names=np.asarray(names, dtype=str),
+             shape=np.array([joint_n, joint_d], dtype=np.int64),
+             step=np.float64(step))
+    return len(skeletons)
+
+
+class SkeletonArchive:
+    """Random access reader of a delta archive.
+
+    Same interface as SkeletonStore (sequence, indexing, labels, names), so it can back
+    Sdata_generator, Hand_Dataset or Store_Dataset. sequences() decodes many samples with one
+    cumsum over all of them, for sequential passes over the split.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.archive_path, self.index_path = archive_paths(self.path)
+        with np.load(self.index_path) as index:
+            self.offsets = index['offsets']
+            self.sizes = index['sizes']
+            self.lengths = index['frames']
+            self.itemsizes = index['itemsizes']
+            self.label_14 = index['label_14']
+            self.label_28 = index['label_28']
+            self.names = index['names']
+            self.joint_n, self.joint_d = (int(s) for s in index['shape'])
+            self.step = float(index['step'])
+        self._blob = None
+
+    @property
+    def blob(self):
+        # opened lazily, so a pickled archive (spawned workers) maps the file again
+        if self._blob is None:
+            if self.archive_path.stat().st_size == 0:
+                self._blob = np.empty(0, dtype=np.uint8)
+            else:
+                self._blob = np.memmap(self.archive_path, dtype=np.uint8, mode='r')
+        return self._blob
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_blob'] = None
+        return state
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def rows(self, i):
+        # quantized keyframe followed by the deltas, as one int64 (T, V, C) array
+        raw = zlib.decompress(self.blob[self.offsets[i]:self.offsets[i] + self.sizes[i]])
+        frame = self.joint_n * self.joint_d
+        key = np.frombuffer(raw, dtype=np.int32, count=frame)
+        delta = np.frombuffer(raw, dtype=np.int16 if self.itemsizes[i] == 2 else np.int32, offset=frame * 4)
+        return np.concatenate([key, delta]).astype(np.int64).reshape(-1, self.joint_n, self.joint_d)
+
+    def sequence(self, i):
+        # T, V, C float32
+        return (np.cumsum(self.rows(i), axis=0) * self.step).astype(np.float32)
+
+    def sequences(self, indices=None):
+        # decode many samples at once: one cumsum over all their rows, reset at every keyframe
+        indices = range(len(self)) if indices is None else indices
+        rows = [self.rows(i) for i in indices]
+        if not rows:
+            return []
+        lengths = np.array([len(r) for r in rows])
+        total = np.cumsum(np.concatenate(rows), axis=0)
+        ends = np.cumsum(lengths)
+        base = np.concatenate([np.zeros((1, self.joint_n, self.joint_d), dtype=np.int64), total[ends[:-1] - 1]])
+        decoded = ((total - np.repeat(base, lengths, axis=0)) * self.step).astype(np.float32)
+        return np.split(decoded, ends[:-1])
+
+    def __getitem__(self, i):
+        # C, T, V, M
+        return np.transpose(self.sequence(i), (2, 0, 1))[..., np.newaxis]
+
+    def labels(self, label_level):
+        if int(label_level) == 14:
+            return self.label_14
+        elif int(label_level) == 28:
+            return self.label_28
+        raise ValueError('label_level must be 14 or 28 (got {})'.format(label_level))
+
+
+def archive_store(path, out_path=None, step=1e-4):
+    # delta archive of an existing skeleton store, next to it by default
+    store = skeleton_store.SkeletonStore(path)
+    return write_archive(out_path or path, store, store.names, store.label_14, store.label_28, step)
+
+
+if __name__ == '__main__':
+    import sys
+    import time
+    root = 'C:/ML/dataset/HandGestureDataset_SHREC2017/'
+    for data_level in (sys.argv[1:] or ['aug4_train', 'val']):
+        path = Path(root) / data_level
+        archive_store(path)
+        store, archive = skeleton_store.SkeletonStore(path), SkeletonArchive(path)
+        start = time.time()
+        decoded = archive.sequences()
+        elapsed = time.time() - start
+        err = max(float(np.abs(d - store.sequence(i)).max()) for i, d in enumerate(decoded) if d.size)
+        print('{}: {} -> {} bytes ({:.2f}x), max abs error {:.3g}, decoded {} samples in {:.2f}s'.format(
+            data_level, store.coords_path.stat().st_size, archive.archive_path.stat().st_size,
+            archive.archive_path.stat().st_size / store.coords_path.stat().st_size, err, len(archive), elapsed))
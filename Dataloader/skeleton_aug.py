@@ -8,19 +8,23 @@ import random
 import math
 from math import sin,cos
 
+import utils
+
 
 class data_aug():
 
-    def __init__(self, data):
+    def __init__(self, data, rng=None):
 
         self.skeleton = data
         self.compoent_num = 22 # num of skeleton
+        # every method draws from this np.random.Generator, see utils.sample_rng
+        self.rng = utils.as_rng(rng)
 
     def scale(self):
         ratio = 0.2
         low = 1 - ratio
         high = 1 + ratio
-        factor = np.random.uniform(low, high)
+        factor = self.rng.uniform(low, high)
         video_len = self.skeleton.shape[0]
         for t in range(video_len):
             for j_id in range(self.compoent_num):
@@ -31,7 +35,7 @@ class data_aug():
     def shift(self):
         low = -0.1
         high = -low
-        offset = np.random.uniform(low, high, 3)
+        offset = self.rng.uniform(low, high, 3)
         video_len = self.skeleton.shape[0]
         for t in range(video_len):
             for j_id in range(self.compoent_num):
@@ -46,11 +50,11 @@ class data_aug():
         high = -low
         # select 4 joints
         all_joint = list(range(self.compoent_num))
-        shuffle(all_joint)
+        self.rng.shuffle(all_joint)
         selected_joint = all_joint[0:6]
 
         for j_id in selected_joint:
-            noise_offset = np.random.uniform(low, high, 3)
+            noise_offset = self.rng.uniform(low, high, 3)
             for t in range(video_len):
                 self.skeleton[t][j_id] += noise_offset
         skeleton = np.array(self.skeleton)
@@ -60,7 +64,7 @@ class data_aug():
         skeleton = np.array(self.skeleton)
         video_len = skeleton.shape[0]
 
-        r = np.random.uniform(0, 1)
+        r = self.rng.uniform(0, 1)
 
         result = []
 
@@ -77,12 +81,12 @@ class data_aug():
     def Gaus_noise(self):
         temp = self.skeleton.copy()
         T, V, C = self.skeleton.shape
-        noise = np.random.normal(0, 0.005, size=(T, V, C))
+        noise = self.rng.normal(0, 0.005, size=(T, V, C))
         return temp + noise
 
     def Rotate(self):
-        axis_next = random.randint(0, 2)
-        angle_next = random.uniform(0, 15)
+        axis_next = self.rng.integers(0, 3)
+        angle_next = self.rng.uniform(0, 15)
         temp = self.skeleton.copy()
         # print('input', temp.shape)
         temp = np.expand_dims(np.array(temp).transpose((2, 0, 1)), axis=-1)  # CTVM
@@ -117,7 +121,7 @@ class data_aug():
         temp = np.expand_dims(np.array(temp).transpose((2, 0, 1)), axis=-1)  # CTVM
         # print(temp.shape)  # (3, 64, 22, 1)
         C, T, V, M = temp.shape
-        if random.random() < 0.5:
+        if self.rng.random() < 0.5:
             time_range_order = [i for i in range(T)]
             time_range_reverse = list(reversed(time_range_order))
             # print(time_range_reverse)
@@ -133,8 +137,8 @@ class data_aug():
         temp = np.expand_dims(np.array(temp).transpose((2, 0, 1)), axis=-1)
         # print('input', temp.shape)
 
-        s1_list = [random.uniform(-1, 1), random.uniform(-1, 1), random.uniform(-1, 1)]
-        s2_list = [random.uniform(-1, 1), random.uniform(-1, 1), random.uniform(-1, 1)]
+        s1_list = [self.rng.uniform(-1, 1), self.rng.uniform(-1, 1), self.rng.uniform(-1, 1)]
+        s2_list = [self.rng.uniform(-1, 1), self.rng.uniform(-1, 1), self.rng.uniform(-1, 1)]
 
         R = np.array([[1, s1_list[0], s2_list[0]],
                       [s1_list[1], 1, s2_list[1]],
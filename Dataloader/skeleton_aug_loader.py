@@ -8,94 +8,87 @@ from tqdm import tqdm
 import sys
 import copy
 import utils
-from Dataloader import skeleton_aug
+from Dataloader import skeleton_aug, skeleton_store, skeleton_streams, skeleton_archive
 from prepare import aug_tools
 
+# augmented copies appended after every sample when aug is True, in this order
+AUGS = ('subtract', 'randomFlip', 'zeroOutAxis', 'rotate', 'zeroOutJoints', 'gausNoise', 'gausFilter', 'shear')
+
 class Sdata_generator:
     def __init__(self, data_level, label_level):
+        self.store_path = Path(F"C:/ML/dataset/HandGestureDataset_SHREC2017/{data_level}")
         self.data_path = Path(F"C:/ML/dataset/HandGestureDataset_SHREC2017/{data_level}_skeleton.pkl")
         self.label_path = Path(F"C:/ML/dataset/HandGestureDataset_SHREC2017/{data_level}_label_{label_level}.pkl")
+        self.data_level = data_level
+        self.label_level = label_level
         self.load_shrec_data()
 
     def load_shrec_data(self,):
+        if skeleton_store.store_exists(self.store_path):
+            # memory-mapped, samples are only paged in when touched
+            self.data = skeleton_store.SkeletonStore(self.store_path)
+            self.sample_name, self.label = self.data.names, self.data.labels(self.label_level)
+            return
+        if skeleton_archive.archive_exists(self.store_path):
+            # delta encoded archive, every sample is decoded when touched
+            self.data = skeleton_archive.SkeletonArchive(self.store_path)
+            self.sample_name, self.label = self.data.names, self.data.labels(self.label_level)
+            return
+
         with open(self.label_path, 'rb') as f:
             self.sample_name, self.label = pickle.load(f)
 
         with open(self.data_path, 'rb') as f:
             self.data = pickle.load(f)
 
+    def source_files(self):
+        if isinstance(self.data, skeleton_store.SkeletonStore):
+            return skeleton_store.store_paths(self.store_path)
+        if isinstance(self.data, skeleton_archive.SkeletonArchive):
+            return skeleton_archive.archive_paths(self.store_path)
+        return [self.data_path, self.label_path]
+
+    def cache_key(self, cache, C, mode, seed=None):
+        return cache.key(data_level=self.data_level, label_level=self.label_level, frame_l=C.frame_l,
+                         mode=mode, seed=seed, source=cache.source_hash(self.source_files()))
+
+    def load_cached(self, cache, key, C):
+        cached = cache.load(key)
+        if cached is None:
+            return False
+        self.streams = skeleton_streams.SkeletonStreams(cached['X'], cached['Y'], C)
+        return True
+
     # le is None to provide a unified interface with JHMDB datagenerator
-    def __call__(self, C, aug=True):
-        X_1, X_2, X_3 = [], [], []
-
-        Y = []
-        for i in tqdm(range(len(self.data))):
-            p = np.transpose(np.copy(self.data[i].squeeze(-1)),(1,2,0))
-             # p.shape (frame,joint_num,joint_coords_dims)
-            label = self.label[i]
-            # p = normalize_skeletons(p, 0)
-            p = utils.zoom(p, target_l=C.frame_l,
-                           joints_num=C.joint_n, joints_dim=C.joint_d)
-            # print(p.shape)
-
-            # s = utils.decouple_spatial(p, C.hand_edge)
-            # s = utils.get_CG(p, C) # (b, l, 231)
-            # t = utils.decouple_temporal(p, 1)
-            # print(p.shape,p[:, 1, :].shape)
-
-            X_1.append(p)
-            X_2.append(p)
-            X_3.append(p)
-            Y.append(label)
-
-            if aug is True:
-                data = aug_tools.aug_look('subtract')(p)
-                X_1.append(data)
-                X_2.append(data)
-                X_3.append(data)
-                Y.append(label)
-                data = aug_tools.aug_look('randomFlip')(p)
-                X_1.append(data)
-                X_2.append(data)
-                X_3.append(data)
-                Y.append(label)
-                data = aug_tools.aug_look('zeroOutAxis')(p)
-                X_1.append(data)
-                X_2.append(data)
-                X_3.append(data)
-                Y.append(label)
-                data = aug_tools.aug_look('rotate')(p)
-                X_1.append(data)
-                X_2.append(data)
-                X_3.append(data)
-                Y.append(label)
-                data = aug_tools.aug_look('zeroOutJoints')(p)
-                X_1.append(data)
-                X_2.append(data)
-                X_3.append(data)
-                Y.append(label)
-                data = aug_tools.aug_look('gausNoise')(p)
-                X_1.append(data)
-                X_2.append(data)
-                X_3.append(data)
-                Y.append(label)
-                data = aug_tools.aug_look('gausFilter')(p)
-                X_1.append(data)
-                X_2.append(data)
-                X_3.append(data)
-                Y.append(label)
-                data = aug_tools.aug_look('shear')(p)
-                X_1.append(data)
-                X_2.append(data)
-                X_3.append(data)
-                Y.append(label)
-
-        self.X_1 = np.stack(X_1)
-        self.X_2 = np.stack(X_2)
-        self.X_3 = np.stack(X_3)
-
-        self.Y = np.stack(Y)
-        return self.X_1, self.X_2, self.X_3, self.Y
+    def __call__(self, C, aug=True, cache=None, seed=None):
+        if cache is not None:
+            key = self.cache_key(cache, C, 'zoom_aug' if aug else 'zoom', seed)
+            if self.load_cached(cache, key, C):
+                return self.streams
+        copies = 1 + len(AUGS) if aug is True else 1
+        # every sample and its augmented copies are written straight into one float32 array,
+        # X[i * copies] is the resampled sequence, the following rows its augmentations
+        X = np.empty((len(self.data) * copies, C.frame_l, C.joint_n, C.joint_d), dtype=np.float32)
+        Y = np.repeat(np.asarray(self.label, dtype=np.int64), copies)
+        # resample every sequence to frame_l at once instead of 66 zoom calls per sample
+        utils.zoom_batch([np.transpose(self.data[i].squeeze(-1), (1, 2, 0)) for i in range(len(self.data))],
+                         target_l=C.frame_l, out=X[::copies])
+        if aug is True:
+            for i in tqdm(range(len(self.data))):
+                # aug_tools works on C, T, V, M
+                p = np.transpose(X[i * copies], (2, 0, 1))[..., np.newaxis]
+                # a seeded build draws every sample's augmentations from its own stream
+                rng = None if seed is None else utils.sample_rng(seed, 0, i)
+                for k, name in enumerate(AUGS, 1):
+                    X[i * copies + k] = np.transpose(aug_tools.aug_look(name, rng)(p, rng)[..., 0], (1, 2, 0))
+        print('{}: built {}, peak RSS {} MB'.format(self.data_level, X.shape, utils.peak_rss_mb()))
+
+        # one joint array, bone / motion / JCD streams are derived on demand
+        self.streams = skeleton_streams.SkeletonStreams(X, Y, C)
+        if cache is not None:
+            cache.save(key, parts={'data_level': self.data_level, 'frame_l': C.frame_l},
+                       X=self.streams['joint'], Y=self.streams.label)
+        return self.streams
 
 
 class SConfig():
@@ -126,9 +119,9 @@ if __name__ == '__main__':
     #     print(p.shape)
     C = SConfig()
     data = Sdata_generator('train', 28)
-    x,y,z,l = data(C, False)
+    streams = data(C, False)
 
-    print(x.shape, l.shape)
+    print(streams['joint'].shape, streams['bone'].shape, streams.label.shape)
 
 
 
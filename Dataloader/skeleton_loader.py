@@ -8,56 +8,83 @@ from tqdm import tqdm
 import sys
 import copy
 import utils
-from Dataloader import skeleton_aug
+from Dataloader import skeleton_aug, skeleton_store, skeleton_streams, skeleton_archive
 from prepare import aug_tools
-from torch.utils.data import Dataset, DataLoader
+from torch.utils.data import Dataset, DataLoader, default_collate
 import torch
 from random import randint, shuffle
 
 class Sdata_generator:
     def __init__(self, data_level, label_level):
+        self.store_path = Path(F"C:/ML/dataset/HandGestureDataset_SHREC2017/{data_level}")
         self.data_path = Path(F"C:/ML/dataset/HandGestureDataset_SHREC2017/{data_level}_skeleton.pkl")
         self.label_path = Path(F"C:/ML/dataset/HandGestureDataset_SHREC2017/{data_level}_label_{label_level}.pkl")
+        self.data_level = data_level
+        self.label_level = label_level
         self.load_shrec_data()
 
     def load_shrec_data(self,):
+        if skeleton_store.store_exists(self.store_path):
+            # memory-mapped, samples are only paged in when touched
+            self.data = skeleton_store.SkeletonStore(self.store_path)
+            self.sample_name, self.label = self.data.names, self.data.labels(self.label_level)
+            return
+        if skeleton_archive.archive_exists(self.store_path):
+            # delta encoded archive, every sample is decoded when touched
+            self.data = skeleton_archive.SkeletonArchive(self.store_path)
+            self.sample_name, self.label = self.data.names, self.data.labels(self.label_level)
+            return
+
         with open(self.label_path, 'rb') as f:
             self.sample_name, self.label = pickle.load(f)
 
         with open(self.data_path, 'rb') as f:
             self.data = pickle.load(f)
 
-    # le is None to provide a unified interface with JHMDB datagenerator
-    def __call__(self, C):
-        X_1, X_2, X_3 = [], [], []
-
-        Y = []
-        for i in range(len(self.data)):
-            p = np.transpose(np.copy(self.data[i].squeeze(-1)),(1,2,0))
-             # p.shape (frame,joint_num,joint_coords_dims)
-            label = self.label[i]
-            # p = normalize_skeletons(p, 0)
-            p = utils.zoom(p, target_l=C.frame_l,
-                           joints_num=C.joint_n, joints_dim=C.joint_d)
-            # print(p.shape)
-
-            # s = utils.decouple_spatial(p, C.hand_edge)
-            # s = utils.get_CG(p, C) # (b, l, 231)
-            # t = utils.decouple_temporal(p, 1)
-            # print(p.shape,p[:, 1, :].shape)
-
-            X_1.append(p)
-            X_2.append(p)
-            X_3.append(p)
-            Y.append(label)
+    def source_files(self):
+        if isinstance(self.data, skeleton_store.SkeletonStore):
+            return skeleton_store.store_paths(self.store_path)
+        if isinstance(self.data, skeleton_archive.SkeletonArchive):
+            return skeleton_archive.archive_paths(self.store_path)
+        return [self.data_path, self.label_path]
 
+    def cache_key(self, cache, C, mode, seed=None):
+        return cache.key(data_level=self.data_level, label_level=self.label_level, frame_l=C.frame_l,
+                         mode=mode, seed=seed, source=cache.source_hash(self.source_files()))
 
-        self.X_1 = np.stack(X_1)
-        self.X_2 = np.stack(X_2)
-        self.X_3 = np.stack(X_3)
+    def load_cached(self, cache, key, C):
+        cached = cache.load(key)
+        if cached is None:
+            return False
+        self.streams = skeleton_streams.SkeletonStreams(cached['X'], cached['Y'], C)
+        return True
 
-        self.Y = np.stack(Y)
-        return self.X_1, self.X_2, self.X_3, self.Y
+    # le is None to provide a unified interface with JHMDB datagenerator
+    def __call__(self, C, cache=None, seed=None, keyframes=False):
+        '''
+        :param keyframes: keep the frame_l frames with the most motion (utils.keyframe_batch)
+                          instead of zooming the whole sequence to frame_l
+        '''
+        if cache is not None:
+            key = self.cache_key(cache, C, 'energy' if keyframes else 'zoom', seed)
+            if self.load_cached(cache, key, C):
+                return self.streams
+        # resample every sequence to frame_l at once instead of 66 zoom calls per sample,
+        # straight into one float32 array so no float64 copy of the split is ever held
+        # X.shape (sample, frame, joint_num, joint_coords_dims)
+        X = np.empty((len(self.data), C.frame_l, C.joint_n, C.joint_d), dtype=np.float32)
+        select = utils.keyframe_batch if keyframes else utils.zoom_batch
+        select([np.transpose(self.data[i].squeeze(-1), (1, 2, 0)) for i in range(len(self.data))],
+               target_l=C.frame_l, out=X)
+        Y = np.asarray(self.label, dtype=np.int64)
+        print('{}: built {}, peak RSS {} MB'.format(self.data_level, X.shape, utils.peak_rss_mb()))
+
+        # bone / motion / JCD streams are derived from the joints when a model asks for them
+        self.streams = skeleton_streams.SkeletonStreams(X, Y, C)
+        if cache is not None:
+            cache.save(key, parts={'data_level': self.data_level, 'frame_l': C.frame_l},
+                       X=self.streams['joint'], Y=self.streams.label)
+        return self.streams
 
 
 class SConfig():
@@ -78,35 +105,112 @@ class SConfig():
 
 
 
+def augment_batch(skeleton, generator=None):
+    '''
+    Hand_Dataset.data_aug over a B, T, V, C tensor: every sample still gets one of scale, shift,
+    noise or time_interpolate with the same ranges, drawn from generator (torch's default one
+    when None) on the batch's device. Cheap enough to run per step on the device (EchoLoader,
+    DeviceLoader)
+    '''
+    skeleton = skeleton.clone()
+    B, T, V, C = skeleton.shape
+    ag_id = torch.randint(0, 4, (B,), device=skeleton.device, generator=generator)
+
+    scale = ag_id == 0
+    factor = torch.empty(int(scale.sum()), 1, 1, 1, device=skeleton.device).uniform_(0.8, 1.2, generator=generator)
+    skeleton[scale] = skeleton[scale] * factor
+
+    shift = ag_id == 1
+    offset = torch.empty(int(shift.sum()), 1, 1, C, device=skeleton.device).uniform_(-0.1, 0.1, generator=generator)
+    skeleton[shift] = skeleton[shift] + offset
+
+    # 4 random joints per sample, each moved by its own offset on every frame
+    noise = ag_id == 2
+    n = int(noise.sum())
+    joints = torch.rand(n, V, device=skeleton.device, generator=generator).argsort(dim=1)[:, :4]
+    selected = torch.zeros(n, V, 1, device=skeleton.device).scatter_(1, joints.unsqueeze(-1), 1.)
+    noise_offset = torch.empty(n, 1, V, C, device=skeleton.device).uniform_(-0.1, 0.1, generator=generator)
+    noise_offset = noise_offset * selected.unsqueeze(1)
+    skeleton[noise] = skeleton[noise] + noise_offset
+
+    # s_t + r * (s_t+1 - s_t), the last frame repeated as padding
+    interp = ag_id == 3
+    if T > 1 and interp.any():
+        r = torch.rand(int(interp.sum()), 1, 1, 1, device=skeleton.device, generator=generator)
+        seq = skeleton[interp]
+        result = torch.empty_like(seq)
+        result[:, :-1] = seq[:, :-1] + r * (seq[:, 1:] - seq[:, :-1])
+        result[:, -1] = result[:, -2]
+        skeleton[interp] = result
+    return skeleton
+
+
 class Hand_Dataset(Dataset):
     """Face Landmarks dataset."""
 
-    def __init__(self, data, label, time_len, use_data_aug):
+    def __init__(self, data, label, time_len, use_data_aug, seed=None, batched=False):
         """
         Args:
-            data: a list of video and it's label
+            data: a list of video and it's label, a store (SkeletonStore, SkeletonArchive, RawSplit:
+                  anything with sequence(i) and labels(level)) or the path of a SkeletonStore
+            label: labels, or the label level (14/28) when data is a store
             time_len: length of input video
             use_data_aug: flag for using data augmentation
+            seed: draw every sample's augmentation from its own (seed, epoch, index) stream, so
+                  a run is reproduced exactly whatever num_workers is (call set_epoch every
+                  epoch). None keeps the global random state
+            batched: fetch and augment whole batches in __getitems__ (needs collate_fn=batch_collate)
         """
+        if isinstance(data, (str, Path)):
+            data = skeleton_store.SkeletonStore(data)
+        if hasattr(data, 'labels') and isinstance(label, int):
+            label = data.labels(label)
         self.use_data_aug = use_data_aug
         self.data = data
         self.label = label
         self.time_len = time_len
         self.compoent_num = 22
+        self.seed = seed
+        self.epoch = 0
+        self.batched = batched
 
 
     def __len__(self):
         return len(self.data)
 
+    def set_epoch(self, epoch):
+        # before iterating a DataLoader, workers receive the dataset (and its epoch) when it starts
+        self.epoch = epoch
+
+    def sample_rng(self, ind):
+        # np.random.Generator of sample ind in this epoch, None without a seed
+        if self.seed is None:
+            return None
+        return utils.sample_rng(self.seed, self.epoch, ind)
+
+    def batch_generator(self, indices):
+        # torch.Generator of this batch of indices in this epoch, None without a seed
+        if self.seed is None:
+            return None
+        state = np.random.SeedSequence([self.seed, self.epoch] + [int(i) for i in indices]).generate_state(1, np.uint64)
+        return torch.Generator().manual_seed(int(state[0]))
+
+    def load_skeleton(self, ind, rng=None):
+        # T, V, C of one sample, before augmentation
+        if hasattr(self.data, 'sequence'):
+            # raw sequence of a store (SkeletonStore, SkeletonArchive, RawSplit), zoomed to
+            # time_len frames like Sdata_generator does it
+            return utils.window_sequence(self.data.sequence(ind), self.time_len)
+        return self.data[ind]
+
     def __getitem__(self, ind):
         #print("ind:",ind)
-        skeleton = self.data[ind]
-
         #hand skeleton
-        skeleton = np.array(skeleton)
+        rng = self.sample_rng(ind)
+        skeleton = np.array(self.load_skeleton(ind, rng))
 
         if self.use_data_aug:
-            skeleton = self.data_aug(skeleton)
+            skeleton = self.data_aug(skeleton, rng)
 
         skeleton = torch.from_numpy(skeleton).float()
         #print(skeleton.shape)
@@ -115,13 +219,48 @@ class Hand_Dataset(Dataset):
 
         return skeleton, label
 
-    def data_aug(self, skeleton):
+    def __getitems__(self, indices):
+        '''
+        DataLoader calls this instead of __getitem__ per index when it is defined. By default it
+        is the list of (skeleton, label) samples DataLoader would build, for any collate_fn.
+        With batched: the whole batch at once, one slice of the backing tensor and no per-sample
+        numpy round trip. Augmentation is then batch_aug (augment_batch, the same four transforms
+        and ranges drawn per sample on torch's generator) instead of the per-sample data_aug.
+        The batch only unpacks with collate_fn=batch_collate (it comes out ready), any other
+        collate_fn raises a TypeError instead of stacking it a second time.
+        :return: list of (skeleton, label), or with batched a StackedBatch of
+                 (B, T, V, C float tensor, B labels)
+        '''
+        if not self.batched:
+            return [self[ind] for ind in indices]
+        if torch.is_tensor(self.data) or isinstance(self.data, np.ndarray):
+            skeleton = torch.as_tensor(self.data[indices]).float()
+        else:
+            # stores are read sample by sample, only the stacking and the augmentation are batched
+            skeleton = torch.stack([torch.as_tensor(np.array(self.load_skeleton(ind, self.sample_rng(ind)),
+                                                             dtype=np.float32))
+                                    for ind in indices])
+        if self.use_data_aug:
+            skeleton = self.batch_aug(skeleton, self.batch_generator(indices))
+
+        if torch.is_tensor(self.label) or isinstance(self.label, np.ndarray):
+            label = torch.as_tensor(self.label[indices])
+        else:
+            label = torch.as_tensor([self.label[ind] for ind in indices])
+        return StackedBatch(skeleton, label)
+
+    def batch_aug(self, skeleton, generator=None):
+        # data_aug for a whole batch, see augment_batch
+        return augment_batch(skeleton, generator)
+
+    def data_aug(self, skeleton, rng=None):
+        rng = utils.as_rng(rng)
 
         def scale(skeleton):
             ratio = 0.2
             low = 1 - ratio
             high = 1 + ratio
-            factor = np.random.uniform(low, high)
+            factor = rng.uniform(low, high)
             video_len = skeleton.shape[0]
             for t in range(video_len):
                 for j_id in range(self.compoent_num):
@@ -132,7 +271,7 @@ class Hand_Dataset(Dataset):
         def shift(skeleton):
             low = -0.1
             high = -low
-            offset = np.random.uniform(low, high, 3)
+            offset = rng.uniform(low, high, 3)
             video_len = skeleton.shape[0]
             for t in range(video_len):
                 for j_id in range(self.compoent_num):
@@ -145,11 +284,11 @@ class Hand_Dataset(Dataset):
             high = -low
             #select 4 joints
             all_joint = list(range(self.compoent_num))
-            shuffle(all_joint)
+            rng.shuffle(all_joint)
             selected_joint = all_joint[0:4]
 
             for j_id in selected_joint:
-                noise_offset = np.random.uniform(low, high, 3)
+                noise_offset = rng.uniform(low, high, 3)
                 for t in range(self.time_len):
                     skeleton[t][j_id] += noise_offset
             skeleton = np.array(skeleton)
@@ -159,7 +298,7 @@ class Hand_Dataset(Dataset):
             skeleton = np.array(skeleton)
             video_len = skeleton.shape[0]
 
-            r = np.random.uniform(0, 1)
+            r = rng.uniform(0, 1)
 
             result = []
 
@@ -175,7 +314,7 @@ class Hand_Dataset(Dataset):
 
         # og_id = np.random.randint(3)
         aug_num = 4
-        ag_id = randint(0, aug_num - 1)
+        ag_id = rng.integers(0, aug_num)
         if ag_id == 0:
             skeleton = scale(skeleton)
         elif ag_id == 1:
@@ -189,6 +328,76 @@ class Hand_Dataset(Dataset):
 
 
 
+class Store_Dataset(Hand_Dataset):
+    """Out-of-core dataset over a SkeletonStore (or anything with sequence(i) and labels(level)).
+
+    Only the index is held in memory, every __getitem__ reads one sequence from the memmap and
+    zooms it to frame_l like this module's Sdata_generator, so a split can be far larger than
+    RAM and the samples are the ones the in-memory path trains on. With window_size it windows
+    like SHREC_loader's Sdata_generator instead (resample to window_size frames, then crop frame_l
+    of them, see utils.window_sequence). The store reopens its memmap after pickling, so it can be
+    used with num_workers > 0 (give it a seed, or pass worker_init_fn, when augmenting). With a
+    seed the random windows come from the sample's stream as well.
+    """
+
+    def __init__(self, store, label_level, frame_l, window_size=None, random_choose=False,
+                 center_choose=False, use_data_aug=False, seed=None, batched=False):
+        if isinstance(store, (str, Path)):
+            store = skeleton_store.SkeletonStore(store)
+        time_len = frame_l if window_size is None else min(frame_l, window_size)
+        super(Store_Dataset, self).__init__(store, store.labels(label_level), time_len, use_data_aug, seed, batched)
+        self.frame_l = frame_l
+        self.window_size = window_size
+        self.random_choose = random_choose
+        self.center_choose = center_choose
+
+    def load_skeleton(self, ind, rng=None):
+        # T, V, C view of the memmap, only this sample's pages are read
+        return utils.window_sequence(self.data.sequence(ind), self.frame_l, self.window_size, self.random_choose,
+                                     self.center_choose, rng)
+
+    def __getitem__(self, ind):
+        # copy out of the read only memmap before augmenting in place
+        rng = self.sample_rng(ind)
+        skeleton = np.array(self.load_skeleton(ind, rng), dtype=np.float32)
+        if self.use_data_aug:
+            skeleton = self.data_aug(skeleton, rng)
+
+        return torch.from_numpy(skeleton).float(), self.label[ind]
+
+
+class StackedBatch():
+    """A whole (skeleton, label) batch from a batched Hand_Dataset.__getitems__.
+
+    batch_collate unpacks it. Every other collate_fn fails on it: default_collate indexes the
+    batch as a list of samples, which raises here rather than silently adding a dimension.
+    """
+
+    def __init__(self, skeleton, label):
+        self.skeleton = skeleton
+        self.label = label
+
+    def _refuse(self, *args):
+        raise TypeError('a batched Hand_Dataset returns whole batches, '
+                        'build its DataLoader with collate_fn=batch_collate')
+
+    __len__ = __getitem__ = __iter__ = _refuse
+
+
+def batch_collate(batch):
+    # a batched __getitems__ already returns a StackedBatch, anything else (a list of samples,
+    # e.g. a plain Dataset) goes through the default collate
+    if isinstance(batch, StackedBatch):
+        return batch.skeleton, batch.label
+    return default_collate(batch)
+
+
+def worker_init_fn(worker_id):
+    # forked workers start with the same global state, draws without a seed would repeat across
+    # them. Seeded datasets don't need this, their draws come from per sample streams
+    np.random.seed(torch.initial_seed() % 2 ** 32)
+
+
 if __name__ == '__main__':
     data_path = Path("C:/ML/dataset/HandGestureDataset_SHREC2017/train_skeleton.pkl")
     label_path = Path("C:/ML/dataset/HandGestureDataset_SHREC2017/train_label_28.pkl")
@@ -200,9 +409,9 @@ if __name__ == '__main__':
     #     print(p.shape)
     C = SConfig()
     data = Sdata_generator('train', 28)
-    x,y,z,l = data(C, True)
+    streams = data(C)
 
-    print(x.shape, l.shape)
+    print(streams['joint'].shape, streams['bone'].shape, streams.label.shape)
 
 
 
@@ -0,0 +1,205 @@
+import json
+import numpy as np
+from pathlib import Path
+import torch.distributed as dist
+from torch.utils.data import IterableDataset, get_worker_info
+
+from Dataloader import skeleton_store
+from Dataloader.skeleton_loader import Store_Dataset
+
+
+# <root>/<split>.shards/
+#   manifest.json      shard names + sample counts
+#   shard-00000.coords / shard-00000.index.npz, ...   every shard is a skeleton store of its own
+MANIFEST = 'manifest.json'
+
+
+def shard_dir(path):
+    path = Path(path)
+    return path.with_name(path.name + '.shards')
+
+
+def write_shards(store, shard_size=4096, seed=1):
+    '''
+    split a skeleton store into fixed-size shards, each with its own index
+    :param store: SkeletonStore or store prefix, e.g. root/aug4_train
+    :param shard_size: samples per shard (the last one may be smaller)
+    :param seed: samples are shuffled across shards, gendata writes them grouped by gesture
+    :return: the shard directory
+    '''
+    if not isinstance(store, skeleton_store.SkeletonStore):
+        store = skeleton_store.SkeletonStore(store)
+    out_dir = shard_dir(store.path)
+    out_dir.mkdir(parents=True, exist_ok=True)
+
+    order = np.random.RandomState(seed).permutation(len(store))
+    shards = []
+    for n, begin in enumerate(range(0, len(store), shard_size)):
+        index = np.sort(order[begin:begin + shard_size])
+        name = 'shard-{:05d}'.format(n)
+        skeleton_store.write_store(out_dir / name, [store.sequence(i) for i in index], store.names[index],
+                                   store.label_14[index], store.label_28[index], store.codec)
+        shards.append({'name': name, 'samples': len(index)})
+
+    manifest = {'source': str(store.path), 'samples': len(store), 'shard_size': shard_size, 'shards': shards}
+    (out_dir / MANIFEST).write_text(json.dumps(manifest, indent=1))
+    return out_dir
+
+
+def read_manifest(path):
+    # path is either the store prefix or the .shards directory itself
+    path = Path(path)
+    if not (path / MANIFEST).exists():
+        path = shard_dir(path)
+    return path, json.loads((path / MANIFEST).read_text())
+
+
+def rank_and_world():
+    if dist.is_available() and dist.is_initialized():
+        return dist.get_rank(), dist.get_world_size()
+    return 0, 1
+
+
+class Sharded_Dataset(IterableDataset):
+    """Iterable dataset over the shards written by write_shards.
+
+    Every (rank, DataLoader worker) pair reads a disjoint subset of the shards, so no process
+    touches the whole corpus. Shards are dealt by sample count (see assignment), and every pair
+    yields the same number of samples: the ones short of the largest share wrap around to their
+    own first samples, or with drop_last all are cut to the smallest share (like
+    DistributedSampler). So every rank gets the same number of batches and DDP doesn't wait on a
+    rank that ran out. There must be at least one shard per (rank, worker) pair.
+    The shard order is reshuffled each epoch (call set_epoch) and samples are mixed through a
+    shuffle buffer of buffer_size. Samples are windowed like Store_Dataset.
+
+    Resuming: after `batches` batches of an epoch, save state_dict(batches, batch_size) and
+    load_state_dict it into a fresh dataset. Each worker then regenerates its deterministic
+    order and skips the batches it had already produced (DataLoader takes them round robin), so
+    the rest of the epoch is exactly the batches not yet seen, up to their order within one
+    round of workers. Every worker yields the same number of samples, so none runs out early.
+    """
+
+    def __init__(self, path, label_level, frame_l, window_size=None, shuffle=True, buffer_size=1024,
+                 seed=1, center_choose=False, use_data_aug=False, drop_last=False):
+        self.shard_path, self.manifest = read_manifest(path)
+        self.label_level = label_level
+        self.frame_l = frame_l
+        self.window_size = window_size
+        self.shuffle = shuffle
+        self.buffer_size = buffer_size
+        self.seed = seed
+        self.center_choose = center_choose
+        self.use_data_aug = use_data_aug
+        self.drop_last = drop_last
+        self.epoch = 0
+        self.skip_batches = 0
+        self.batch_size = 1
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+        self.skip_batches = 0
+
+    def state_dict(self, batches, batch_size):
+        # batches: number of batches the training loop consumed in the current epoch
+        return {'epoch': self.epoch, 'batches': batches, 'batch_size': batch_size}
+
+    def load_state_dict(self, state):
+        self.epoch = state['epoch']
+        self.skip_batches = state['batches']
+        self.batch_size = state['batch_size']
+
+    def assignment(self, slots):
+        '''
+        deal the shards to slots (rank * num_workers + worker id), the same on every rank and
+        worker: largest shard first, each to the slot with the fewest samples so far; the epoch's
+        permutation decides among shards of equal size
+        :return: shard numbers of every slot, samples of every slot
+        '''
+        shards = self.manifest['shards']
+        if len(shards) < slots:
+            raise ValueError('{} shards for {} (rank, worker) pairs, every worker needs one: write smaller shards '
+                             '(write_shards shard_size) or use fewer workers'.format(len(shards), slots))
+        order = np.arange(len(shards))
+        if self.shuffle:
+            order = np.random.RandomState(self.seed + self.epoch).permutation(len(shards))
+        sizes = np.array([shards[i]['samples'] for i in order], dtype=np.int64)
+        assigned = [[] for _ in range(slots)]
+        load = np.zeros(slots, dtype=np.int64)
+        for k in np.argsort(-sizes, kind='stable'):
+            slot = int(np.argmin(load))
+            assigned[slot].append(int(order[k]))
+            load[slot] += sizes[k]
+        return assigned, load
+
+    def shards(self, rank, world, worker_id, num_workers):
+        # names of this worker's shards, and the number of samples every worker yields
+        assigned, load = self.assignment(world * num_workers)
+        shards = self.manifest['shards']
+        count = int(load.min() if self.drop_last else load.max())
+        return [shards[i]['name'] for i in assigned[rank * num_workers + worker_id]], count
+
+    def stream(self, datasets, rng, count):
+        # exactly count (shard, sample) pairs: this worker's own, cut, or wrapped around to its first ones
+        own = sum(len(dataset) for dataset in datasets)
+        replay = []
+        for n, item in enumerate(self.indices(datasets, rng)):
+            if n == count:
+                return
+            if n < count - own:
+                replay.append(item)
+            yield item
+        for n in range(count - own):
+            yield replay[n % len(replay)]
+
+    def indices(self, datasets, rng):
+        # (shard, sample) pairs of this worker, mixed through the shuffle buffer
+        buffer = []
+        for n, dataset in enumerate(datasets):
+            order = rng.permutation(len(dataset)) if self.shuffle else range(len(dataset))
+            for i in order:
+                if not self.shuffle:
+                    yield n, i
+                elif len(buffer) < self.buffer_size:
+                    buffer.append((n, i))
+                else:
+                    j = rng.randint(len(buffer))
+                    yield buffer[j]
+                    buffer[j] = (n, i)
+        rng.shuffle(buffer)
+        for item in buffer:
+            yield item
+
+    def __iter__(self):
+        rank, world = rank_and_world()
+        info = get_worker_info()
+        worker_id, num_workers = (info.id, info.num_workers) if info is not None else (0, 1)
+
+        # every shard's samples draw their windows and augmentations from streams of their own
+        # (seed, shard, epoch, index), the same whichever worker reads the shard
+        shard_ids = {shard['name']: k for k, shard in enumerate(self.manifest['shards'])}
+        names, count = self.shards(rank, world, worker_id, num_workers)
+        datasets = []
+        for name in names:
+            shard_seed = int(np.random.SeedSequence([self.seed, shard_ids[name]]).generate_state(1)[0])
+            dataset = Store_Dataset(self.shard_path / name, self.label_level, self.frame_l, self.window_size,
+                                    center_choose=self.center_choose, use_data_aug=self.use_data_aug,
+                                    seed=shard_seed)
+            dataset.set_epoch(self.epoch)
+            datasets.append(dataset)
+        rng = np.random.RandomState([self.seed, self.epoch, rank * num_workers + worker_id])
+
+        # batches this worker produced before the checkpoint (DataLoader pulls them round robin)
+        produced = self.skip_batches // num_workers + (worker_id < self.skip_batches % num_workers)
+        skip = produced * self.batch_size
+        for n, i in self.stream(datasets, rng, count):
+            if skip:
+                skip -= 1
+                continue
+            yield datasets[n][i]
+
+
+if __name__ == '__main__':
+    import sys
+    root = 'C:/ML/dataset/HandGestureDataset_SHREC2017/'
+    for data_level in (sys.argv[1:] or ['aug4_train', 'val']):
+        print(data_level, write_shards(root + data_level))
@@ -0,0 +1,276 @@
+import numpy as np
+import pickle
+from pathlib import Path
+
+
+# On-disk layout of a split, e.g. <root>/aug4_train.coords + <root>/aug4_train.index.npz
+#   .coords     one contiguous buffer of every frame, shape (total_frames, V, C), stored as `codec`
+#   .index.npz  offsets/lengths (in frames) of each sample + label_14/label_28/names columns,
+#               the codec and per sample, per coordinate coord_scale/coord_offset
+COORDS_SUFFIX = '.coords'
+INDEX_SUFFIX = '.index.npz'
+
+# float32 as is, float16 (half the bytes, ~5e-4 relative error) or int16 quantized between the
+# min and max of every sample and coordinate (half the bytes, error <= range / 131068)
+CODECS = {'float32': np.float32, 'float16': np.float16, 'int16': np.int16}
+
+
+def store_paths(path):
+    path = Path(path)
+    return path.with_name(path.name + COORDS_SUFFIX), path.with_name(path.name + INDEX_SUFFIX)
+
+
+def store_exists(path):
+    coords_path, index_path = store_paths(path)
+    return coords_path.exists() and index_path.exists()
+
+
+def to_sequence(skeleton):
+    # C, T, V, M (what gendata produces) -> T, V, C
+    skeleton = np.asarray(skeleton)
+    if skeleton.ndim == 4:
+        skeleton = np.transpose(skeleton[..., 0], (1, 2, 0))
+    return np.ascontiguousarray(skeleton, dtype=np.float32)
+
+
+def encode(seq, codec='float32'):
+    # T, V, C float32 -> (stored array, coord_scale, coord_offset), seq == stored * scale + offset
+    if codec not in CODECS:
+        raise ValueError('codec must be one of {} (got {})'.format(list(CODECS), codec))
+    joint_d = seq.shape[-1]
+    scale, offset = np.ones(joint_d, dtype=np.float32), np.zeros(joint_d, dtype=np.float32)
+    if codec == 'int16' and seq.size:
+        flat = seq.reshape(-1, joint_d)
+        low, high = flat.min(0), flat.max(0)
+        offset = ((high + low) / 2).astype(np.float32)
+        scale = np.maximum((high - low) / (2 * 32767), np.finfo(np.float32).tiny).astype(np.float32)
+        seq = np.clip(np.rint((seq - offset) / scale), -32767, 32767)
+    return np.ascontiguousarray(seq, dtype=CODECS[codec]), scale, offset
+
+
+def decode(stored, codec, scale, offset):
+    # -> T, V, C float32 (a view of stored for float32)
+    if codec == 'float32':
+        return stored
+    if codec == 'float16':
+        return stored.astype(np.float32)
+    return stored.astype(np.float32) * scale + offset
+
+
+def write_store(path, skeletons, names, labels_14, labels_28, codec='float32'):
+    '''
+
+    :param path: store prefix, e.g. root/aug4_train
+    :param skeletons: list of C, T, V, M (or T, V, C) arrays
+    :param names: list of "{g}_{f}_{sub}_{e}" strings, one per sample
+    :param labels_14: list of int (already 0 based)
+    :param labels_28: list of int (already 0 based)
+    :param codec: float32, float16 or int16, see CODECS
+    :return: number of samples written
+    '''
+    if not len(skeletons) == len(names) == len(labels_14) == len(labels_28):
+        raise ValueError('skeletons/names/labels have different lengths ({}, {}, {}, {})'.format(
+            len(skeletons), len(names), len(labels_14), len(labels_28)))
+    coords_path, index_path = store_paths(path)
+    coords_path.parent.mkdir(parents=True, exist_ok=True)
+
+    lengths = np.zeros(len(skeletons), dtype=np.int64)
+    joint_n, joint_d = 22, 3
+    scales, offsets_c = [], []
+    with open(coords_path, 'wb') as f:
+        for i, skeleton in enumerate(skeletons):
+            seq = to_sequence(skeleton)
+            lengths[i] = seq.shape[0]
+            joint_n, joint_d = seq.shape[1], seq.shape[2]
+            stored, scale, offset = encode(seq, codec)
+            scales.append(scale)
+            offsets_c.append(offset)
+            f.write(stored.tobytes())
+    offsets = np.zeros(len(skeletons), dtype=np.int64)
+    offsets[1:] = np.cumsum(lengths)[:-1]
+
+    write_index(index_path, offsets, lengths, labels_14, labels_28, names, (joint_n, joint_d),
+                codec, np.reshape(scales, (-1, joint_d)), np.reshape(offsets_c, (-1, joint_d)))
+    return len(skeletons)
+
+
+def write_index(index_path, offsets, lengths, labels_14, labels_28, names, shape, codec='float32',
+                coord_scale=None, coord_offset=None):
+    if coord_scale is None:
+        coord_scale = np.ones((len(offsets), shape[1]), dtype=np.float32)
+    if coord_offset is None:
+        coord_offset = np.zeros((len(offsets), shape[1]), dtype=np.float32)
+    np.savez(index_path,
+             offsets=np.asarray(offsets, dtype=np.int64),
+             lengths=np.asarray(lengths, dtype=np.int64),
+             label_14=np.asarray(labels_14, dtype=np.int64),
+             label_28=np.asarray(labels_28, dtype=np.int64),
+             names=np.asarray(names, dtype=str),
+             shape=np.array(shape, dtype=np.int64),
+             codec=np.array(codec),
+             coord_scale=np.asarray(coord_scale, dtype=np.float32),
+             coord_offset=np.asarray(coord_offset, dtype=np.float32))
+
+
+def read_index(path):
+    _, index_path = store_paths(path)
+    with np.load(index_path) as index:
+        index = {key: index[key] for key in index.files}
+    # stores written before the codecs existed are plain float32
+    joint_d = int(index['shape'][1])
+    index.setdefault('codec', np.array('float32'))
+    index.setdefault('coord_scale', np.ones((len(index['offsets']), joint_d), dtype=np.float32))
+    index.setdefault('coord_offset', np.zeros((len(index['offsets']), joint_d), dtype=np.float32))
+    return index
+
+
+def append_store(path, skeletons, names, labels_14, labels_28):
+    '''
+    append samples to the end of an existing store, rows already in it are left untouched
+    :return: frame offsets of the appended samples
+    '''
+    if not len(skeletons) == len(names) == len(labels_14) == len(labels_28):
+        raise ValueError('skeletons/names/labels have different lengths ({}, {}, {}, {})'.format(
+            len(skeletons), len(names), len(labels_14), len(labels_28)))
+    coords_path, index_path = store_paths(path)
+    index = read_index(path)
+    joint_n, joint_d = (int(s) for s in index['shape'])
+    codec = str(index['codec'])
+
+    # the buffer may hold frames of rows dropped from the index, so append after its real end
+    begin = coords_path.stat().st_size // (joint_n * joint_d * np.dtype(CODECS[codec]).itemsize)
+    lengths = np.zeros(len(skeletons), dtype=np.int64)
+    scales = np.ones((len(skeletons), joint_d), dtype=np.float32)
+    offsets_c = np.zeros((len(skeletons), joint_d), dtype=np.float32)
+    with open(coords_path, 'ab') as f:
+        for i, skeleton in enumerate(skeletons):
+            seq = to_sequence(skeleton)
+            if seq.shape[1:] != (joint_n, joint_d):
+                raise ValueError('sample {} has {} joints x {} coords, the store has {} x {}'.format(
+                    names[i], seq.shape[1], seq.shape[2], joint_n, joint_d))
+            lengths[i] = seq.shape[0]
+            stored, scales[i], offsets_c[i] = encode(seq, codec)
+            f.write(stored.tobytes())
+    offsets = begin + np.cumsum(lengths) - lengths
+
+    write_index(index_path,
+                np.concatenate([index['offsets'], offsets]),
+                np.concatenate([index['lengths'], lengths]),
+                np.concatenate([index['label_14'], labels_14]),
+                np.concatenate([index['label_28'], labels_28]),
+                np.concatenate([index['names'], np.asarray(names, dtype=str)]),
+                (joint_n, joint_d), codec,
+                np.concatenate([index['coord_scale'], scales]),
+                np.concatenate([index['coord_offset'], offsets_c]))
+    return offsets
+
+
+def keep_rows(path, offsets):
+    '''
+    drop every index row whose frame offset is not in offsets (their frames stay in the buffer)
+    :return: number of rows dropped
+    '''
+    _, index_path = store_paths(path)
+    index = read_index(path)
+    keep = np.isin(index['offsets'], np.asarray(offsets, dtype=np.int64))
+    if keep.all():
+        return 0
+    write_index(index_path, index['offsets'][keep], index['lengths'][keep], index['label_14'][keep],
+                index['label_28'][keep], index['names'][keep], index['shape'], str(index['codec']),
+                index['coord_scale'][keep], index['coord_offset'][keep])
+    return int((~keep).sum())
+
+
+class SkeletonStore:
+    """Read only view of a split written by write_store.
+
+    The coordinate buffer is opened with np.memmap, so opening is instant and every process
+    (DataLoader workers included) reads the same page cache instead of holding its own copy.
+    Indexing returns C, T, V, M float32 arrays, the same layout as the old pickled lists (views
+    of the memmap for float32 stores, decoded copies for float16/int16 ones).
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.coords_path, self.index_path = store_paths(self.path)
+        index = read_index(self.path)
+        self.offsets = index['offsets']
+        self.lengths = index['lengths']
+        self.label_14 = index['label_14']
+        self.label_28 = index['label_28']
+        self.names = index['names']
+        self.joint_n, self.joint_d = (int(s) for s in index['shape'])
+        self.codec = str(index['codec'])
+        self.coord_scale = index['coord_scale']
+        self.coord_offset = index['coord_offset']
+        self._coords = None
+
+    @property
+    def coords(self):
+        # opened lazily, so a pickled store (spawned workers) maps the file again instead of copying it
+        if self._coords is None:
+            total = int((self.offsets + self.lengths).max()) if len(self.offsets) else 0
+            if total == 0:
+                self._coords = np.empty((0, self.joint_n, self.joint_d), dtype=CODECS[self.codec])
+            else:
+                self._coords = np.memmap(self.coords_path, dtype=CODECS[self.codec], mode='r',
+                                         shape=(total, self.joint_n, self.joint_d))
+        return self._coords
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_coords'] = None
+        return state
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def sequence(self, i):
+        # T, V, C float32, a view of the memmap unless the store is float16/int16 encoded
+        begin = self.offsets[i]
+        return decode(self.coords[begin:begin + self.lengths[i]], self.codec,
+                      self.coord_scale[i], self.coord_offset[i])
+
+    def __getitem__(self, i):
+        # C, T, V, M
+        return np.transpose(self.sequence(i), (2, 0, 1))[..., np.newaxis]
+
+    def labels(self, label_level):
+        if int(label_level) == 14:
+            return self.label_14
+        elif int(label_level) == 28:
+            return self.label_28
+        raise ValueError('label_level must be 14 or 28 (got {})'.format(label_level))
+
+
+def convert_store(path, out_path, codec):
+    # re-encode a store with another codec, e.g. root/val -> root/val_int16
+    store = SkeletonStore(path)
+    # the store itself is iterated, so only one decoded sample is held at a time
+    return write_store(out_path, store, store.names, store.label_14, store.label_28, codec)
+
+
+def convert_pickles(root, data_level):
+    # one-off conversion of an existing {data_level}_skeleton.pkl + label pickles
+    root = Path(root)
+    with open(root / F"{data_level}_skeleton.pkl", 'rb') as f:
+        skeletons = pickle.load(f)
+    with open(root / F"{data_level}_label_14.pkl", 'rb') as f:
+        names, labels_14 = pickle.load(f)
+    with open(root / F"{data_level}_label_28.pkl", 'rb') as f:
+        _, labels_28 = pickle.load(f)
+
+    # old gendata only kept one name per gesture for the augmented copies
+    if len(names) != len(skeletons):
+        if len(names) and len(skeletons) % len(names) == 0:
+            names = list(np.repeat(names, len(skeletons) // len(names)))
+        else:
+            names = [''] * len(skeletons)
+    return write_store(root / data_level, skeletons, names, labels_14, labels_28)
+
+
+if __name__ == '__main__':
+    import sys
+    root = 'C:/ML/dataset/HandGestureDataset_SHREC2017/'
+    for data_level in (sys.argv[1:] or ['aug4_train', 'val']):
+        print(data_level, convert_pickles(root, data_level))
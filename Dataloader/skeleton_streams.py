@@ -0,0 +1,81 @@
+import numpy as np
+import torch
+from torch.utils.data import TensorDataset
+
+import utils
+
+
+# joint: raw joints, bone: decouple_spatial over hand_edge, motion: decouple_temporal, jcd: get_CG
+STREAMS = ('joint', 'bone', 'motion', 'jcd')
+
+
+def bone_stream(joint, hand_edge):
+    # N, T, V, C
+    return utils.decouple_spatial(joint, hand_edge)
+
+
+def motion_stream(joint):
+    # N, T, V, C, the last frame is zero padded so the stream keeps frame_l frames
+    diff = np.moveaxis(utils.decouple_temporal(np.moveaxis(joint, 1, 0), 1), 0, 1)
+    out = np.zeros_like(joint)
+    out[:, :diff.shape[1]] = diff
+    return out
+
+
+def jcd_stream(joint, chunk=256):
+    # N, T, V*(V-1)/2, get_CG for every sample, in chunks to bound the pairwise buffer
+    N, T, V, C = joint.shape
+    iu = np.triu_indices(V, 1, V)
+    out = np.empty((N, T, len(iu[0])), dtype=joint.dtype)
+    for begin in range(0, N, chunk):
+        p = joint[begin:begin + chunk]
+        d_m = np.sqrt(((p[:, :, iu[0]] - p[:, :, iu[1]]) ** 2).sum(-1))
+        mean = d_m.reshape(len(p), -1).mean(-1)[:, None, None]
+        out[begin:begin + chunk] = (d_m - mean) / mean  # norm_scale
+    return out
+
+
+class SkeletonStreams:
+    """Joints of a split plus the streams derived from them.
+
+    Only the joints are stored up front, the other streams are computed the first time a model
+    asks for them and then kept.
+    """
+
+    def __init__(self, joint, label, C):
+        self.C = C
+        self.label = np.asarray(label)
+        self.streams = {'joint': np.ascontiguousarray(joint, dtype=np.float32)}
+
+    def __len__(self):
+        return len(self.label)
+
+    def __getitem__(self, name):
+        if name not in self.streams:
+            joint = self.streams['joint']
+            if name == 'bone':
+                stream = bone_stream(joint, self.C.hand_edge)
+            elif name == 'motion':
+                stream = motion_stream(joint)
+            elif name == 'jcd':
+                stream = jcd_stream(joint)
+            else:
+                raise KeyError('unknown stream {} (expected one of {})'.format(name, STREAMS))
+            self.streams[name] = stream.astype(np.float32, copy=False)
+        return self.streams[name]
+
+    def tensor(self, name):
+        # shares memory with the numpy stream
+        return torch.from_numpy(self[name])
+
+    def labels(self):
+        return torch.from_numpy(self.label).long()
+
+    def dataset(self, names=('joint',)):
+        # TensorDataset of the requested streams followed by the label
+        return TensorDataset(*[self.tensor(name) for name in names], self.labels())
+
+
+def model_streams(model):
+    # the streams a model's forward expects, in order
+    return tuple(getattr(model, 'input_streams', ('joint',)))
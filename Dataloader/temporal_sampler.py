@@ -0,0 +1,124 @@
+import numpy as np
+import torch
+
+import utils
+from Dataloader import skeleton_store
+
+
+# Batched, on-device versions of utils.uniform_sample_np / random_sample_np / random_choose_simple.
+# Every function works on a B, T, V, C batch of zero-padded sequences plus their lengths and
+# builds (B, size) frame indices, so a whole batch is windowed with one torch.gather wherever it
+# lives. Sequences shorter than the window repeat their last frame (the numpy crop returns them
+# shorter instead, which a batch can't hold).
+MODES = ('uniform', 'random', 'crop', 'center')
+
+
+def sample_indices(lengths, size, mode='uniform', generator=None):
+    '''
+    :param lengths: B frames of every sequence (tensor, on the device the indices are wanted on)
+    :param size: frames to pick
+    :param mode: uniform - evenly spaced frames (uniform_sample_np)
+                 random  - sorted random frames, with replacement (random_sample_np)
+                 crop    - size consecutive frames at a random start (random_choose_simple)
+                 center  - size consecutive frames in the middle (random_choose_simple, center=True)
+    :return: B, size long tensor
+    '''
+    lengths = torch.as_tensor(lengths).long()
+    device = lengths.device
+    L = lengths.clamp(min=1).unsqueeze(1)
+    steps = torch.arange(size, device=device).unsqueeze(0)
+    if mode == 'uniform':
+        # int(i * (T / size)) in float64, the same frames as uniform_sample_np
+        return (steps.double() * (L.double() / size)).long()
+    if mode == 'random':
+        draw = torch.rand(len(lengths), size, device=device, generator=generator)
+        return (draw * L).long().clamp(max=L - 1).sort(dim=1).values
+    if mode == 'crop':
+        room = (L - size).clamp(min=0) + 1
+        begin = (torch.rand(len(lengths), 1, device=device, generator=generator) * room).long()
+    elif mode == 'center':
+        begin = (L - size).clamp(min=0) // 2
+    else:
+        raise ValueError('mode must be one of {} (got {})'.format(MODES, mode))
+    return torch.minimum(begin + steps, L - 1)
+
+
+def gather_frames(x, index):
+    # x: B, T, V, C, index: B, size -> B, size, V, C
+    B, T, V, C = x.shape
+    index = index.to(x.device)
+    return torch.gather(x, 1, index[:, :, None, None].expand(-1, -1, V, C))
+
+
+class TemporalSampler:
+    """Store_Dataset's window_size windowing for a whole batch: resample to window_size frames (uniform, or
+    random with random_choose), then take frame_l of them (random crop, or the center with
+    center_choose). The two steps are composed on the indices, the data is gathered once.
+    A new draw on every call, so every epoch sees fresh windows of the full-length sequences.
+    """
+
+    def __init__(self, frame_l, window_size=150, random_choose=False, center_choose=False, seed=None):
+        self.frame_l = min(frame_l, window_size)
+        self.window_size = window_size
+        self.random_choose = random_choose
+        self.center_choose = center_choose
+        self.seed = seed
+        self.generators = {}
+
+    def generator(self, device):
+        # one generator per device, seeded, so windows are reproducible when seed is given
+        if self.seed is None:
+            return None
+        device = torch.device(device)
+        if device not in self.generators:
+            self.generators[device] = torch.Generator(device=device)
+            self.generators[device].manual_seed(self.seed)
+        return self.generators[device]
+
+    def indices(self, lengths):
+        lengths = torch.as_tensor(lengths).long()
+        generator = self.generator(lengths.device)
+        window = sample_indices(lengths, self.window_size, 'random' if self.random_choose else 'uniform', generator)
+        window_lengths = torch.full_like(lengths, self.window_size)
+        crop = sample_indices(window_lengths, self.frame_l, 'center' if self.center_choose else 'crop', generator)
+        return torch.gather(window, 1, crop)
+
+    def __call__(self, x, lengths):
+        return gather_frames(x, self.indices(torch.as_tensor(lengths).to(x.device)))
+
+
+def padded_split(data, max_len=None):
+    '''
+    every sequence of a SkeletonStore / SkeletonArchive / RawSplit (or a list of C, T, V, M
+    skeletons), zero-padded to the longest one
+    :param max_len: thin longer sequences to max_len frames (uniform), bounds the padded size
+    :return: N, T, V, C float32 tensor, N lengths
+    '''
+    seqs = [data.sequence(i) if hasattr(data, 'sequence') else skeleton_store.to_sequence(data[i])
+            for i in range(len(data))]
+    if max_len is not None:
+        seqs = [utils.uniform_sample_np(s, max_len) if len(s) > max_len else s for s in seqs]
+    lengths = np.array([len(s) for s in seqs], dtype=np.int64)
+    V, C = next((s.shape[1:] for s in seqs if len(s)), (22, 3))
+    X = np.zeros((len(seqs), max(int(lengths.max(initial=0)), 1), V, C), dtype=np.float32)
+    for i, s in enumerate(seqs):
+        X[i, :len(s)] = s
+    return torch.from_numpy(X), torch.from_numpy(lengths)
+
+
+if __name__ == '__main__':
+    import time
+    lengths = torch.randint(20, 300, (256,))
+    x = torch.randn(256, 300, 22, 3)
+    for mode, reference in (('uniform', utils.uniform_sample_np), ('center', lambda s, n: utils.random_choose_simple(s, n, center=True))):
+        index = sample_indices(lengths, 120, mode)
+        out = gather_frames(x, index)
+        # the numpy crop keeps short sequences short, compare the frames it returns
+        refs = [reference(x[i, :int(lengths[i])].numpy(), 120) for i in range(len(x))]
+        same = all(np.array_equal(out[i, :len(ref)].numpy(), ref) for i, ref in enumerate(refs))
+        print(mode, 'matches numpy' if same else 'DIFFERS from numpy')
+    sampler = TemporalSampler(120)
+    start = time.time()
+    for _ in range(100):
+        sampler(x, lengths)
+    print('TemporalSampler: {:.2f} ms per batch of {}'.format((time.time() - start) * 10, len(x)))
@@ -0,0 +1,131 @@
+import os
+import json
+import time
+import shutil
+import threading
+import hashlib
+import numpy as np
+from pathlib import Path
+
+
+def file_sha1(path, chunk=1 << 22):
+    h = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(chunk), b''):
+            h.update(block)
+    return h.hexdigest()
+
+
+class TensorCache:
+    """On-disk cache of preprocessed float32 tensors, one directory of .npy files per key.
+
+    Entries are evicted least recently used first once the cache grows past max_bytes.
+    """
+
+    def __init__(self, cache_dir, max_bytes=4 * 1024 ** 3):
+        self.cache_dir = Path(cache_dir)
+        self.max_bytes = max_bytes
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        self.hash_file = self.cache_dir / 'source_hashes.json'
+
+    def source_hash(self, paths):
+        # sha1 of the source files, only recomputed when a file's size or mtime changed
+        try:
+            known = json.loads(self.hash_file.read_text())
+        except (OSError, ValueError):
+            known = {}
+        h = hashlib.sha1()
+        changed = False
+        for path in sorted(str(p) for p in paths):
+            st = os.stat(path)
+            entry = known.get(path)
+            if entry is None or entry['size'] != st.st_size or entry['mtime'] != st.st_mtime_ns:
+                entry = {'size': st.st_size, 'mtime': st.st_mtime_ns, 'sha1': file_sha1(path)}
+                known[path] = entry
+                changed = True
+            h.update(entry['sha1'].encode())
+        if changed:
+            tmp = self.hash_file.with_suffix('.tmp{}_{}'.format(os.getpid(), threading.get_ident()))
+            tmp.write_text(json.dumps(known))
+            os.replace(tmp, self.hash_file)
+        return h.hexdigest()
+
+    @staticmethod
+    def key(**parts):
+        return hashlib.sha1(json.dumps(parts, sort_keys=True, default=str).encode()).hexdigest()
+
+    def load(self, key):
+        entry = self.cache_dir / key
+        meta = entry / 'meta.json'
+        if not meta.exists():
+            return None
+        try:
+            names = json.loads(meta.read_text())['arrays']
+            arrays = {name: np.load(entry / (name + '.npy')) for name in names}
+        except (OSError, ValueError, KeyError, EOFError):
+            return None
+        os.utime(meta)  # mark as recently used
+        return arrays
+
+    def save(self, key, parts=None, **arrays):
+        entry = self.cache_dir / key
+        # per process and thread, splits may be built side by side (utils.Startup)
+        tmp = self.cache_dir / '{}.tmp{}_{}'.format(key, os.getpid(), threading.get_ident())
+        shutil.rmtree(tmp, ignore_errors=True)
+        tmp.mkdir()
+        for name, array in arrays.items():
+            np.save(tmp / (name + '.npy'), np.ascontiguousarray(array))
+        (tmp / 'meta.json').write_text(json.dumps({'arrays': list(arrays), 'parts': parts,
+                                                   'created': time.time()}, default=str))
+        try:
+            os.replace(tmp, entry)
+        except OSError:
+            # the entry exists: written by another process first, or left unreadable (truncated
+            # .npy or meta.json after a crash or a full disk), which load() can't use, replace it
+            if self.load(key) is None:
+                shutil.rmtree(entry, ignore_errors=True)
+                try:
+                    os.replace(tmp, entry)
+                except OSError:
+                    pass
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict(keep=key)
+
+    def entries(self):
+        out = []
+        for entry in self.cache_dir.iterdir():
+            meta = entry / 'meta.json'
+            if entry.is_dir() and meta.exists():
+                size = sum(f.stat().st_size for f in entry.iterdir())
+                out.append((meta.stat().st_mtime, size, entry))
+        return sorted(out)
+
+    def evict(self, keep=None):
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in entries:
+            if total <= self.max_bytes:
+                break
+            if entry.name == keep:
+                continue
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+
+if __name__ == '__main__':
+    import tempfile
+    with tempfile.TemporaryDirectory() as root:
+        cache = TensorCache(root)
+        key = TensorCache.key(split='train')
+        x = np.arange(24, dtype=np.float32).reshape(2, 3, 4)
+        cache.save(key, x=x)
+        assert np.array_equal(cache.load(key)['x'], x)
+        # a corrupt entry (truncated array, then unreadable meta.json) is rewritten by the next save
+        for corrupt in ('x.npy', 'meta.json'):
+            path = Path(root) / key / corrupt
+            path.write_bytes(path.read_bytes()[:len(path.read_bytes()) // 2])
+            assert cache.load(key) is None, corrupt
+            cache.save(key, x=x)
+            assert np.array_equal(cache.load(key)['x'], x), corrupt
+        assert [p.name for p in Path(root).iterdir() if '.tmp' in p.name] == []
+    print('ok')
@@ -251,6 +251,9 @@ class iAFF(nn.Module):
 
 
 class Dylan_MT_Net(nn.Module):
+    # streams (see Dataloader/skeleton_streams.py) passed to forward, in order
+    input_streams = ('joint',)
+
     def __init__(self, in_channels, out_channels, num_class, num_node=22, num_frame=64, n_layers=2, attn_heads=4, dropout=0.05, l_dropout=0.2):
         super(Dylan_MT_Net, self).__init__()
         self.out_channels = out_channels
@@ -1,5 +1,6 @@
 from torchsummary import summary  # noqa
 from pathlib import Path
+import atexit
 import numpy as np
 import utils
 from utils import makedir
@@ -14,6 +15,8 @@ from torch.utils.data import TensorDataset, DataLoader
 from MODEL.dylan_net_v7 import Dylan_MT_Net
 # from Dataloader.Shrec_dataset import load_shrec_data, Sdata_generator, SConfig
 from Dataloader.skeleton_loader import SConfig, Sdata_generator
+from Dataloader.tensor_cache import TensorCache
+from Dataloader.shared_split import shared_splits
 import torch
 
 import torch.nn as nn
@@ -79,24 +82,20 @@ def net_train(net, train_loader, parameters, dtype, device):
 
 
 def train_evaluate(parameterization):
-    train_data_generator = Sdata_generator('train', 28)  # aug
-    test_data_generator = Sdata_generator('val', 28)
-
     Config = SConfig(parameterization.get("num_frame", 120))
     best_acc = 0
     best_epoch = 0
     # Train, Test = load_data()
-    X_0, X_1, X_2, Y = train_data_generator(Config, False)
-    X_0 = torch.from_numpy(X_0).type('torch.FloatTensor')
-    Y = torch.from_numpy(Y).type('torch.LongTensor')
-
-    X_0_t, X_1_t, X_2_t, Y_t = test_data_generator(Config)
-    X_0_t = torch.from_numpy(X_0_t).type('torch.FloatTensor')
-    Y_t = torch.from_numpy(Y_t).type('torch.LongTensor')
+    # acquired by the first trial with this num_frame, later trials reuse it
+    if Config.frame_l not in splits_by_frame:
+        splits_by_frame[Config.frame_l] = shared_splits('train', 'val', 28, Config, cache=cache)
+        # released at exit, also when a trial fails or the search is interrupted
+        atexit.register(splits_by_frame[Config.frame_l].close)
+    splits = splits_by_frame[Config.frame_l]
 
-    trainset = TensorDataset(X_0, Y)
+    trainset = TensorDataset(splits.tensor('train_X'), splits.tensor('train_Y'))
 
-    testset = TensorDataset(X_0_t, Y_t)
+    testset = TensorDataset(splits.tensor('val_X'), splits.tensor('val_Y'))
     test_loader = DataLoader(
         testset, batch_size=1000)
     # constructing a new training data loader allows us to tune the batch size
@@ -114,17 +113,21 @@ def train_evaluate(parameterization):
                             parameters=parameterization, dtype=dtype, device=device)
 
     # return the accuracy of the model as it was trained in this run
-    return evaluate(
+    acc = evaluate(
         net=trained_net,
         data_loader=test_loader,
         dtype=dtype,
         device=device,
     )
+    return acc
 
 
 # torch.cuda.set_device(0) #this is sometimes necessary for me
 dtype = torch.float
 device = torch.device('cuda' if torch.cuda.is_available() else 'cpu')
+# shared memory splits of this process by num_frame, each closed at exit
+cache = TensorCache('C:/ML/dataset/HandGestureDataset_SHREC2017/cache')
+splits_by_frame = {}
 
 best_parameters, values, experiment, model = optimize(
     parameters=[
@@ -2,6 +2,7 @@ from bayes_opt import BayesianOptimization
 import torch
 import torch.nn as nn
 import sys
+import atexit
 import time
 import numpy as np
 import logging
@@ -20,7 +21,9 @@ from torch.utils.data import TensorDataset, DataLoader
 #from MODEL.dstanet import DSTANet
 from MODEL.dylan_net_v10 import Dylan_MT_Net
 # from Dataloader.Shrec_dataset import load_shrec_data, Sdata_generator, SConfig
-from Dataloader.skeleton_loader import SConfig, Sdata_generator, Hand_Dataset
+from Dataloader.skeleton_loader import SConfig, Sdata_generator, Hand_Dataset, batch_collate
+from Dataloader.tensor_cache import TensorCache
+from Dataloader.shared_split import shared_splits, Shared_Dataset
 
 
 def train( model, device, train_loader, optimizer, epoch, criterion):
@@ -76,32 +79,16 @@ def main(att_drop, l_drop, weight_decay):
 
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-    Config = SConfig(frame_size)
+    best_acc = 0
 
-    train_data_generator = Sdata_generator('aug4_train', clc_num) #aug
-    test_data_generator = Sdata_generator('val', clc_num)
+    # trainset = train_streams.dataset(('joint', 'bone', 'motion'))
+    trainset = Shared_Dataset(splits, 'train', frame_size, use_data_aug=False, batched=True)
+    train_loader = DataLoader(trainset, batch_size=batch_size, shuffle=True, collate_fn=batch_collate)
 
-    best_acc = 0
-    X_0,X_1,X_2, Y = train_data_generator(Config)
-    X_0 = torch.from_numpy(X_0).type('torch.FloatTensor')
-    X_1 = torch.from_numpy(X_1).type('torch.FloatTensor')
-    X_2 = torch.from_numpy(X_2).type('torch.FloatTensor')
-    Y = torch.from_numpy(Y).type('torch.LongTensor')
-
-    X_0_t,X_1_t,X_2_t, Y_t = test_data_generator(Config)
-    X_0_t = torch.from_numpy(X_0_t).type('torch.FloatTensor')
-    X_1_t = torch.from_numpy(X_1_t).type('torch.FloatTensor')
-    X_2_t = torch.from_numpy(X_2_t).type('torch.FloatTensor')
-    Y_t = torch.from_numpy(Y_t).type('torch.LongTensor')
-
-    # trainset = TensorDataset(X_0, X_1, X_2, Y)
-    trainset = Hand_Dataset(X_0, Y, frame_size, use_data_aug=False)
-    train_loader = DataLoader(trainset, batch_size=batch_size, shuffle=True)
-
-    # testset = TensorDataset(X_0_t, X_1_t, X_2_t, Y_t)
-    testset = Hand_Dataset(X_0_t, Y_t, frame_size, use_data_aug=False)
+    # testset = test_streams.dataset(('joint', 'bone', 'motion'))
+    testset = Shared_Dataset(splits, 'val', frame_size, use_data_aug=False, batched=True)
     test_loader = DataLoader(
-        testset, batch_size=1000)
+        testset, batch_size=1000, collate_fn=batch_collate)
 
 
     # Net = DSTANet(config=config)
@@ -144,6 +131,12 @@ def main(att_drop, l_drop, weight_decay):
 
 if __name__ == '__main__':
     #batch_size, mid_layer, att_drop, l_drop, lr, weight_decay, patience, label_smoothing,
+    # the split is the same for every trial: acquired once per process (or mapped from a parallel
+    # search that already published it) and released at exit, also when the search fails or is
+    # interrupted (a reference left behind keeps the segment alive after the process is gone)
+    cache = TensorCache('C:/ML/dataset/HandGestureDataset_SHREC2017/cache')
+    splits = shared_splits('aug4_train', 'val', 14, SConfig(120), cache=cache)
+    atexit.register(splits.close)
 
     rf_bo = BayesianOptimization(
         main,
@@ -20,16 +20,20 @@ from torch.utils.data import TensorDataset, DataLoader
 from MODEL.dylan_net_v12 import Dylan_MT_Net
 # from Dataloader.Shrec_dataset import load_shrec_data, Sdata_generator, SConfig
 from Dataloader.skeleton_loader import SConfig, Sdata_generator
+from Dataloader.tensor_cache import TensorCache
+from Dataloader.skeleton_streams import model_streams
+from Dataloader.prefetcher import DevicePrefetcher
 
 
 def train(args, model, device, train_loader, optimizer, epoch, criterion, logging):
     model.train()
     train_loss = 0
     # ls = utils.LabelSmoothing()
-    for batch_idx, (data1, data2, data3, target) in enumerate(tqdm(train_loader)):
-        data1, data2, data3, target = data1.to(device), data2.to(device), data3.to(device), target.to(device)
+    for batch_idx, (*inputs, target) in enumerate(tqdm(train_loader)):
+        # only the streams the model declared are in the batch
+        inputs, target = [x.to(device) for x in inputs], target.to(device)
         optimizer.zero_grad()
-        output = model(data1)
+        output = model(*inputs)
         loss = criterion(output, target)
         # loss = ls(output, target)
         # L1_reg = 0
@@ -41,7 +45,7 @@ def train(args, model, device, train_loader, optimizer, epoch, criterion, loggin
         optimizer.step()
         if batch_idx % args.log_interval == 0:
             msg = ('Train Epoch: {} [{}/{} ({:.0f}%)]\tLoss: {:.6f}\tLr:{}'.format(
-                epoch, batch_idx * len(data1), len(train_loader.dataset),
+                epoch, batch_idx * len(target), len(train_loader.dataset),
                 100. * batch_idx / len(train_loader), loss.item(), optimizer.state_dict()['param_groups'][0]['lr']))
             print(msg)
             logging.info(msg)
@@ -55,9 +59,9 @@ def test(model, device, test_loader, logging, criterion):
     test_loss = 0
     correct = 0
     with torch.no_grad():
-        for _, (data1, data2, data3, target) in enumerate(tqdm(test_loader)):
-            data1, data2, data3, target = data1.to(device), data2.to(device), data3.to(device), target.to(device)
-            output = model(data1)
+        for _, (*inputs, target) in enumerate(tqdm(test_loader)):
+            inputs, target = [x.to(device) for x in inputs], target.to(device)
+            output = model(*inputs)
             # sum up batch loss
             test_loss += criterion(output, target).item()
             # get the index of the max log-probability
@@ -82,9 +86,9 @@ def test_val(model, device, test_loader, logging, criterion):
     test_loss = 0
     correct = 0
     with torch.no_grad():
-        for _, (data1, data2, data3, target) in enumerate(tqdm(test_loader)):
-            data1, data2, data3, target = data1.to(device), data2.to(device), data3.to(device), target.to(device)
-            output = model(data1)
+        for _, (*inputs, target) in enumerate(tqdm(test_loader)):
+            inputs, target = [x.to(device) for x in inputs], target.to(device)
+            output = model(*inputs)
             # sum up batch loss
             test_loss += criterion(output, target).item()
             # get the index of the max log-probability
@@ -134,30 +138,26 @@ def main(logging, dataset_aug, clc_num, parser):
     best_acc = 0
     best_epoch = 0
     # Train, Test = load_data()
-    X_0,X_1,X_2, Y = train_data_generator(Config)
-    X_0 = torch.from_numpy(X_0).type('torch.FloatTensor')
-    X_1 = torch.from_numpy(X_1).type('torch.FloatTensor')
-    X_2 = torch.from_numpy(X_2).type('torch.FloatTensor')
-    Y = torch.from_numpy(Y).type('torch.LongTensor')
-
-    X_0_t,X_1_t,X_2_t, Y_t = test_data_generator(Config)
-    X_0_t = torch.from_numpy(X_0_t).type('torch.FloatTensor')
-    X_1_t = torch.from_numpy(X_1_t).type('torch.FloatTensor')
-    X_2_t = torch.from_numpy(X_2_t).type('torch.FloatTensor')
-    Y_t = torch.from_numpy(Y_t).type('torch.LongTensor')
-
-    trainset = TensorDataset(X_0, X_1, X_2, Y)
-    train_loader = DataLoader(trainset, **kwargs)
-
-    testset = TensorDataset(X_0_t, X_1_t, X_2_t, Y_t)
-    test_loader = DataLoader(
-        testset, batch_size=args.test_batch_size)
-
+    cache = TensorCache(args.cache_dir) if args.cache_dir else None
+    train_streams = train_data_generator(Config, cache=cache, seed=args.seed)
+    test_streams = test_data_generator(Config, cache=cache, seed=args.seed)
 
     # Net = DSTANet(config=config)#
     Net = Dylan_MT_Net(8, args.mid_layer, clc_num, n_layers=args.net_layer)
     model = Net.to(device)
 
+    # only the streams the model takes are built and batched
+    trainset = train_streams.dataset(model_streams(Net))
+    train_loader = DataLoader(trainset, **kwargs)
+
+    testset = test_streams.dataset(model_streams(Net))
+    test_loader = DataLoader(
+        testset, batch_size=args.test_batch_size)
+    if args.prefetch:
+        # batches are staged (pinned) and copied to the device while the previous step runs
+        train_loader = DevicePrefetcher(train_loader, device, args.prefetch)
+        test_loader = DevicePrefetcher(test_loader, device, args.prefetch)
+
     optimizer = Adam(model.parameters(), lr=args.lr, betas=(0.9, 0.999), weight_decay=args.weight_decay, amsgrad=False) # 0.001
     # optimizer = SGD(model.parameters(),lr=args.lr, momentum=0.9, weight_decay=args.weight_decay, nesterov=True)
 
@@ -226,6 +226,10 @@ if __name__ == '__main__':
     parser.add_argument('--mid_layer', type=int, default=4)
     parser.add_argument('--warm_up_epoch', type=int, default=5)
     parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--cache_dir', type=str, default='C:/ML/dataset/HandGestureDataset_SHREC2017/cache',
+                        help='preprocessed tensor cache, empty to disable')
+    parser.add_argument('--prefetch', type=int, default=2,
+                        help='batches staged ahead on the device by a background thread, 0 to disable')
     parser.add_argument('--log-interval', type=int, default=5, metavar='N',
                         help='how many batches to wait before logging training status')
     parser.add_argument('--save-model', action='store_true', default=False,
@@ -19,16 +19,25 @@ from torch.utils.data import TensorDataset, DataLoader
 #from MODEL.dstanet import DSTANet
 from MODEL.dylan_net_v7 import Dylan_MT_Net
 # from Dataloader.Shrec_dataset import load_shrec_data, Sdata_generator, SConfig
-from Dataloader.skeleton_loader import SConfig, Sdata_generator, Hand_Dataset
+from Dataloader.skeleton_loader import SConfig, Sdata_generator, Hand_Dataset, Store_Dataset, worker_init_fn, batch_collate
+from Dataloader.tensor_cache import TensorCache
+from Dataloader.shrec_raw import RawSplit
+from Dataloader.device_loader import DeviceLoader
+from Dataloader.echo_loader import EchoLoader
+from Dataloader.prefetcher import DevicePrefetcher
+from Dataloader.temporal_sampler import TemporalSampler, padded_split
 
 
 def train(args, model, device, train_loader, optimizer, epoch, criterion, logging):
     model.train()
     train_loss = 0
     correct = 0
+    # samples actually stepped on, more than the dataset when batches are echoed
+    seen = 0
     # ls = utils.LabelSmoothing()
     for batch_idx, (data1, target) in enumerate(tqdm(train_loader)):
         data1, target = data1.to(device), target.to(device)
+        seen += len(data1)
         optimizer.zero_grad()
         output = model(data1)
         loss = criterion(output, target)
@@ -48,10 +57,10 @@ def train(args, model, device, train_loader, optimizer, epoch, criterion, loggin
                 100. * batch_idx / len(train_loader), loss.item(), optimizer.state_dict()['param_groups'][0]['lr']))
             print(msg)
             logging.info(msg)
-    train_loss /= len(train_loader.dataset)
+    train_loss /= max(seen, 1)
     msg = ('Val set: Average loss: {:.6f}, Accuracy: {}/{} ({:.2f}%)\n'.format(
-        train_loss, correct, len(train_loader.dataset),
-        100. * correct / len(train_loader.dataset)))
+        train_loss, correct, seen,
+        100. * correct / max(seen, 1)))
     print(msg)
     logging.info(msg)
 
@@ -123,7 +132,8 @@ def main(logging, dataset_aug, parser, savedir):
 
     device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
 
-    kwargs = {'batch_size': args.batch_size}
+    # batched Hand_Dataset hands out whole batches (__getitems__), batch_collate unpacks them
+    kwargs = {'batch_size': args.batch_size, 'collate_fn': batch_collate}
     if use_cuda:
         kwargs.update({'num_workers': 1,
                        'shuffle': True},)
@@ -133,43 +143,95 @@ def main(logging, dataset_aug, parser, savedir):
     # load_data = load_shrec_data
 
 
-    train_data_generator = Sdata_generator('aug4_train', clc_num) #aug
-    test_data_generator = Sdata_generator('val', clc_num)
 
     best_acc = 0
     best_epoch = 0
     test_loss_out = 0
-    # Train, Test = load_data()
-    X_0,X_1,X_2, Y = train_data_generator(Config)
-    X_0 = torch.from_numpy(X_0).type('torch.FloatTensor')
-    X_1 = torch.from_numpy(X_1).type('torch.FloatTensor')
-    X_2 = torch.from_numpy(X_2).type('torch.FloatTensor')
-    Y = torch.from_numpy(Y).type('torch.LongTensor')
-    print(X_0.shape)
-
-    X_0_t,X_1_t,X_2_t, Y_t = test_data_generator(Config)
-    X_0_t = torch.from_numpy(X_0_t).type('torch.FloatTensor')
-    X_1_t = torch.from_numpy(X_1_t).type('torch.FloatTensor')
-    X_2_t = torch.from_numpy(X_2_t).type('torch.FloatTensor')
-    Y_t = torch.from_numpy(Y_t).type('torch.LongTensor')
-
-    # trainset = TensorDataset(X_0, Y)
-    trainset = Hand_Dataset(X_0, Y, args.frame_size, use_data_aug=False)
-    train_loader = DataLoader(trainset, **kwargs)
-
-    # testset = TensorDataset(X_0_t, Y_t)
-    testset = Hand_Dataset(X_0_t, Y_t, args.frame_size, use_data_aug=False)
-    test_loader = DataLoader(
-        testset, batch_size=args.test_batch_size)
-
-
-    # Net = DSTANet(config=config)#
-    Net = Dylan_MT_Net(3, args.mid_layer,
-                       clc_num, num_node=22, num_frame=Config.frame_l,
-                       n_layers=args.net_layer, attn_heads=6,
-                       dropout=args.att_drop, l_dropout=args.l_drop)
-
-    model = Net.to(device)
+    cache = TensorCache(args.cache_dir) if args.cache_dir and not (args.out_of_core or args.raw_root) else None
+
+    def load_split(train_split):
+        # the generator unpickles its split, built here so that runs in the split's own Startup step
+        if not args.raw_root:
+            data_generator = Sdata_generator('aug4_train' if train_split else 'val', clc_num) #aug
+        if args.fresh_windows:
+            # full-length sequences, windowed per batch on the device (see TemporalSampler)
+            if args.raw_root:
+                data = RawSplit(args.raw_root, 'train_gestures.txt' if train_split else 'test_gestures.txt')
+                labels = data.labels(clc_num)
+            else:
+                data, labels = data_generator.data, data_generator.label
+            X, lengths = padded_split(data)
+            dataset = Hand_Dataset(X, torch.as_tensor(np.asarray(labels)), X.shape[1], use_data_aug=False, batched=True)
+            dataset.lengths = lengths
+            return dataset
+        if args.out_of_core or args.raw_root:
+            # samples are read from the memory-mapped stores batch by batch, nothing is built up front
+            if args.raw_root:
+                # straight from the SHREC tree, parsed on first access and cached per sample
+                source = RawSplit(args.raw_root, 'train_gestures.txt' if train_split else 'test_gestures.txt')
+            else:
+                source = data_generator.store_path
+            # zoomed to frame_l like the in-memory split, so the two paths see the same samples
+            return Store_Dataset(source, clc_num, Config.frame_l, seed=args.seed, batched=True)
+        # Train, Test = load_data()
+        streams = data_generator(Config, cache=cache, seed=args.seed, keyframes=args.keyframes)
+        X, Y = streams.tensor('joint'), streams.labels()
+        print(X.shape)
+        # trainset = TensorDataset(X_0, Y)
+        return Hand_Dataset(X, Y, args.frame_size, use_data_aug=False, batched=True)
+
+    def build_model():
+        # Net = DSTANet(config=config)#
+        Net = Dylan_MT_Net(3, args.mid_layer,
+                           clc_num, num_node=22, num_frame=Config.frame_l,
+                           n_layers=args.net_layer, attn_heads=6,
+                           dropout=args.att_drop, l_dropout=args.l_drop)
+        return Net.to(device)
+
+    # the val split and the model are built while the train split loads, training starts as soon
+    # as the train split and the model are there, the val split is only waited for by the first test.
+    # Training still waits for the whole train split (read, windowed, cached), batches are not
+    # handed out per shard as parts of it become ready
+    startup = utils.Startup()
+    train_future = startup.submit('train split', load_split, True)
+    test_future = startup.submit('val split', load_split, False)
+    model_future = startup.submit('model', build_model)
+    trainset = train_future.result()
+    if args.out_of_core or args.raw_root:
+        kwargs.update({'num_workers': args.workers, 'shuffle': True, 'worker_init_fn': worker_init_fn})
+    if args.fresh_windows:
+        # uniform resample to 150 frames + random crop of frame_l, a new window every epoch
+        train_loader = DeviceLoader.from_dataset(trainset, args.batch_size, device, seed=args.seed,
+                                                 lengths=trainset.lengths,
+                                                 temporal=TemporalSampler(Config.frame_l, seed=args.seed))
+    elif args.device_loader and not (args.out_of_core or args.raw_root):
+        # the whole split sits on the device, batches are gathered there
+        train_loader = DeviceLoader.from_dataset(trainset, args.batch_size, device, seed=args.seed)
+    else:
+        train_loader = DataLoader(trainset, **kwargs)
+        if args.prefetch:
+            # batches are staged (pinned) and copied to the device while the previous step runs
+            train_loader = DevicePrefetcher(train_loader, device, args.prefetch)
+    echo_loader = None
+    if args.echo > 1:
+        # every loaded batch is stepped on args.echo times, repeats freshly augmented on the device
+        train_loader = echo_loader = EchoLoader(train_loader, args.echo, device, seed=args.seed)
+    train_loader = startup.watch(train_loader)
+    test_loader = None
+
+    def make_test_loader():
+        testset = test_future.result()
+        print(len(trainset), len(testset))
+        if args.fresh_windows:
+            return DeviceLoader.from_dataset(testset, args.test_batch_size, device, shuffle=False,
+                                             lengths=testset.lengths,
+                                             temporal=TemporalSampler(Config.frame_l, center_choose=True))
+        if args.device_loader and not (args.out_of_core or args.raw_root):
+            return DeviceLoader.from_dataset(testset, args.test_batch_size, device, shuffle=False)
+        test_loader = DataLoader(testset, batch_size=args.test_batch_size, collate_fn=batch_collate)
+        return DevicePrefetcher(test_loader, device, args.prefetch) if args.prefetch else test_loader
+
+    model = model_future.result()
 
     optimizer = Adam(model.parameters(), lr=args.lr, betas=(0.9, 0.999), weight_decay=args.weight_decay, amsgrad=False) # 0.001
 
@@ -188,9 +250,19 @@ def main(logging, dataset_aug, parser, savedir):
 
     for epoch in range(1, args.epochs + 1):
         print('Epoch:', epoch)
+        trainset.set_epoch(epoch)
         train_loss = train(args, model, device, train_loader,
                            optimizer, epoch, criterion, logging)
         # test_val(model, device, train_loader, logging, criterion)
+        if echo_loader is not None:
+            logging.info(echo_loader.report())
+            print(echo_loader.report())
+            echo_loader.reset()
+        if test_loader is None:
+            test_loader = make_test_loader()
+            logging.info(startup.report())
+            print(startup.report())
+            startup.shutdown()
         acc, test_loss = test(model, device, test_loader, logging, criterion)
         #scheduler.step(train_loss)
         scheduler.step(train_loss)
@@ -247,6 +319,27 @@ if __name__ == '__main__':
 
     parser.add_argument('--warm_up_epoch', type=int, default=5)
     parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--cache_dir', type=str, default='C:/ML/dataset/HandGestureDataset_SHREC2017/cache',
+                        help='preprocessed tensor cache, empty to disable')
+    parser.add_argument('--out_of_core', action='store_true', default=False,
+                        help='read samples from the skeleton stores on demand instead of building the split in memory')
+    parser.add_argument('--workers', type=int, default=4,
+                        help='DataLoader workers for --out_of_core')
+    parser.add_argument('--device_loader', action='store_true', default=False,
+                        help='keep the in-memory split on the device and batch it there (no DataLoader)')
+    parser.add_argument('--fresh_windows', action='store_true', default=False,
+                        help='keep the full-length sequences on the device and draw new frame windows every epoch')
+    parser.add_argument('--keyframes', action='store_true', default=False,
+                        help='keep the frame_size frames with the most motion energy instead of resampling '
+                             'the whole sequence (allows a smaller --frame_size)')
+    parser.add_argument('--prefetch', type=int, default=0,
+                        help='batches staged ahead on the device by a background thread (e.g. 2), '
+                             '0 (default) keeps the plain DataLoader')
+    parser.add_argument('--echo', type=int, default=1,
+                        help='data echoing: step on every loaded batch this many times (repeats are '
+                             'augmented on the device), for loader-bound runs')
+    parser.add_argument('--raw_root', type=str, default='',
+                        help='read the splits from this SHREC directory tree instead of the gendata stores')
     parser.add_argument('--log-interval', type=int, default=50, metavar='N',
                         help='how many batches to wait before logging training status')
     parser.add_argument('--save-model', action='store_true', default=False,
@@ -8,10 +8,13 @@ import  torch
 from torch import nn
 import torch.nn.functional as F
 
+import utils
 
-def aug_look(name):
+
+def aug_look(name, rng=None):
+    # rng is only needed by Subtract, which draws its joint when built, the others take it per call
     if 'subtract' in name:
-        return Subtract()
+        return Subtract(rng=rng)
     elif 'randomFlip' in name:
         return RandomHorizontalFlip()  # subSampleFlip(data_numpy, time_range)
     elif 'rotate' in name:
@@ -77,12 +80,12 @@ class SelectFrames(object):
 
 
 class Subtract(object):
-    def __init__(self, joint = None):
+    def __init__(self, joint = None, rng = None):
         if joint == None:
-            self.joint = random.randint(0, 21)
+            self.joint = utils.as_rng(rng).integers(0, 22)
         else:
             self.joint = joint
-    def __call__(self, data_numpy):
+    def __call__(self, data_numpy, rng=None):
         C, T, V, M = data_numpy.shape
         x_new = np.zeros((C, T, V, M))
         for i in range(V):
@@ -92,13 +95,14 @@ class Subtract(object):
 class Subsample(object):
     def __init__(self,time_range = None):
         self.time_range = time_range
-    def __call__(self, data_numpy):
+    def __call__(self, data_numpy, rng=None):
+        rng = utils.as_rng(rng)
         C, T, V, M = data_numpy.shape
         # frames = random.randint(1, T)
         if self.time_range == None:
-            self.time_range = random.randint(1, T)
+            self.time_range = rng.integers(1, T + 1)
         all_frames = [i for i in range(T)]
-        time_range_list = random.sample(all_frames, self.time_range)
+        time_range_list = rng.choice(all_frames, self.time_range, replace=False).tolist()
         time_range_list.sort()
         x_new = np.zeros((C, T, V, M))
         x_new[:, time_range_list, :, :] = data_numpy[:, time_range_list, :, :]
@@ -111,11 +115,12 @@ class Zero_out_axis(object):
         self.first_axis = axis
 
 
-    def __call__(self, data_numpy):
+    def __call__(self, data_numpy, rng=None):
+        rng = utils.as_rng(rng)
         if self.first_axis != None:
             axis_next = self.first_axis
         else:
-            axis_next = random.randint(0,2)
+            axis_next = rng.integers(0, 3)
 
         temp = data_numpy.copy()
         C, T, V, M = data_numpy.shape
@@ -126,11 +131,12 @@ class Zero_out_axis(object):
 class Diff_on_axis(object):
     def __init__(self, axis = None):
         self.first_axis = axis
-    def __call__(self, data_numpy):
+    def __call__(self, data_numpy, rng=None):
+        rng = utils.as_rng(rng)
         if self.first_axis != None:
             axis_next = self.first_axis
         else:
-            axis_next = random.randint(0,2)
+            axis_next = rng.integers(0, 3)
         temp = data_numpy.copy()
         C, T, V, M = data_numpy.shape
         for t in range(T - 1):
@@ -142,9 +148,10 @@ class Diff_on_axis(object):
 class RandomHorizontalFlip(object):
     def __init__(self, p = 0.5):
         self.p = p
-    def __call__(self, data_numpy):
+    def __call__(self, data_numpy, rng=None):
+        rng = utils.as_rng(rng)
         C, T, V, M = data_numpy.shape
-        if random.random() < self.p:
+        if rng.random() < self.p:
             time_range_order = [i for i in range(T)]
             time_range_reverse = list(reversed(time_range_order))
             return data_numpy[:, time_range_reverse, :, :]
@@ -155,23 +162,24 @@ class Rotate(object):
     def __init__(self, axis = None, angle = None, ):
         self.first_axis = axis
         self.first_angle = angle
-    def __call__(self, data_numpy):
+    def __call__(self, data_numpy, rng=None):
+        rng = utils.as_rng(rng)
         if self.first_axis != None:
             axis_next = self.first_axis
         else:
-            axis_next = random.randint(0,2)
+            axis_next = rng.integers(0, 3)
 
         if self.first_angle != None:
             if isinstance(self.first_angle, list):
                 angle_big = self.first_angle[0] + self.first_angle[1]
                 angle_small = self.first_angle[0] - self.first_angle[1]
-                angle_next = random.uniform(angle_small, angle_big)
+                angle_next = rng.uniform(angle_small, angle_big)
             else:
                 angle_next = self.first_angle
         else:
             # angle_list = [0, 90, 180, 270]
             # angle_next = random.sample(angle_list, 1)[0]
-            angle_next = random.uniform(0, 30)
+            angle_next = rng.uniform(0, 30)
 
         temp = data_numpy.copy()
         angle = math.radians(angle_next)
@@ -201,37 +209,38 @@ class Zero_out_joints(object):
     def __init__(self,joint_list = None, time_range = None):
         self.first_joint_list = joint_list
         self.first_time_range = time_range
-    def __call__(self, data_numpy):
+    def __call__(self, data_numpy, rng=None):
+        rng = utils.as_rng(rng)
         temp = data_numpy.copy()
         C, T, V, M = data_numpy.shape
 
         if self.first_joint_list != None:
             if isinstance(self.first_joint_list, int):
                 all_joints = [i for i in range(V)]
-                joint_list_ = random.sample(all_joints, self.first_joint_list)
+                joint_list_ = rng.choice(all_joints, self.first_joint_list, replace=False).tolist()
                 joint_list_ = sorted(joint_list_)
             else:
                 joint_list_ = self.first_joint_list
         else:
-            random_int = random.randint(5, 15)
+            random_int = rng.integers(5, 15 + 1)
             all_joints = [i for i in range(V)]
-            joint_list_ = random.sample(all_joints, random_int)
+            joint_list_ = rng.choice(all_joints, random_int, replace=False).tolist()
             joint_list_ = sorted(joint_list_)
 
         if self.first_time_range != None:
             if isinstance(self.first_time_range, int):
                 all_frames = [i for i in range(T)]
-                time_range_ = random.sample(all_frames, self.first_time_range)
+                time_range_ = rng.choice(all_frames, self.first_time_range, replace=False).tolist()
                 time_range_ = sorted(time_range_)
             else:
                 time_range_ = self.first_time_range
         else:
             if 50 < T < 100:
-                random_int = random.randint(20, 50)
+                random_int = rng.integers(20, 50 + 1)
             else:
-                random_int = random.randint(0, T)
+                random_int = rng.integers(0, T + 1)
             all_frames = [i for i in range(T)]
-            time_range_ = random.sample(all_frames, random_int)
+            time_range_ = rng.choice(all_frames, random_int, replace=False).tolist()
             time_range_ = sorted(time_range_)
 
         x_new = np.zeros((C, len(time_range_), len(joint_list_), M))
@@ -245,17 +254,18 @@ class Gaus_noise(object):
     def __init__(self, mean= 0, std = 0.05):
         self.mean = mean
         self.std = std
-    def __call__(self, data_numpy):
+    def __call__(self, data_numpy, rng=None):
+        rng = utils.as_rng(rng)
         temp = data_numpy.copy()
         C, T, V, M = data_numpy.shape
-        noise = np.random.normal(self.mean, self.std, size=(C, T, V, M))
+        noise = rng.normal(self.mean, self.std, size=(C, T, V, M))
         return temp + noise
 
 class Gaus_filter(object):
     def __init__(self, kernel = 15, sig_list =  [0.1, 2]):
         self.g = GaussianBlurConv(3, kernel, sig_list)
-    def __call__(self, data_numpy):
-        return self.g(data_numpy)
+    def __call__(self, data_numpy, rng=None):
+        return self.g(data_numpy, rng)
 
 
 class Shear(object):
@@ -263,17 +273,18 @@ class Shear(object):
         self.s1 = s1
         self.s2 = s2
 
-    def __call__(self, data_numpy):
+    def __call__(self, data_numpy, rng=None):
+        rng = utils.as_rng(rng)
         temp = data_numpy.copy()
         if self.s1 != None:
             s1_list = self.s1
         else:
-            s1_list = [random.uniform(-1, 1),random.uniform(-1, 1),random.uniform(-1, 1)]
+            s1_list = [rng.uniform(-1, 1),rng.uniform(-1, 1),rng.uniform(-1, 1)]
             # print(s1_list[0])
         if self.s2 != None:
             s2_list = self.s2
         else:
-            s2_list = [random.uniform(-1, 1), random.uniform(-1, 1), random.uniform(-1, 1)]
+            s2_list = [rng.uniform(-1, 1), rng.uniform(-1, 1), rng.uniform(-1, 1)]
 
         R = np.array([[1,     s1_list[0], s2_list[0]],
                       [s1_list[1], 1,     s2_list[1]],
@@ -308,11 +319,12 @@ def subtract(data_numpy, joint):
 
 # ok
 # b: crop and resize
-def subsample(data_numpy, time_range):
+def subsample(data_numpy, time_range, rng=None):
+    rng = utils.as_rng(rng)
     C, T, V, M = data_numpy.shape
     if isinstance(time_range, int):
         all_frames = [i for i in range(T)]
-        time_range = random.sample(all_frames, time_range)
+        time_range = rng.choice(all_frames, time_range, replace=False).tolist()
         time_range.sort()
     x_new = np.zeros((C, T, V, M))
     x_new[:, time_range, :, :] = data_numpy[:, time_range, :, :]
@@ -320,12 +332,13 @@ def subsample(data_numpy, time_range):
 
 # ok
 # c: crop,resize (and flip)
-def subSampleFlip(data_numpy, time_range):
+def subSampleFlip(data_numpy, time_range, rng=None):
+    rng = utils.as_rng(rng)
     C, T, V, M = data_numpy.shape
     assert T >= time_range, "frames longer than data"
     if isinstance(time_range, int):
         all_frames = [i for i in range(T)]
-        time_range = random.sample(all_frames, time_range)
+        time_range = rng.choice(all_frames, time_range, replace=False).tolist()
         time_range_order = sorted(time_range)
         time_range_reverse =  list(reversed(time_range_order))
     x_new = np.zeros((C, T, V, M))
@@ -387,20 +400,21 @@ def rotate(data_numpy, axis, angle):
 
 # ok
 # g: cutout
-def zero_out_joints(data_numpy, joint_list, time_range):
+def zero_out_joints(data_numpy, joint_list, time_range, rng=None):
+    rng = utils.as_rng(rng)
     temp = data_numpy.copy()
     C, T, V, M = data_numpy.shape
     # print("joint_list" ,joint_list)
     # print("time_range" ,time_range)
     if isinstance(joint_list, int):
         all_joints = [i for i in range(V)]
-        joint_list_ = random.sample(all_joints, joint_list)
+        joint_list_ = rng.choice(all_joints, joint_list, replace=False).tolist()
         joint_list_ = sorted(joint_list_)
     else:
         joint_list_ = joint_list
     if isinstance(time_range, int):
         all_frames = [i for i in range(T)]
-        time_range_ = random.sample(all_frames, time_range)
+        time_range_ = rng.choice(all_frames, time_range, replace=False).tolist()
         time_range_ =  sorted(time_range_)
     else:
         time_range_ = time_range
@@ -415,10 +429,11 @@ def zero_out_joints(data_numpy, joint_list, time_range):
 
 # ok
 # h: gaussian noise
-def gaus_noise(data_numpy, mean= 0, std = 0.01):
+def gaus_noise(data_numpy, mean= 0, std = 0.01, rng=None):
+    rng = utils.as_rng(rng)
     temp = data_numpy.copy()
     C, T, V, M = data_numpy.shape
-    noise = np.random.normal(mean, std, size=(C, T, V, M ))
+    noise = rng.normal(mean, std, size=(C, T, V, M ))
     return temp + noise
 
 
@@ -444,9 +459,9 @@ class GaussianBlurConv(nn.Module):
         # kernel = kernel.repeat(channels, 1, 1, 1) # (3,1,1,5)
         # self.weight = nn.Parameter(data=kernel, requires_grad=False)
 
-    def __call__(self, x):
-
-        sigma = random.uniform(self.min_max_sigma[0], self.min_max_sigma[1])
+    def __call__(self, x, rng=None):
+        rng = utils.as_rng(rng)
+        sigma = rng.uniform(self.min_max_sigma[0], self.min_max_sigma[1])
         blur_flter = np.exp(-np.power(self.kernel_index, 2.0) / (2.0 * np.power(sigma, 2.0)))
         kernel = torch.from_numpy(blur_flter).unsqueeze(0).unsqueeze(0)
         # kernel =  kernel.float()
@@ -454,7 +469,7 @@ class GaussianBlurConv(nn.Module):
         kernel = kernel.repeat(self.channels, 1, 1, 1) # (3,1,1,5)
         self.weight = nn.Parameter(data=kernel, requires_grad=False)
 
-        prob = np.random.random_sample()
+        prob = rng.random()
         x = torch.from_numpy(x).double()
         if prob < 0.5:
             x = x.permute(3,0,2,1) # M,C,V,T
@@ -481,9 +496,10 @@ def diff(data_numpy):
 
 '''============================================================='''
 
-def downsample(data_numpy, step, random_sample=True):
+def downsample(data_numpy, step, random_sample=True, rng=None):
     # input: C,T,V,M
-    begin = np.random.randint(step) if random_sample else 0
+    rng = utils.as_rng(rng)
+    begin = rng.integers(step) if random_sample else 0
     return data_numpy[:, begin::step, :, :]
 
 
@@ -507,10 +523,11 @@ def mean_subtractor(data_numpy, mean):
     return data_numpy
 
 
-def auto_pading(data_numpy, size, random_pad=False):
+def auto_pading(data_numpy, size, random_pad=False, rng=None):
+    rng = utils.as_rng(rng)
     C, T, V, M = data_numpy.shape
     if T < size:
-        begin = random.randint(0, size - T) if random_pad else 0
+        begin = rng.integers(0, size - T + 1) if random_pad else 0
         data_numpy_paded = np.zeros((C, size, V, M))
         data_numpy_paded[:, begin:begin + T, :, :] = data_numpy
         return data_numpy_paded
@@ -518,18 +535,19 @@ def auto_pading(data_numpy, size, random_pad=False):
         return data_numpy
 
 
-def random_choose(data_numpy, size, auto_pad=True):
+def random_choose(data_numpy, size, auto_pad=True, rng=None):
     # input: C,T,V,M 随机选择其中一段，不是很合理。因为有0
+    rng = utils.as_rng(rng)
     C, T, V, M = data_numpy.shape
     if T == size:
         return data_numpy
     elif T < size:
         if auto_pad:
-            return auto_pading(data_numpy, size, random_pad=True)
+            return auto_pading(data_numpy, size, random_pad=True, rng=rng)
         else:
             return data_numpy
     else:
-        begin = random.randint(0, T - size)
+        begin = rng.integers(0, T - size + 1)
         return data_numpy[:, begin:begin + size, :, :]
 
 
@@ -537,18 +555,19 @@ def random_move(data_numpy,
                 angle_candidate=[-10., -5., 0., 5., 10.],
                 scale_candidate=[0.9, 1.0, 1.1],
                 transform_candidate=[-0.2, -0.1, 0.0, 0.1, 0.2],
-                move_time_candidate=[1]):
+                move_time_candidate=[1], rng=None):
     # input: C,T,V,M
+    rng = utils.as_rng(rng)
     C, T, V, M = data_numpy.shape
-    move_time = random.choice(move_time_candidate)
+    move_time = rng.choice(move_time_candidate)
     node = np.arange(0, T, T * 1.0 / move_time).round().astype(int)
     node = np.append(node, T)
     num_node = len(node)
 
-    A = np.random.choice(angle_candidate, num_node)
-    S = np.random.choice(scale_candidate, num_node)
-    T_x = np.random.choice(transform_candidate, num_node)
-    T_y = np.random.choice(transform_candidate, num_node)
+    A = rng.choice(angle_candidate, num_node)
+    S = rng.choice(scale_candidate, num_node)
+    T_x = rng.choice(transform_candidate, num_node)
+    T_y = rng.choice(transform_candidate, num_node)
 
     a = np.zeros(T)
     s = np.zeros(T)
@@ -580,7 +599,8 @@ def random_move(data_numpy,
     return data_numpy
 
 
-def random_shift(data_numpy):
+def random_shift(data_numpy, rng=None):
+    rng = utils.as_rng(rng)
     C, T, V, M = data_numpy.shape
     data_shift = np.zeros(data_numpy.shape)
     valid_frame = (data_numpy != 0).sum(axis=3).sum(axis=2).sum(axis=0) > 0
@@ -588,7 +608,7 @@ def random_shift(data_numpy):
     end = len(valid_frame) - valid_frame[::-1].argmax()
 
     size = end - begin
-    bias = random.randint(0, T - size)
+    bias = rng.integers(0, T - size + 1)
     data_shift[:, bias:bias + size, :, :] = data_numpy[:, begin:end, :, :]
 
     return data_shift
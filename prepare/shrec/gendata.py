@@ -1,22 +1,42 @@
 import pickle
 from tqdm import tqdm
 import sys
-from rotation import *
-from normalize_skeletons import normalize_skeletons
-from prepare import aug_tools
+import time
+import random
+import argparse
+import json
+from multiprocessing import Pool
 sys.path.extend(['../../'])
+try:
+    from rotation import *
+    from normalize_skeletons import normalize_skeletons, normalize_skeletons_ragged
+    from validate_skeletons import validate_skeletons, merge_reports, format_report, POLICIES
+except ImportError:
+    # imported as a package module (e.g. from the repo root) instead of run from prepare/shrec
+    from prepare.shrec.rotation import *
+    from prepare.shrec.normalize_skeletons import normalize_skeletons, normalize_skeletons_ragged
+    from prepare.shrec.validate_skeletons import validate_skeletons, merge_reports, format_report, POLICIES
+from prepare import aug_tools
+import utils
+from Dataloader import skeleton_store, skeleton_shards
+from Dataloader.sample_index import SampleIndex
+from Dataloader.tensor_cache import file_sha1
 
 import numpy as np
 import os
 from random import randint, shuffle
 
 
-def data_aug(skeleton, ag_id):
+def data_aug(skeleton, ag_id, rng=None):
+    # work on a copy, the callers pass the same p (a view of the stored sample) for every ag_id
+    skeleton = np.array(skeleton)
+    rng = utils.as_rng(rng)
+
     def scale(skeleton):
         ratio = 0.2
         low = 1 - ratio
         high = 1 + ratio
-        factor = np.random.uniform(low, high)
+        factor = rng.uniform(low, high)
         video_len = skeleton.shape[0]
         for t in range(video_len):
             for j_id in range(22):
@@ -27,7 +47,7 @@ def data_aug(skeleton, ag_id):
     def shift(skeleton):
         low = -0.1
         high = -low
-        offset = np.random.uniform(low, high, 3)
+        offset = rng.uniform(low, high, 3)
         video_len = skeleton.shape[0]
         for t in range(video_len):
             for j_id in range(22):
@@ -40,12 +60,12 @@ def data_aug(skeleton, ag_id):
         high = -low
         # select 4 joints
         all_joint = list(range(22))
-        shuffle(all_joint)
+        rng.shuffle(all_joint)
         selected_joint = all_joint[0:4]
         time_len = skeleton.shape[0]
 
         for j_id in selected_joint:
-            noise_offset = np.random.uniform(low, high, 3)
+            noise_offset = rng.uniform(low, high, 3)
             for t in range(time_len):
                 skeleton[t][j_id] += noise_offset
         skeleton = np.array(skeleton)
@@ -55,7 +75,7 @@ def data_aug(skeleton, ag_id):
         skeleton = np.array(skeleton)
         video_len = skeleton.shape[0]
 
-        r = np.random.uniform(0, 1)
+        r = rng.uniform(0, 1)
 
         result = []
 
@@ -86,15 +106,10 @@ def data_aug(skeleton, ag_id):
 
 
 def read_skeleton(ske_txt):
-    ske_txt = open(ske_txt, 'r').readlines()
-    skeletons = []
-    for line in ske_txt:
-        nums = line.split(' ')
-        # num_frame = int(nums[0]) + 1
-        coords_frame = np.array(nums).reshape((22, 3)).astype(np.float32)
-        skeletons.append(coords_frame)
+    # parse the whole file in one call, every line is one frame of 22 joints x (x, y, z)
+    skeletons = np.fromfile(ske_txt, dtype=np.float32, sep=' ').reshape((-1, 22, 3))
     num_frame = len(skeletons)
-    skeletons = np.expand_dims(np.array(skeletons).transpose((2, 0, 1)), axis=-1)  # CTVM
+    skeletons = np.expand_dims(skeletons.transpose((2, 0, 1)), axis=-1)  # CTVM
     skeletons = np.transpose(skeletons, [3, 1, 2, 0])  # M, T, V, C
     # print(skeletons.shape)
     return skeletons, num_frame
@@ -138,26 +153,28 @@ def gendata(aug=True):
             skeletons_all_train.append(data)
             labels14_all_train.append(label_14 - 1)
             labels28_all_train.append(label_28 - 1)
+            names_all_train.append("{}_{}_{}_{}".format(g_id, f_id, sub_id, e_id))
             data = data_aug(p, 1)
             skeletons_all_train.append(data)
             labels14_all_train.append(label_14 - 1)
             labels28_all_train.append(label_28 - 1)
+            names_all_train.append("{}_{}_{}_{}".format(g_id, f_id, sub_id, e_id))
             data = data_aug(p, 2)
             skeletons_all_train.append(data)
             labels14_all_train.append(label_14 - 1)
             labels28_all_train.append(label_28 - 1)
+            names_all_train.append("{}_{}_{}_{}".format(g_id, f_id, sub_id, e_id))
             data = data_aug(p, 3)
             skeletons_all_train.append(data)
             labels14_all_train.append(label_14 - 1)
             labels28_all_train.append(label_28 - 1)
+            names_all_train.append("{}_{}_{}_{}".format(g_id, f_id, sub_id, e_id))
 
     print(len(skeletons_all_train))
 
-    pickle.dump(skeletons_all_train, open(os.path.join(root, 'aug4_train_skeleton.pkl'), 'wb'))
-    pickle.dump([names_all_train, labels14_all_train],
-                open(os.path.join(root, 'aug4_train_label_14.pkl'), 'wb'))
-    pickle.dump([names_all_train, labels28_all_train],
-                open(os.path.join(root, 'aug4_train_label_28.pkl'), 'wb'))
+    # memory-mapped store (aug4_train.coords + aug4_train.index.npz), see Dataloader/skeleton_store.py
+    skeleton_store.write_store(os.path.join(root, 'aug4_train'), skeletons_all_train,
+                               names_all_train, labels14_all_train, labels28_all_train)
 
     # for line in tqdm(val_split):
     #     line = line.rstrip()
@@ -172,14 +189,228 @@ def gendata(aug=True):
     #     labels28_all_val.append(label_28-1)
     #     names_all_val.append("{}_{}_{}_{}".format(g_id, f_id, sub_id, e_id))
 
-    # pickle.dump(skeletons_all_val, open(os.path.join(root, 'val_skeleton.pkl'), 'wb'))
-    # pickle.dump([names_all_val, labels14_all_val],
-    #             open(os.path.join(root, 'val_label_14.pkl'), 'wb'))
-    # pickle.dump([names_all_val, labels28_all_val],
-    #             open(os.path.join(root, 'val_label_28.pkl'), 'wb'))
+    # skeleton_store.write_store(os.path.join(root, 'val'), skeletons_all_val,
+    #                            names_all_val, labels14_all_val, labels28_all_val)
+
+def gesture_path(root, line):
+    g_id, f_id, sub_id, e_id = map(int, line.split(" ")[:4])
+    return os.path.join(root, "gesture_{}/finger_{}/subject_{}/essai_{}/skeletons_world.txt"
+                        .format(g_id, f_id, sub_id, e_id))
+
+
+def read_gesture(task):
+    # one line of train_gestures.txt / test_gestures.txt -> raw T, V, C sequence (None if unreadable)
+    root, line = task
+    try:
+        skeletons, num_frame = read_skeleton(gesture_path(root, line))
+    except (OSError, ValueError):
+        return None
+    return skeletons[0]
+
+
+def ingest_gesture(task):
+    # normalized T, V, C sequence -> C, T, V, M sample (+ its 4 augmentations)
+    seq, line, aug, seed = task
+    g_id, f_id, sub_id, e_id, label_14, label_28, size_seq = map(int, line.split(" "))
+    skeletons = np.transpose(seq, (2, 0, 1))[..., np.newaxis]
+    samples = [skeletons]
+    if aug is True:
+        # every gesture draws from its own generator, whichever worker ingests it
+        rng = np.random.default_rng(seed)
+        p = np.squeeze(skeletons, axis=-1).transpose(1, 2, 0)
+        for ag_id in range(4):
+            samples.append(data_aug(p, ag_id, rng))
+    return samples, "{}_{}_{}_{}".format(g_id, f_id, sub_id, e_id), label_14 - 1, label_28 - 1
+
+
+def ingest_chunk(task):
+    '''
+    read, validate, normalize and augment a chunk of gestures in one worker, only the finished
+    samples go back to the parent
+    :param task: (root, [(k, split line number, split line)], aug, seed, policy)
+    :return: [(k, samples, name, label_14, label_28)] of the kept gestures, the validate_skeletons
+             report, the k of every readable gesture (the report's samples) and of every unreadable one
+    '''
+    root, items, aug, seed, policy = task
+    raw = [read_gesture((root, line)) for _, _, line in items]
+    readable = [j for j, seq in enumerate(raw) if seq is not None]
+    lengths = np.array([len(raw[j]) for j in readable], dtype=np.int64)
+    coords = np.concatenate([raw[j] for j in readable]) if readable else np.zeros((0, 22, 3), dtype=np.float32)
+    try:
+        coords, offsets, lengths, keep, report = validate_skeletons(coords, np.cumsum(lengths) - lengths, lengths,
+                                                                    policy=policy)
+    except RuntimeError as error:
+        # the sample numbers are positions in this chunk, name them
+        raise RuntimeError('{} (samples of the chunk: {})'.format(
+            error, ['_'.join(items[j][2].split(" ")[:4]) for j in readable]))
+    # the kept samples are normalized in one vectorized pass over the ragged buffer
+    kept = np.flatnonzero(keep)
+    coords = normalize_skeletons_ragged(coords, offsets[kept], lengths[kept], origin=0, base_bone=[0, 10])
+    done = []
+    for j in kept:
+        k, i, line = items[readable[j]]
+        done.append((k,) + ingest_gesture((coords[offsets[j]:offsets[j] + lengths[j]], line, aug, seed + i)))
+    return done, report, [items[j][0] for j in readable], [k for (k, _, _), seq in zip(items, raw) if seq is None]
+
+
+# gestures per ingest_chunk task
+CHUNK = 32
+RNG = 'generator'
+
+
+def read_manifest(store_path, aug, seed, codec):
+    # {'aug', 'seed', 'codec', 'rng', 'files': {skeletons_world.txt path: {line, size, mtime, sha1, offsets}}}
+    # 'rng' marks stores augmented from per gesture generators, older ones are rebuilt
+    manifest_path = store_path + '.manifest.json'
+    try:
+        with open(manifest_path, 'r') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if (manifest.get('aug'), manifest.get('seed'), manifest.get('codec', 'float32'), manifest.get('rng')) \
+            != (aug, seed, codec, RNG) \
+            or not skeleton_store.store_exists(store_path):
+        return None
+    return manifest
+
+
+def unchanged(entry, line, src_path):
+    # same split line and same file content; size/mtime first, the hash only when they moved
+    if entry is None or entry['line'] != line:
+        return False
+    try:
+        st = os.stat(src_path)
+        if entry['size'] == st.st_size and entry['mtime'] == st.st_mtime_ns:
+            return True
+        if entry['sha1'] != file_sha1(src_path):
+            return False
+    except OSError:
+        # gone or unreadable: parse it again, read_gesture drops it as unreadable
+        return False
+    entry.update(size=st.st_size, mtime=st.st_mtime_ns)  # touched but not modified
+    return True
+
+
+def ingest_split(pool, root, split_file, out_name, aug, seed, incremental=False, codec='float32', policy='repair'):
+    '''
+    parse the gestures of one split file into the store root/out_name
+    with incremental, gestures whose skeletons_world.txt is unchanged since the last run (per the
+    store's manifest) are skipped, new or changed ones are appended and stale rows are dropped
+    from the index
+    codec picks the coordinate storage (float32, float16 or int16, see skeleton_store.CODECS)
+    every parsed gesture goes through validate_skeletons before normalization, policy says what
+    happens to bad ones (see validate_skeletons), unreadable files are always dropped. Reading,
+    validation, normalization (normalize_skeletons_ragged) and augmentation run per chunk of
+    gestures in the workers, see ingest_chunk
+    :return: (files in the split, files parsed, samples written, rows dropped)
+    '''
+    lines = [line.rstrip() for line in open(os.path.join(root, split_file), 'r').readlines() if line.strip()]
+    store_path = os.path.join(root, out_name)
+    manifest = read_manifest(store_path, aug, seed, codec) if incremental else None
+    if manifest is None:
+        manifest = {'aug': aug, 'seed': seed, 'codec': codec, 'rng': RNG, 'files': {}}
+        skeleton_store.write_store(store_path, [], [], [], [], codec)
+    known = manifest['files']
+
+    files, todo = {}, []
+    for i, line in enumerate(lines):
+        src_path = gesture_path(root, line)
+        if unchanged(known.get(src_path), line, src_path):
+            files[src_path] = known[src_path]
+        else:
+            todo.append((i, line, src_path))
+
+    items = [(k, i, line) for k, (i, line, _) in enumerate(todo)]
+    tasks = [(root, items[b:b + CHUNK], aug, seed, policy) for b in range(0, len(items), CHUNK)]
+    reports, ids, unreadable = [], [], []
+    skeletons, names, labels_14, labels_28, counts, ks = [], [], [], [], [], []
+    for done, report, readable, missing in tqdm(pool.imap(ingest_chunk, tasks), total=len(tasks)):
+        reports.append(report)
+        ids.append(readable)
+        unreadable.extend(missing)
+        for k, samples, name, label_14, label_28 in done:
+            skeletons.extend(samples)
+            names.extend([name] * len(samples))
+            labels_14.extend([label_14] * len(samples))
+            labels_28.extend([label_28] * len(samples))
+            counts.append(len(samples))
+            ks.append(k)
+    print(format_report(merge_reports(reports, ids, policy), ['_'.join(line.split(" ")[:4]) for _, line, _ in todo]))
+    if unreadable:
+        print('  unreadable: {} files {}'.format(len(unreadable), [todo[k][2] for k in unreadable][:20]))
+
+    offsets = skeleton_store.append_store(store_path, skeletons, names, labels_14, labels_28)
+    begins = np.cumsum(counts, dtype=np.int64) - counts
+    rows = {k: offsets[b:b + c].tolist() for k, b, c in zip(ks, begins, counts)}
+    for k, (_, line, src_path) in enumerate(todo):
+        if not os.path.exists(src_path):
+            continue
+        # dropped gestures are recorded without rows, so --update skips them until the file changes
+        st = os.stat(src_path)
+        files[src_path] = {'line': line, 'size': st.st_size, 'mtime': st.st_mtime_ns, 'sha1': file_sha1(src_path),
+                           'offsets': rows.get(k, [])}
+
+    # rows of changed or removed gestures are no longer referenced by the manifest
+    dropped = skeleton_store.keep_rows(store_path, [o for entry in files.values() for o in entry['offsets']])
+    # gesture/finger/subject/essai columns for subject-wise splits and filters
+    SampleIndex.from_store(store_path).save(store_path)
+    manifest['files'] = files
+    tmp = store_path + '.manifest.json.tmp'
+    with open(tmp, 'w') as f:
+        json.dump(manifest, f)
+    os.replace(tmp, store_path + '.manifest.json')
+    return len(lines), len(todo), len(skeletons), dropped
+
+
+def ingest(root='C:/ML/dataset/HandGestureDataset_SHREC2017/', workers=None, aug=True, seed=1, incremental=False,
+           codec='float32', policy='repair'):
+    '''
+    parse train and test gestures in a process pool and write both splits
+    (aug4_train or train, and val) as skeleton stores holding both label levels (14/28)
+    '''
+    start = time.time()
+    n_files = 0
+    n_parsed = 0
+    with Pool(workers) as pool:
+        for split_file, out_name, split_aug in (('train_gestures.txt', 'aug4_train' if aug else 'train', aug),
+                                                ('test_gestures.txt', 'val', False)):
+            split_start = time.time()
+            files, parsed, samples, dropped = ingest_split(pool, root, split_file, out_name, split_aug, seed,
+                                                           incremental, codec, policy)
+            n_files += files
+            n_parsed += parsed
+            print('{}: {} files, {} unchanged skipped, {} parsed -> {} samples, {} stale rows dropped in {:.1f}s'
+                  .format(out_name, files, files - parsed, parsed, samples, dropped, time.time() - split_start))
+    elapsed = time.time() - start
+    print('ingested {} files ({} skipped) in {:.1f}s ({:.1f} files/sec)'.format(
+        n_parsed, n_files - n_parsed, elapsed, n_parsed / max(elapsed, 1e-9)))
+
 
 if __name__ == '__main__':
-    gendata()
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--ingest', action='store_true', default=False,
+                        help='parallel ingest of the train and test splits')
+    parser.add_argument('--root', type=str, default='C:/ML/dataset/HandGestureDataset_SHREC2017/')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='number of ingest processes (default: all cores)')
+    parser.add_argument('--no_aug', action='store_true', default=False)
+    parser.add_argument('--seed', type=int, default=1)
+    parser.add_argument('--update', action='store_true', default=False,
+                        help='with --ingest, only parse gestures that are new or changed since the last run')
+    parser.add_argument('--codec', type=str, default='float32', choices=list(skeleton_store.CODECS),
+                        help='coordinate storage of the written stores (float16/int16 halve the bytes)')
+    parser.add_argument('--policy', type=str, default='repair', choices=POLICIES,
+                        help='what the ingest does with invalid gestures, see validate_skeletons')
+    parser.add_argument('--shard_size', type=int, default=0,
+                        help='also split the written stores into shards of this many samples')
+    args = parser.parse_args()
+    if args.ingest:
+        ingest(args.root, args.workers, not args.no_aug, args.seed, args.update, args.codec, args.policy)
+    else:
+        gendata()
+    if args.shard_size:
+        for out_name in ('aug4_train' if not args.no_aug else 'train', 'val'):
+            print(out_name, skeleton_shards.write_shards(os.path.join(args.root, out_name), args.shard_size, args.seed))
     # root = 'C:/ML/dataset/HandGestureDataset_SHREC2017/val_skeleton.pkl'
     #
     # with open(root, 'rb') as f:
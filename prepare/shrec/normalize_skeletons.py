@@ -1,4 +1,8 @@
-from rotation import *
+try:
+    from rotation import *
+except ImportError:
+    # imported as a package module (e.g. from the repo root) instead of run from prepare/shrec
+    from prepare.shrec.rotation import *
 import numpy as np
 
 
@@ -88,3 +92,125 @@ def normalize_skeletons(skeleton, origin=None, base_bone=None, zaxis=None, xaxis
     # print(skeleton[0, 0, zaxis[0]], skeleton[0, 0, zaxis[1]], skeleton[0, 0, xaxis[0]], skeleton[0, 0, xaxis[1]])
     skeleton = np.transpose(skeleton, [3, 1, 2, 0])  # mtvc - ctvm
     return skeleton
+
+
+def normalize_skeletons_batch(skeleton, origin=None, base_bone=None, zaxis=None, xaxis=None):
+    '''
+    normalize_skeletons for a whole stacked corpus in one vectorized pass
+    (works in place, like normalize_skeletons)
+
+    :param skeleton: N, M, T, V, C(x, y, z)
+    :param origin: int
+    :param base_bone: [int, int]
+    :param zaxis:  [int, int]
+    :param xaxis:  [int, int]
+    :return: N, C, T, V, M
+    '''
+
+    N, M, T, V, C = skeleton.shape
+    if N == 0:
+        return np.transpose(skeleton, [0, 4, 2, 3, 1])
+
+    null = skeleton.reshape(N, -1).sum(-1) == 0
+    if null.any():
+        raise RuntimeError('null skeleton (samples {})'.format(np.nonzero(null)[0].tolist()))
+
+    # pad top null frames: move the non zero frames to the front, keeping their order
+    shift = skeleton[:, :, 0].reshape(N, -1).sum(-1) == 0
+    if shift.any():
+        sub = skeleton[shift]
+        valid = sub.sum(-1).sum(-1).sum(1) != 0  # n, T
+        order = np.argsort(~valid, axis=1, kind='stable')
+        sub = np.take_along_axis(sub, order[:, None, :, None, None], axis=2)
+        sub *= (np.arange(T)[None] < valid.sum(1, keepdims=True))[:, None, :, None, None]
+        skeleton[shift] = sub
+
+    if origin is not None:
+        main_body_center = skeleton[:, 0, 0, origin].copy()  # N, c
+        person = skeleton.reshape(N, M, -1).sum(-1) != 0  # N, M
+        mask = (skeleton.sum(-1) != 0)[..., None]  # only for none zero frames
+        centered = (skeleton - main_body_center[:, None, None, None]) * mask
+        skeleton[:] = np.where(person[:, :, None, None, None], centered, skeleton)
+
+    if base_bone is not None:
+        # first frame with a non zero base bone
+        bones = np.linalg.norm(skeleton[:, 0, :, base_bone[1]] - skeleton[:, 0, :, base_bone[0]], axis=-1)  # N, T
+        has_bone = (bones != 0).any(1)
+        main_body_spine = bones[np.arange(N), (bones != 0).argmax(1)]
+        if not has_bone.all():
+            print('zero bone', np.nonzero(~has_bone)[0].tolist())
+        skeleton /= np.where(has_bone, main_body_spine, 1).astype(skeleton.dtype)[:, None, None, None, None]
+
+    def rotate(matrices):
+        # only non zero persons / frames are rotated, like the per joint loop
+        person = skeleton.reshape(N, M, -1).sum(-1) != 0  # N, M
+        frame = skeleton.reshape(N, M, T, -1).sum(-1) != 0  # N, M, T
+        rotated = np.einsum('nij,nmtvj->nmtvi', matrices, skeleton)
+        keep = (person[:, :, None] & frame)[..., None, None]
+        skeleton[:] = np.where(keep, rotated, skeleton)
+
+    if zaxis is not None:
+        joint_bottom = skeleton[:, 0, 0, zaxis[0]]
+        joint_top = skeleton[:, 0, 0, zaxis[1]]
+        axis = np.cross(joint_top - joint_bottom, [0, 0, 1])
+        angle = angles_between(joint_top - joint_bottom, [0, 0, 1])
+        rotate(rotation_matrices(axis, angle))
+
+    if xaxis is not None:
+        joint_left = skeleton[:, 0, 0, xaxis[0]].copy()
+        joint_right = skeleton[:, 0, 0, xaxis[1]].copy()
+        joint_left[:, 2] = 0
+        joint_right[:, 2] = 0  # rotate by zaxis
+        axis = np.cross(joint_right - joint_left, [1, 0, 0])
+        angle = angles_between(joint_right - joint_left, [1, 0, 0])
+        rotate(rotation_matrices(axis, angle))
+
+    return np.transpose(skeleton, [0, 4, 2, 3, 1])  # nmtvc - nctvm
+
+
+def normalize_skeletons_ragged(coords, offsets, lengths, **kwargs):
+    '''
+    normalize every sample of a ragged store buffer in one pass
+
+    :param coords: total_frames, V, C
+    :param offsets: N, first frame of every sample
+    :param lengths: N, number of frames of every sample
+    :param kwargs: origin / base_bone / zaxis / xaxis, see normalize_skeletons
+    :return: normalized copy of coords (frames not referenced by offsets/lengths are left as is)
+    '''
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    T = int(lengths.max()) if len(lengths) else 0
+    valid = np.arange(T)[None] < lengths[:, None]  # N, T
+    frames = (offsets[:, None] + np.arange(T)[None])[valid]
+
+    # zero padded frames behave like trailing null frames, which normalize_skeletons leaves at zero
+    padded = np.zeros((len(lengths), 1, T) + coords.shape[1:], dtype=coords.dtype)
+    padded[:, 0][valid] = coords[frames]
+    padded = normalize_skeletons_batch(padded, **kwargs)  # N, C, T, V, M
+
+    out = np.array(coords)
+    out[frames] = np.transpose(padded[..., 0], (0, 2, 3, 1))[valid]
+    return out
+
+
+if __name__ == '__main__':
+    # the batched version has to stay equivalent to the per sample loop
+    skeletons = [np.random.randn(1, np.random.randint(20, 80), 22, 3).astype(np.float32) for _ in range(16)]
+    skeletons[0][:, :5] = 0  # top null frames
+    skeletons[1][:, -7:] = 0
+    kwargs = dict(origin=0, base_bone=[0, 10], zaxis=[0, 1], xaxis=[0, 2])
+
+    expected = [normalize_skeletons(s.copy(), **kwargs) for s in skeletons]
+    lengths = np.array([s.shape[1] for s in skeletons])
+    offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])
+    coords = np.concatenate([s[0] for s in skeletons])
+    out = normalize_skeletons_ragged(coords, offsets, lengths, **kwargs)
+    for o, l, e in zip(offsets, lengths, expected):
+        np.testing.assert_allclose(out[o:o + l], np.transpose(e[..., 0], (1, 2, 0)), rtol=1e-4, atol=1e-5)
+    # equal lengths through normalize_skeletons_batch directly
+    same = np.stack([s[:, :20] for s in skeletons])
+    batch = normalize_skeletons_batch(same.copy(), **kwargs)
+    for b, s in zip(batch, same):
+        np.testing.assert_allclose(b, normalize_skeletons(s.copy(), **kwargs), rtol=1e-4, atol=1e-5)
+    print('normalize_skeletons_batch / normalize_skeletons_ragged match normalize_skeletons')
@@ -20,6 +20,27 @@ def rotation_matrix(axis, theta):
                      [2 * (bd + ac), 2 * (cd - ab), aa + dd - bb - cc]])
 
 
+def rotation_matrices(axes, thetas):
+    """
+    Batched rotation_matrix: axes (N, 3), thetas (N,) -> (N, 3, 3).
+    Rows with a (near) zero axis or angle get the identity, like rotation_matrix.
+    """
+    axes = np.asarray(axes, dtype=np.float64).reshape(-1, 3)
+    thetas = np.asarray(thetas, dtype=np.float64).reshape(-1)
+    identity = (np.abs(axes).sum(-1) < 1e-6) | (np.abs(thetas) < 1e-6)
+    norm = np.sqrt((axes * axes).sum(-1, keepdims=True))
+    axes = axes / np.where(identity[:, None], 1, norm)
+    a = np.cos(thetas / 2.0)
+    b, c, d = (-axes * np.sin(thetas / 2.0)[:, None]).T
+    aa, bb, cc, dd = a * a, b * b, c * c, d * d
+    bc, ad, ac, ab, bd, cd = b * c, a * d, a * c, a * b, b * d, c * d
+    matrices = np.stack([np.stack([aa + bb - cc - dd, 2 * (bc + ad), 2 * (bd - ac)], -1),
+                         np.stack([2 * (bc - ad), aa + cc - bb - dd, 2 * (cd + ab)], -1),
+                         np.stack([2 * (bd + ac), 2 * (cd - ab), aa + dd - bb - cc], -1)], -2)
+    matrices[identity] = np.eye(3)
+    return matrices
+
+
 def unit_vector(vector):
     """ Returns the unit vector of the vector.  """
     return vector / np.linalg.norm(vector)
@@ -42,6 +63,19 @@ def angle_between(v1, v2):
     return np.arccos(np.clip(np.dot(v1_u, v2_u), -1.0, 1.0))
 
 
+def angles_between(v1, v2):
+    """ Batched angle_between: v1 (N, 3), v2 (N, 3) or (3,) -> (N,) """
+    v1 = np.asarray(v1)
+    v2 = np.broadcast_to(np.asarray(v2), v1.shape)
+    zero = (np.abs(v1).sum(-1) < 1e-6) | (np.abs(v2).sum(-1) < 1e-6)
+    n1 = np.linalg.norm(v1, axis=-1, keepdims=True)
+    n2 = np.linalg.norm(v2, axis=-1, keepdims=True)
+    v1_u = v1 / np.where(zero[:, None], 1, n1)
+    v2_u = v2 / np.where(zero[:, None], 1, n2)
+    angles = np.arccos(np.clip((v1_u * v2_u).sum(-1), -1.0, 1.0))
+    return np.where(zero, 0, angles)
+
+
 def x_rotation(vector, theta):
     """Rotates 3-D vector around x-axis"""
     R = np.array([[1, 0, 0], [0, np.cos(theta), -np.sin(theta)], [0, np.sin(theta), np.cos(theta)]])
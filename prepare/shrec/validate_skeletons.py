@@ -0,0 +1,172 @@
+import numpy as np
+
+
+POLICIES = ('repair', 'drop', 'report', 'raise')
+ISSUES = ('non_finite_frames', 'null_frames', 'outlier_frames', 'null_skeleton', 'zero_bone')
+
+
+def ragged_frames(offsets, lengths):
+    # frame numbers of every sample back to back, and the sample each one belongs to
+    offsets = np.asarray(offsets, dtype=np.int64)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    sample = np.repeat(np.arange(len(lengths)), lengths)
+    starts = np.cumsum(lengths) - lengths
+    frames = offsets[sample] + np.arange(int(lengths.sum())) - starts[sample]
+    return frames, sample
+
+
+def validate_skeletons(coords, offsets, lengths, base_bone=(0, 10), max_jump=3.0, policy='repair'):
+    '''
+    check a whole ragged corpus (raw coordinates, before normalize_skeletons) in one pass
+
+    frame level issues: null frames (every joint at 0, normalize_skeletons moves them to the end),
+    NaN/inf coordinates and outlier frames (a spike: the frame jumps away from both neighbours by
+    more than max_jump times the sample's mean base bone length)
+    sample level issues: null skeletons (no usable frame) and zero base bones (the base bone is 0
+    on every usable frame, normalize_skeletons can't scale them)
+
+    :param coords: total_frames, V, C
+    :param offsets: N, first frame of every sample
+    :param lengths: N, number of frames of every sample
+    :param policy: repair - drop the bad frames, drop the samples that can't be fixed
+                   drop   - drop every sample with any issue but null frames
+                   report - only count, change nothing but drop the null skeletons
+                            (normalize_skeletons can't take them)
+                   raise  - RuntimeError listing the bad samples, if there are any
+    :return: coords, offsets, lengths (compacted when frames were dropped), keep (N bool, the
+             samples to write), report (dict of counts and per issue sample lists)
+    '''
+    if policy not in POLICIES:
+        raise ValueError('policy must be one of {} (got {})'.format(POLICIES, policy))
+    coords = np.asarray(coords)
+    lengths = np.asarray(lengths, dtype=np.int64)
+    N = len(lengths)
+    frames, sample = ragged_frames(offsets, lengths)
+    seq = coords[frames]  # F, V, C
+
+    finite = np.isfinite(seq).all(axis=(1, 2))
+    null = finite & (np.where(np.isfinite(seq), seq, 0) == 0).all(axis=(1, 2))
+    usable = finite & ~null
+
+    # spikes: a large jump into the frame and out of it again, between consecutive frames of a sample
+    bone = np.linalg.norm(seq[:, base_bone[1]] - seq[:, base_bone[0]], axis=-1)
+    bone = np.where(usable, bone, 0)
+    bone_frames = np.bincount(sample, weights=bone > 0, minlength=N)
+    mean_bone = np.bincount(sample, weights=bone, minlength=N) / np.maximum(bone_frames, 1)
+    jump = np.zeros(len(seq))
+    same = np.zeros(len(seq), dtype=bool)
+    if len(seq) > 1:
+        jump[1:] = np.abs(np.where(usable[:, None, None], seq, 0)[1:] -
+                          np.where(usable[:, None, None], seq, 0)[:-1]).max(axis=(1, 2))
+        same[1:] = (sample[1:] == sample[:-1]) & usable[1:] & usable[:-1]
+    big = same & (jump > max_jump * mean_bone[sample]) & (mean_bone[sample] > 0)
+    outlier = np.zeros(len(seq), dtype=bool)
+    outlier[:-1] = big[:-1] & big[1:]
+
+    def per_sample(flags):
+        return np.bincount(sample, weights=flags, minlength=N).astype(np.int64)
+
+    good_frames = per_sample(usable & ~outlier)
+    issues = {
+        'non_finite_frames': per_sample(~finite),
+        'null_frames': per_sample(null),
+        'outlier_frames': per_sample(outlier),
+        'null_skeleton': good_frames == 0,
+        'zero_bone': (good_frames > 0) & (per_sample(usable & ~outlier & (bone > 0)) == 0),
+    }
+    # null frames alone are no reason to drop a sample, normalize_skeletons always handled them
+    bad = np.zeros(N, dtype=bool)
+    for name, flags in issues.items():
+        if name != 'null_frames':
+            bad |= flags > 0
+    unfixable = issues['null_skeleton'] | issues['zero_bone']
+
+    report = {'samples': N, 'frames': len(seq), 'policy': policy}
+    for name, flags in issues.items():
+        report[name] = int(flags.sum())
+        report[name + '_samples'] = np.flatnonzero(flags).tolist()
+
+    if policy == 'raise' and bad.any():
+        raise RuntimeError('invalid skeletons: {}'.format(
+            {name: report[name + '_samples'] for name in issues if report[name + '_samples']}))
+    if policy in ('report', 'raise'):
+        # raise only gets here without any null skeleton
+        keep = ~issues['null_skeleton']
+        report['dropped'] = int((~keep).sum())
+        report['dropped_samples'] = np.flatnonzero(~keep).tolist()
+        return coords, np.asarray(offsets, dtype=np.int64), lengths, keep, report
+
+    keep = ~unfixable if policy == 'repair' else ~bad
+    report['dropped'] = int((~keep).sum())
+    report['dropped_samples'] = np.flatnonzero(~keep).tolist()
+    if policy == 'drop':
+        return coords, np.asarray(offsets, dtype=np.int64), lengths, keep, report
+
+    # repair: compact every kept sample to its usable, non outlier frames (what normalize_skeletons
+    # does with null frames, without the zero padding at the end)
+    frame_keep = usable & ~outlier & keep[sample]
+    new_lengths = np.bincount(sample[frame_keep], minlength=N).astype(np.int64)
+    new_offsets = np.cumsum(new_lengths) - new_lengths
+    report['repaired_frames'] = int((~frame_keep & keep[sample]).sum())
+    return np.ascontiguousarray(seq[frame_keep]), new_offsets, new_lengths, keep, report
+
+
+def merge_reports(reports, ids=None, policy='repair'):
+    '''
+    one report out of those of several validate_skeletons calls (e.g. one per ingest chunk)
+    :param ids: per report, the number of each of its samples in the merged report
+                (default: the reports' samples back to back)
+    '''
+    merged = {'samples': 0, 'frames': 0, 'policy': policy, 'dropped': 0, 'dropped_samples': []}
+    for name in ISSUES:
+        merged[name], merged[name + '_samples'] = 0, []
+    begin = 0
+    for k, report in enumerate(reports):
+        numbers = np.asarray(ids[k] if ids is not None else np.arange(begin, begin + report['samples']), dtype=np.int64)
+        begin += report['samples']
+        for key, value in report.items():
+            if key == 'policy':
+                continue
+            if key.endswith('_samples'):
+                merged.setdefault(key, []).extend(numbers[value].tolist())
+            else:
+                merged[key] = merged.get(key, 0) + value
+    return merged
+
+
+def format_report(report, names=None):
+    # names: optional sample names to print instead of sample numbers
+    def samples(rows):
+        return [names[r] for r in rows[:20]] if names is not None else rows[:20]
+
+    lines = ['validated {} samples / {} frames (policy {})'.format(report['samples'], report['frames'], report['policy'])]
+    for name in ISSUES:
+        if report[name]:
+            lines.append('  {}: {} (samples {})'.format(name, report[name], samples(report[name + '_samples'])))
+    if report.get('repaired_frames'):
+        lines.append('  repaired: {} frames dropped'.format(report['repaired_frames']))
+    if report['dropped']:
+        lines.append('  dropped {} samples {}'.format(report['dropped'], samples(report['dropped_samples'])))
+    return '\n'.join(lines)
+
+
+if __name__ == '__main__':
+    rng = np.random.RandomState(0)
+    seqs = [np.cumsum(rng.randn(rng.randint(20, 60), 22, 3) * 0.01, axis=0) + rng.randn(1, 22, 3) for _ in range(8)]
+    seqs[1][:4] = 0  # leading null frames
+    seqs[2][10, 3] = np.nan
+    seqs[3][:] = 0  # null skeleton
+    seqs[4][:, 10] = seqs[4][:, 0]  # zero base bone
+    seqs[5][15] += 50  # spike
+    lengths = np.array([len(s) for s in seqs])
+    offsets = np.cumsum(lengths) - lengths
+    coords = np.concatenate(seqs)
+    for policy in ('report', 'drop', 'repair'):
+        out, out_offsets, out_lengths, keep, report = validate_skeletons(coords, offsets, lengths, policy=policy)
+        print(format_report(report))
+        print('  kept', np.flatnonzero(keep).tolist(), 'lengths', out_lengths.tolist())
+    # validating in two halves and merging gives the report of one pass
+    halves = [validate_skeletons(coords[:offsets[4]], offsets[:4], lengths[:4])[4],
+              validate_skeletons(coords[offsets[4]:], offsets[4:] - offsets[4], lengths[4:])[4]]
+    whole = validate_skeletons(coords, offsets, lengths)[4]
+    assert merge_reports(halves) == whole, (merge_reports(halves), whole)
@@ -0,0 +1,76 @@
+import argparse
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+from tqdm import tqdm
+
+from MODEL.dylan_net_v7 import Dylan_MT_Net
+from Dataloader import skeleton_store
+from Dataloader.skeleton_loader import Store_Dataset, batch_collate
+
+
+def reconstruction_error(store, encoded):
+    # max / mean absolute error of the decoded coordinates against the float32 store
+    max_err, total, count = 0.0, 0.0, 0
+    for i in range(len(store)):
+        err = np.abs(encoded.sequence(i) - store.sequence(i))
+        if err.size:
+            max_err = max(max_err, float(err.max()))
+            total += float(err.sum())
+            count += err.size
+    return max_err, total / max(count, 1)
+
+
+def accuracy(model, device, store, label_level, frame_l, batch_size):
+    # zoomed to frame_l like the Sdata_generator splits main_train_test trains on, and the same
+    # frames for both stores
+    loader = DataLoader(Store_Dataset(store, label_level, frame_l, batched=True), batch_size=batch_size,
+                        collate_fn=batch_collate)
+    correct = 0
+    model.eval()
+    with torch.no_grad():
+        for data, target in tqdm(loader):
+            pred = model(data.to(device)).argmax(dim=1)
+            correct += pred.eq(target.to(device)).sum().item()
+    return 100. * correct / len(loader.dataset)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='re-encode a skeleton store and check what it costs')
+    parser.add_argument('--store', type=str, default='C:/ML/dataset/HandGestureDataset_SHREC2017/val')
+    parser.add_argument('--codecs', type=str, nargs='+', default=['float16', 'int16'],
+                        choices=list(skeleton_store.CODECS))
+    parser.add_argument('--checkpoint', type=str, default='',
+                        help='best_model.pt of main_train_test.py, enables the accuracy delta')
+    parser.add_argument('--cls', type=int, default=14)
+    parser.add_argument('--frame_size', type=int, default=120)
+    parser.add_argument('--net_layer', type=int, default=2)
+    parser.add_argument('--mid_layer', type=int, default=4)
+    parser.add_argument('--att_drop', type=float, default=0.0005)
+    parser.add_argument('--l_drop', type=float, default=0.3)
+    parser.add_argument('--test-batch-size', type=int, default=1000)
+    args = parser.parse_args()
+
+    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+    store = skeleton_store.SkeletonStore(args.store)
+    model = None
+    if args.checkpoint:
+        model = Dylan_MT_Net(3, args.mid_layer, args.cls, num_node=22, num_frame=args.frame_size,
+                             n_layers=args.net_layer, attn_heads=6,
+                             dropout=args.att_drop, l_dropout=args.l_drop).to(device)
+        model.load_state_dict(torch.load(args.checkpoint, map_location=device))
+        base_acc = accuracy(model, device, store, args.cls, args.frame_size, args.test_batch_size)
+        print('{}: accuracy {:.2f}%'.format(store.codec, base_acc))
+
+    for codec in args.codecs:
+        out_path = '{}_{}'.format(args.store, codec)
+        skeleton_store.convert_store(args.store, out_path, codec)
+        encoded = skeleton_store.SkeletonStore(out_path)
+        max_err, mean_err = reconstruction_error(store, encoded)
+        ratio = encoded.coords_path.stat().st_size / max(store.coords_path.stat().st_size, 1)
+        msg = '{}: {:.2f}x the bytes, max abs error {:.3g}, mean abs error {:.3g}'.format(
+            codec, ratio, max_err, mean_err)
+        if model is not None:
+            acc = accuracy(model, device, encoded, args.cls, args.frame_size, args.test_batch_size)
+            msg += ', accuracy {:.2f}% ({:+.2f})'.format(acc, acc - base_acc)
+        print(msg)
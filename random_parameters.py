@@ -1,4 +1,5 @@
 import os
+import atexit
 import torch
 import random
 import numpy as np
@@ -23,7 +24,9 @@ from torch.utils.data import TensorDataset, DataLoader
 #from MODEL.dstanet import DSTANet
 from MODEL.dylan_net_v9 import Dylan_MT_Net
 # from Dataloader.Shrec_dataset import load_shrec_data, Sdata_generator, SConfig
-from Dataloader.skeleton_loader import SConfig, Sdata_generator, Hand_Dataset
+from Dataloader.skeleton_loader import SConfig, Sdata_generator, Hand_Dataset, batch_collate
+from Dataloader.tensor_cache import TensorCache
+from Dataloader.shared_split import shared_splits, Shared_Dataset
 
 def train(model, device, train_loader, optimizer, epoch, criterion):
     model.train()
@@ -102,6 +105,25 @@ best_score = 0
 best_hyperparams = {}
 best_epoch = 0
 
+use_cuda = torch.cuda.is_available()
+
+device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
+
+C = SConfig(120)
+# Train, Test = load_data()
+# the split is the same for every trial: built once (or mapped from a parallel search that
+# already published it) instead of once per iteration, released at exit however the search ends
+cache = TensorCache('C:/ML/dataset/HandGestureDataset_SHREC2017/cache')
+splits = shared_splits('train', 'val', 28, C, cache=cache)
+atexit.register(splits.close)
+
+# trainset = train_streams.dataset(('joint', 'bone', 'motion'))
+# seeded: every trial sees the same augmentations in the same epoch
+trainset = Shared_Dataset(splits, 'train', 120, use_data_aug=True, seed=1)
+
+# testset = test_streams.dataset(('joint', 'bone', 'motion'))
+testset = Shared_Dataset(splits, 'val', 120, use_data_aug=False, batched=True)
+
 for i in range(MAX_EVALS):
     random.seed(i)  # 设置随机种子，每次搜索设置不同的种子，若种子固定，那每次选取的超参都是一样的
     hyperparameters = {k: random.sample(v, 1)[0] for k, v in param_grid.items()}
@@ -117,35 +139,10 @@ for i in range(MAX_EVALS):
     mid_layers = hyperparameters['mid_layers']
     print('lit:', i, hyperparameters)
 
-    use_cuda = torch.cuda.is_available()
-
-    device = torch.device("cuda" if torch.cuda.is_available() else "cpu")
-
-    train_data_generator = Sdata_generator('train', 28)  # aug
-    test_data_generator = Sdata_generator('val', 28)
-
-    C = SConfig(120)
-    # Train, Test = load_data()
-    X_0, X_1, X_2, Y = train_data_generator(C)
-    X_0 = torch.from_numpy(X_0).type('torch.FloatTensor')
-    X_1 = torch.from_numpy(X_1).type('torch.FloatTensor')
-    X_2 = torch.from_numpy(X_2).type('torch.FloatTensor')
-    Y = torch.from_numpy(Y).type('torch.LongTensor')
-
-    X_0_t, X_1_t, X_2_t, Y_t = test_data_generator(C)
-    X_0_t = torch.from_numpy(X_0_t).type('torch.FloatTensor')
-    X_1_t = torch.from_numpy(X_1_t).type('torch.FloatTensor')
-    X_2_t = torch.from_numpy(X_2_t).type('torch.FloatTensor')
-    Y_t = torch.from_numpy(Y_t).type('torch.LongTensor')
-
-    # trainset = TensorDataset(X_0, X_1, X_2, Y)
-    trainset = Hand_Dataset(X_0, Y, 120, use_data_aug=True)
-    train_loader = DataLoader(trainset, batch_size=batch_size, shuffle=True)
+    train_loader = DataLoader(trainset, batch_size=batch_size, shuffle=True, collate_fn=batch_collate)
 
-    # testset = TensorDataset(X_0_t, X_1_t, X_2_t, Y_t)
-    testset = Hand_Dataset(X_0_t, Y_t, 120, use_data_aug=False)
     test_loader = DataLoader(
-        testset, batch_size=1000)
+        testset, batch_size=1000, collate_fn=batch_collate)
 
     # Net = DSTANet(config=config)#
     Net = Dylan_MT_Net(16, 4, 28,  num_node=22, num_frame=120, n_layers=att_layers, attn_heads=att_head, dropout=Drop, l_dropout=L_Drop)
@@ -166,6 +163,7 @@ for i in range(MAX_EVALS):
 
     for epoch in range(1, 199 + 1):
         print('Epoch:', epoch)
+        trainset.set_epoch(epoch)
         train_loss = train(model, device, train_loader,
                            optimizer, epoch, criterion)
         acc = test(model, device, test_loader, criterion)
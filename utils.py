@@ -10,6 +10,9 @@ from scipy.signal import medfilt
 import math
 import torch.nn as nn
 import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 
 def makedir(path):
     pathlib.Path(path).mkdir(parents=True, exist_ok=True)
@@ -63,9 +66,10 @@ def poses_motion(P):
 
 
 def decouple_spatial(skeleton, edges=()):
-    tmp = np.zeros(skeleton.shape)
+    # T, V, C or a batch N, T, V, C
+    tmp = np.zeros(skeleton.shape, dtype=skeleton.dtype)
     for v1, v2 in edges:
-        tmp[:, v2, :] = skeleton[:, v2, :] - skeleton[:, v1, :]
+        tmp[..., v2, :] = skeleton[..., v2, :] - skeleton[..., v1, :]
     return tmp
 
 
@@ -154,6 +158,160 @@ def zoom(p, target_l=64, joints_num=25, joints_dim=3):
     return p_new
 
 
+def medfilt3(p, axis=1):
+    # medfilt(x, 3) along one axis of a whole array (zero padded at both ends, like medfilt)
+    p = np.moveaxis(p, axis, 0)
+    pad = np.zeros((1,) + p.shape[1:], dtype=p.dtype)
+    a = np.concatenate([pad, p[:-1]])
+    c = np.concatenate([p[1:], pad])
+    med = np.maximum(np.minimum(a, p), np.minimum(np.maximum(a, p), c))
+    return np.moveaxis(med, 0, axis)
+
+
+def zoom_batch(batch, target_l=64, out=None):
+    '''
+    zoom for a whole batch: median filter and spline zoom every joint/coordinate in one call
+    :param batch: N, T, V, C array, or a list of T_i, V, C arrays (zoomed per group of equal length)
+    :param target_l: number of output frames
+    :param out: optional preallocated N, target_l, V, C array (e.g. float32) the result is written into
+    :return: N, target_l, V, C
+    '''
+    if isinstance(batch, np.ndarray):
+        lengths = np.full(len(batch), batch.shape[1])
+    else:
+        lengths = np.array([len(p) for p in batch])
+    if len(lengths) == 0:
+        return np.empty((0, target_l, 0, 0)) if out is None else out
+    _, V, C = np.shape(batch[0])
+    if out is None:
+        out = np.empty((len(lengths), target_l, V, C), dtype=np.result_type(batch[0]))
+    for l in np.unique(lengths):
+        index = np.nonzero(lengths == l)[0]
+        group = batch[index] if isinstance(batch, np.ndarray) else np.stack([batch[i] for i in index])
+        group = medfilt3(group, axis=1)
+        # a zoom factor of 1 on the other axes leaves them untouched, so this is the per joint zoom at once
+        out[index] = inter.zoom(group, (1, target_l / l, 1, 1))[:, :target_l]
+    return out
+
+
+def motion_energy(batch):
+    '''
+    per-frame joint velocity energy: the squared decouple_temporal differences summed over joints
+    and coordinates, averaged over the step into the frame and the step out of it
+    :param batch: N, T, V, C
+    :return: N, T
+    '''
+    batch = np.asarray(batch, dtype=np.float32)
+    step = np.square(batch[:, 1:] - batch[:, :-1]).sum(axis=(2, 3))  # N, T - 1
+    energy = np.zeros(batch.shape[:2], dtype=np.float32)
+    energy[:, 1:] += step
+    energy[:, :-1] += step
+    energy[:, 1:-1] /= 2
+    return energy
+
+
+def keyframe_batch(batch, target_l=64, out=None):
+    '''
+    keep the target_l frames with the most motion energy of every sequence, in time order, so the
+    idle lead-in and lead-out frames are the first to go. Sequences of target_l frames or fewer are
+    uniformly resampled instead (like uniform_sample_np)
+    :param batch: N, T, V, C array, or a list of T_i, V, C arrays (handled per group of equal length)
+    :param out: optional preallocated N, target_l, V, C array the result is written into
+    :return: N, target_l, V, C
+    '''
+    if isinstance(batch, np.ndarray):
+        lengths = np.full(len(batch), batch.shape[1])
+    else:
+        lengths = np.array([len(p) for p in batch])
+    if len(lengths) == 0:
+        return np.empty((0, target_l, 0, 0)) if out is None else out
+    _, V, C = np.shape(batch[0])
+    if out is None:
+        out = np.empty((len(lengths), target_l, V, C), dtype=np.result_type(batch[0]))
+    for l in np.unique(lengths):
+        index = np.nonzero(lengths == l)[0]
+        group = batch[index] if isinstance(batch, np.ndarray) else np.stack([batch[i] for i in index])
+        if l <= target_l:
+            frames = np.broadcast_to((np.arange(target_l) * (l / target_l)).astype(np.int64), (len(index), target_l))
+        else:
+            # stable sort on -energy: among equal energies the earlier frame wins
+            frames = np.sort(np.argsort(-motion_energy(group), axis=1, kind='stable')[:, :target_l], axis=1)
+        out[index] = np.take_along_axis(group, frames[:, :, None, None], axis=1)
+    return out
+
+
+def peak_rss_mb():
+    # peak resident set size of this process so far, in MB (None if the platform can't tell)
+    try:
+        import resource
+    except ImportError:
+        try:
+            import psutil
+        except ImportError:
+            return None
+        info = psutil.Process().memory_info()
+        return round(getattr(info, 'peak_wset', info.rss) / 1024 ** 2)
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return round(peak / 1024 ** 2) if sys.platform == 'darwin' else round(peak / 1024)
+
+
+class Startup():
+    """Runs the independent startup steps of a training script at the same time and times them.
+
+    Steps are threads (split building is numpy/scipy work and file reads, model construction is
+    torch, all of which release the GIL for the heavy parts). watch(loader) marks the first batch
+    it hands out, report() gives when every step finished and the time to the first batch, all
+    counted from the Startup's creation.
+    """
+
+    def __init__(self, max_workers=3):
+        self.start = time.time()
+        self.pool = ThreadPoolExecutor(max_workers=max_workers)
+        self.done = {}
+        self.first_batch = None
+
+    def submit(self, name, fn, *args, **kwargs):
+        def step():
+            result = fn(*args, **kwargs)
+            self.done[name] = time.time() - self.start
+            return result
+        return self.pool.submit(step)
+
+    def mark_first_batch(self):
+        if self.first_batch is None:
+            self.first_batch = time.time() - self.start
+
+    def watch(self, loader):
+        return _FirstBatch(loader, self)
+
+    def report(self):
+        steps = ', '.join('{} {:.2f}s'.format(name, t) for name, t in sorted(self.done.items(), key=lambda x: x[1]))
+        first = 'not yet' if self.first_batch is None else '{:.2f}s'.format(self.first_batch)
+        return 'startup: {}; time to first batch {}'.format(steps, first)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False)
+
+
+class _FirstBatch():
+    # loader wrapper telling the Startup when the first batch comes out, len/dataset pass through
+    def __init__(self, loader, startup):
+        self.loader = loader
+        self.startup = startup
+
+    def __len__(self):
+        return len(self.loader)
+
+    def __getattr__(self, name):
+        return getattr(self.__dict__['loader'], name)
+
+    def __iter__(self):
+        for batch in self.loader:
+            self.startup.mark_first_batch()
+            yield batch
+
+
 class LabelSmoothing(nn.Module):
     """NLL loss with label smoothing.
     """
@@ -185,6 +343,20 @@ def init_seed(x):
     torch.backends.cudnn.benchmark = False
 
 
+def sample_rng(seed, epoch, index):
+    # the numpy stream of one sample in one epoch, the same draws whichever worker (and however
+    # many of them) loads it
+    return np.random.default_rng([seed, epoch, int(index)])
+
+
+def as_rng(rng=None):
+    # augmentations draw from rng; without one, from a generator seeded off the global numpy
+    # state (init_seed / worker_init_fn), as before
+    if rng is None:
+        return np.random.default_rng(np.random.randint(2 ** 31))
+    return rng
+
+
 class GradualWarmupScheduler():
     """ Gradually warm-up(increasing) learning rate in optimizer.
     Args:
@@ -238,13 +410,14 @@ class GradualWarmupScheduler():
                 param_group['lr'] = lr
 
 
-def random_sample_np(data_numpy, size):
+def random_sample_np(data_numpy, size, rng=None):
     # C, T, V, M = data_numpy.shape
     T, V, C = data_numpy.shape
     if T == size:
         return data_numpy
+    rng = as_rng(rng)
     interval = int(np.ceil(size / T))
-    random_list = sorted(random.sample(list(range(T))*interval, size))
+    random_list = sorted(rng.choice(list(range(T))*interval, size, replace=False))
     return data_numpy[random_list, ...]
 
 
@@ -258,7 +431,7 @@ def uniform_sample_np(data_numpy, size):
     return data_numpy[uniform_list, ...]
 
 
-def random_choose_simple(data_numpy, size, center=False):
+def random_choose_simple(data_numpy, size, center=False, rng=None):
     # input: C,T,V,M 随机选择其中一段，不是很合理。因为有0
     T, V, C = data_numpy.shape
     if size < 0:
@@ -271,5 +444,38 @@ def random_choose_simple(data_numpy, size, center=False):
         if center:
             begin = (T - size) // 2
         else:
-            begin = random.randint(0, T - size)
+            begin = as_rng(rng).integers(0, T - size + 1)
         return data_numpy[begin:begin + size, :, :]
+
+
+def window_sequence(data_numpy, frame_l, window_size=None, random_choose=False, center_choose=False, rng=None):
+    '''
+    the windowing every dataset shares: T, V, C sequence -> frame_l frames
+    :param window_size: None - zoom the whole sequence to frame_l, like Sdata_generator
+                        otherwise resample to window_size frames (uniform, or random with
+                        random_choose) and take frame_l of them (a random crop, or the center
+                        with center_choose), like SHREC_loader
+    '''
+    if window_size is None:
+        return zoom_batch([data_numpy], target_l=frame_l)[0]
+    if random_choose:
+        data_numpy = random_sample_np(data_numpy, window_size, rng=rng)
+    else:
+        data_numpy = uniform_sample_np(data_numpy, window_size)
+    return random_choose_simple(data_numpy, frame_l, center=center_choose, rng=rng)
+
+
+if __name__ == '__main__':
+    # medfilt3 / zoom_batch have to match medfilt / the per sequence zoom
+    rng = np.random.default_rng(0)
+    seqs = [rng.standard_normal((rng.integers(10, 180), 22, 3)) for _ in range(32)]
+    for p in seqs[:4]:
+        np.testing.assert_allclose(medfilt3(p, axis=0)[:, 3, 1], medfilt(p[:, 3, 1], 3))
+    expected = np.stack([zoom(p, target_l=64, joints_num=22, joints_dim=3) for p in seqs])
+    np.testing.assert_allclose(zoom_batch(seqs, target_l=64), expected, rtol=1e-7, atol=1e-9)
+    # same-length input array, float32 into a preallocated output
+    same = rng.standard_normal((32, 50, 22, 3)).astype(np.float32)
+    out = zoom_batch(same, target_l=64, out=np.empty((32, 64, 22, 3), dtype=np.float32))
+    expected = np.stack([zoom(p, target_l=64, joints_num=22, joints_dim=3) for p in same])
+    np.testing.assert_allclose(out, expected, rtol=1e-5, atol=1e-5)
+    print('medfilt3 / zoom_batch match medfilt / zoom')